@@ -0,0 +1,266 @@
+'''
+Allan deviation of gyro and accel data, and fitting of the noise terms.
+The overlapping estimator is evaluated on octave-spaced cluster sizes m from cumulative
+sums, O(n) per cluster size:
+    avar(tau) = sum((S[k+2m] - 2*S[k+m] + S[k])**2) / (2 * m**2 * (n-2m)),   tau = m / rate
+where S is the cumulative sum of the samples.
+allan_stream computes the same estimates block by block with bounded memory, for example
+during a 24-hour capture.
+'''
+import os
+import sys
+import numpy as np
+import columnar
+import log_loader
+
+# sqrt(2*ln(2)/pi), Allan deviation at the flat bottom divided by bias instability
+BI_FACTOR = 0.664
+
+def octave_sizes(max_m, min_m=1):
+    '''
+    Cluster sizes 1, 2, 4, ... up to max_m.
+    '''
+    m = []
+    i = 1
+    while i <= max_m:
+        if i >= min_m:
+            m.append(i)
+        i *= 2
+    return np.array(m, dtype=np.int64)
+
+def adev(x, rate, m=None):
+    '''
+    Overlapping Allan deviation.
+    Args:
+        x: (n,) or (n, k) array of samples, for example gyro rate in deg/s.
+        rate: sample rate, Hz.
+        m: cluster sizes, None for octave sizes up to n/3.
+    Returns:
+        taus: (n_tau,) cluster times, s.
+        adev: (n_tau, k) Allan deviation, same unit as x.
+        counts: (n_tau,) number of terms of each estimate.
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    if x.ndim == 1:
+        x = x[:, None]
+    n = x.shape[0]
+    if m is None:
+        m = octave_sizes(n // 3)
+    # removing the mean does not change the result, but keeps the sums small
+    s = np.zeros((n+1, x.shape[1]))
+    np.cumsum(x - x.mean(axis=0), axis=0, out=s[1:])
+    taus = []
+    out = []
+    counts = []
+    for mi in m:
+        if 2 * mi > n:
+            break
+        d = s[2*mi:] - 2.0 * s[mi:n+1-mi] + s[:n+1-2*mi]
+        taus.append(mi / rate)
+        out.append(np.sqrt((d * d).sum(axis=0) / (2.0 * mi * mi * d.shape[0])))
+        counts.append(d.shape[0])
+    return np.array(taus), np.array(out).reshape(-1, x.shape[1]), np.array(counts)
+
+class _stage:
+    '''
+    Overlapping estimates of one decimation stage of allan_stream.
+    '''
+    def __init__(self, m, n_values, offset):
+        self.m = m
+        self.max_m = int(m[-1])
+        self.offset = offset
+        self.tail = np.zeros((1, n_values))      # latest 2*max_m+1 cumulative sums
+        self.sums = np.zeros((m.size, n_values))
+        self.counts = np.zeros((m.size,), dtype=np.int64)
+        self.pending = np.zeros((0, n_values))   # samples not yet averaged for the next stage
+
+    def update(self, x):
+        n_tail = self.tail.shape[0]
+        c = np.empty((n_tail + x.shape[0], x.shape[1]))
+        c[:n_tail] = self.tail
+        np.cumsum(x - self.offset, axis=0, out=c[n_tail:])
+        c[n_tail:] += self.tail[-1]
+        n = c.shape[0]
+        for i, mi in enumerate(self.m):
+            # only the terms that end in the new data
+            e0 = max(n_tail, 2 * mi)
+            if e0 >= n:
+                continue
+            d = c[e0:] - 2.0 * c[e0-mi:n-mi] + c[e0-2*mi:n-2*mi]
+            self.sums[i] += (d * d).sum(axis=0)
+            self.counts[i] += d.shape[0]
+        keep = min(n, 2 * self.max_m + 1)
+        self.tail = c[n-keep:] - c[n-keep]
+
+    def decimate(self, x, size):
+        '''
+        Averages of non-overlapping clusters of size samples, for the next stage.
+        '''
+        x = np.vstack((self.pending, x)) if self.pending.shape[0] else x
+        n = (x.shape[0] // size) * size
+        self.pending = x[n:].copy()
+        if n == 0:
+            return None
+        return x[:n].reshape(-1, size, x.shape[1]).mean(axis=1)
+
+class allan_stream:
+    '''
+    Streaming overlapping Allan deviation with bounded memory.
+    Cluster sizes up to max_m are estimated on the samples. The samples are also averaged
+    in clusters of max_m into a second stage, which estimates cluster sizes 2*max_m to
+    max_m**2, and so on for n_stages stages. Memory is about 3*max_m*n_values floats per stage.
+    '''
+    def __init__(self, rate, n_values=1, max_m=1024, n_stages=3):
+        '''
+        Args:
+            rate: sample rate, Hz.
+            n_values: number of values per sample, for example 6 for accel and gyro.
+            max_m: largest cluster size of each stage, a power of 2.
+            n_stages: number of decimation stages.
+        '''
+        self.rate = rate
+        self.n_values = n_values
+        self.max_m = max_m
+        self.n_stages = n_stages
+        self.stages = []
+        self.samples = 0
+
+    def update(self, x):
+        '''
+        Add a block of samples.
+        Args:
+            x: (n, n_values) array, or (n_values,) for one sample. Blocks of many samples
+                are much faster than single samples.
+        '''
+        x = np.asarray(x, dtype=np.float64).reshape(-1, self.n_values)
+        if x.shape[0] == 0:
+            return
+        self.samples += x.shape[0]
+        for k in range(self.n_stages):
+            if k == len(self.stages):
+                # the first sample is the offset subtracted from the cumulative sums
+                m = octave_sizes(self.max_m, 1 if k == 0 else 2)
+                self.stages.append(_stage(m, self.n_values, x[0].copy()))
+            stage = self.stages[k]
+            stage.update(x)
+            if k == self.n_stages - 1:
+                break
+            x = stage.decimate(x, self.max_m)
+            if x is None:
+                break
+
+    def result(self, min_count=1):
+        '''
+        Returns:
+            taus, adev, counts as adev(). Estimates of fewer than min_count terms are left out.
+        '''
+        taus = []
+        out = []
+        counts = []
+        for k, stage in enumerate(self.stages):
+            scale = float(self.max_m) ** k
+            for i, mi in enumerate(stage.m):
+                if stage.counts[i] < min_count:
+                    continue
+                taus.append(mi * scale / self.rate)
+                out.append(np.sqrt(stage.sums[i] / (2.0 * mi * mi * stage.counts[i])))
+                counts.append(stage.counts[i])
+        return np.array(taus), np.array(out).reshape(-1, self.n_values), np.array(counts)
+
+def fit_noise(taus, adev):
+    '''
+    Fit the noise terms to an Allan deviation curve, each column independently.
+    Args:
+        taus: (n_tau,) cluster times, s.
+        adev: (n_tau, k) Allan deviation, unit u.
+    Returns:
+        dict of (k,) arrays, NaN where a term is not visible in the curve:
+            'arw': angle/velocity random walk, u*sqrt(s). Where the slope is -1/2,
+                adev = arw/sqrt(tau).
+            'bias_instability': u, minimum of the curve / 0.664.
+            'bi_tau': s, tau of the minimum.
+            'rrw': rate random walk, u/sqrt(s). Where the slope is +1/2,
+                adev = rrw*sqrt(tau/3).
+    '''
+    taus = np.asarray(taus, dtype=np.float64)
+    adev = np.asarray(adev, dtype=np.float64).reshape(taus.size, -1)
+    k = adev.shape[1]
+    result = {'arw': np.full((k,), np.nan), 'bias_instability': np.full((k,), np.nan),\
+              'bi_tau': np.full((k,), np.nan), 'rrw': np.full((k,), np.nan)}
+    if taus.size < 2:
+        return result
+    log_t = np.log(taus)
+    for j in range(k):
+        a = adev[:, j]
+        ok = a > 0
+        if np.count_nonzero(ok) < 2:
+            continue
+        t, a, lt = taus[ok], a[ok], log_t[ok]
+        slope = np.diff(np.log(a)) / np.diff(lt)
+        # both ends of a segment with slope about -1/2 or +1/2
+        seg = (slope > -0.75) & (slope < -0.25)
+        if seg.any():
+            idx = np.unique(np.hstack((np.nonzero(seg)[0], np.nonzero(seg)[0] + 1)))
+            result['arw'][j] = np.exp(np.mean(np.log(a[idx] * np.sqrt(t[idx]))))
+        seg = (slope > 0.25) & (slope < 0.75)
+        if seg.any():
+            idx = np.unique(np.hstack((np.nonzero(seg)[0], np.nonzero(seg)[0] + 1)))
+            result['rrw'][j] = np.exp(np.mean(np.log(a[idx] * np.sqrt(3.0 / t[idx]))))
+        i = int(np.argmin(a))
+        result['bias_instability'][j] = a[i] / BI_FACTOR
+        result['bi_tau'][j] = t[i]
+    return result
+
+def adev_table(path, names, rate, block=1000000, max_m=1024, n_stages=3):
+    '''
+    Allan deviation of columns of a columnar table (see columnar.py), read block by block
+    from the memory-mapped columns.
+    Args:
+        path: table directory.
+        names: column names, each (rows,) or (rows, width).
+        rate: sample rate, Hz.
+    Returns:
+        taus, adev, counts as adev(), columns in order of names.
+    '''
+    table = columnar.load_table(path)
+    cols = [table[i].reshape(table[i].shape[0], -1) for i in names]
+    n_values = sum(i.shape[1] for i in cols)
+    stream = allan_stream(rate, n_values, max_m, n_stages)
+    n = cols[0].shape[0]
+    for i in range(0, n, block):
+        stream.update(np.hstack([np.asarray(c[i:i+block], dtype=np.float64) for c in cols]))
+    return stream.result()
+
+def report(taus, adev, names=None):
+    '''
+    Text summary of the fitted noise terms.
+    '''
+    fit = fit_noise(taus, adev)
+    if names is None:
+        names = ['%u'% i for i in range(adev.shape[1])]
+    lines = ['%-10s %14s %14s %10s %14s'% ('', 'arw', 'bias inst', 'bi tau', 'rrw')]
+    for j, name in enumerate(names):
+        lines.append('%-10s %14.6g %14.6g %10.1f %14.6g'% (name, fit['arw'][j],\
+                     fit['bias_instability'][j], fit['bi_tau'][j], fit['rrw'][j]))
+    return '\n'.join(lines)
+
+if __name__ == "__main__":
+    # Allan deviation of a log.
+    #   python allan.py data_dir/1.csv 100             csv of log_for_mtlt_test.py
+    #   python allan.py session/s1 100 accel gyro      columnar table
+    file_name = sys.argv[1]
+    rate = float(sys.argv[2])
+    if os.path.isdir(file_name):
+        names = sys.argv[3:] if len(sys.argv) > 3 else ['accel', 'gyro']
+        taus, dev, counts = adev_table(file_name, names, rate)
+        names = ['%s[%u]'% (i, j) for i in names for j in range(3)][0:dev.shape[1]]
+    else:
+        # acc and gyro are columns 2 to 7 of the logs of log_for_mtlt_test.py and
+        #   log_for_freeintegration.py
+        data = log_loader.load(file_name, usecols=list(range(2, 8)))
+        taus, dev, counts = adev(data, rate)
+        names = ['ax', 'ay', 'az', 'wx', 'wy', 'wz']
+    np.set_printoptions(precision=6, linewidth=150)
+    for i in range(taus.size):
+        print('%12.3f %s'% (taus[i], dev[i]))
+    print(report(taus, dev, names))
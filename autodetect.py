@@ -0,0 +1,240 @@
+'''
+Detect the baud rate and the packet type of a unit, or the packet type of a raw capture.
+Bytes are sampled at each candidate baud rate and scanned for 5555 frames with a correct CRC
+(framing.frame_scanner). The type codes and sizes of the frames are matched against the
+packet_def of each device, and the baud rate and device with the most matched frames win.
+A wrong baud rate gives noise, where a frame with a correct CRC is very unlikely.
+    python autodetect.py                        all serial ports
+    python autodetect.py /dev/ttyUSB0 COM7      some ports
+    python autodetect.py log.bin                a raw capture
+'''
+import os
+import glob
+import time
+import argparse
+import framing
+import imu38x
+import rtk330l
+
+# most common first, sampling stops at the first one with enough frames
+bauds = [115200, 230400, 460800, 57600, 38400, 921600]
+devices = {'imu38x': imu38x.packet_def, 'rtk330l': rtk330l.packet_def}
+# seconds to sample at each baud rate, and for all bauds of a port
+dwell = 0.5
+budget = 5.0
+# a baud rate is accepted without trying the others with this many frames covering this
+#   fraction of the bytes
+min_frames = 5
+min_coverage = 0.8
+# bytes of a raw capture scanned
+file_bytes = 1024*1024
+
+def histogram(data):
+    '''
+    Frames with a correct CRC in data.
+    Returns:
+        (dict of (type code, frame size) -> number of frames, frame_scanner with the
+        statistics of the scan).
+    '''
+    scanner = framing.frame_scanner()
+    buf, frames = scanner.feed(data)
+    hist = {}
+    for offset, pos, packet_type, n, crc_ok in frames:
+        if crc_ok:
+            k = (packet_type, n + framing.overhead)
+            hist[k] = hist.get(k, 0) + 1
+    return hist, scanner
+
+def match(hist, n_bytes, names=None):
+    '''
+    Best device and packet type for a histogram of frames.
+    Args:
+        hist: see histogram().
+        n_bytes: bytes scanned.
+        names: devices to consider, None for all of devices.
+    Returns:
+        dict with device, packet_type (the most frequent type), frames (frames of the
+        device), coverage (fraction of the bytes in these frames), types (type -> frames of
+        the device) and unknown (frames of other types). device and packet_type are None
+        if no frame matches.
+    '''
+    best = {'device': None, 'packet_type': None, 'frames': 0, 'coverage': 0.0,\
+            'types': {}, 'unknown': sum(hist.values())}
+    for name in (names if names is not None else devices):
+        packet_def = devices[name]
+        types = {}
+        size = 0
+        for (packet_type, frame_size), n in hist.items():
+            if packet_type in packet_def and packet_def[packet_type][0] == frame_size:
+                types[packet_type] = n
+                size += n * frame_size
+        frames = sum(types.values())
+        if frames > best['frames']:
+            best = {'device': name,\
+                    'packet_type': max(types, key=types.get),\
+                    'frames': frames,\
+                    'coverage': size / float(n_bytes) if n_bytes else 0.0,\
+                    'types': types,\
+                    'unknown': sum(hist.values()) - frames}
+    return best
+
+def detect_data(data, names=None):
+    hist, scanner = histogram(data)
+    result = match(hist, len(data), names)
+    result['crc_fail'] = scanner.crc_fail
+    result['bytes'] = len(data)
+    return result
+
+def detect_file(file_name, names=None, max_bytes=None):
+    '''
+    Packet type of a raw capture, from its first max_bytes bytes.
+    Returns:
+        see match(), baud is None.
+    '''
+    f = open(file_name, 'rb')
+    data = f.read(max_bytes if max_bytes is not None else file_bytes)
+    f.close()
+    result = detect_data(data, names)
+    result['port'] = file_name
+    result['baud'] = None
+    return result
+
+def sample(port, baud, seconds):
+    '''
+    Bytes received from a port in seconds at a baud rate.
+    '''
+    import serial
+    ser = serial.Serial(port, baud, timeout=0.05)
+    try:
+        ser.reset_input_buffer()
+        data = bytearray()
+        tend = time.time() + seconds
+        while time.time() < tend:
+            data += ser.read(max(ser.in_waiting, 1))
+    finally:
+        ser.close()
+    return bytes(data)
+
+def detect_port(port, names=None, candidates=None, time_budget=None, seconds=None):
+    '''
+    Baud rate and packet type of the unit on a serial port.
+    Args:
+        names: devices to consider, None for all of devices.
+        candidates: baud rates to try in order, None for bauds.
+        time_budget: stop trying baud rates after this many seconds, None for budget.
+        seconds: sampling time at each baud rate, None for dwell.
+    Returns:
+        see match(), with the port and baud. device and baud are None if nothing was found.
+    '''
+    candidates = candidates if candidates is not None else bauds
+    time_budget = time_budget if time_budget is not None else budget
+    seconds = seconds if seconds is not None else dwell
+    tend = time.time() + time_budget
+    best = None
+    for baud in candidates:
+        remaining = tend - time.time()
+        if remaining <= 0:
+            break
+        try:
+            data = sample(port, baud, min(seconds, remaining))
+        except ValueError as e:
+            # baud rate not supported
+            print('%s at %u: %s'% (port, baud, e))
+            continue
+        except OSError as e:
+            # busy or missing
+            print('%s: %s'% (port, e))
+            break
+        result = detect_data(data, names)
+        result['baud'] = baud
+        if best is None or result['frames'] > best['frames']:
+            best = result
+        if result['frames'] >= min_frames and result['coverage'] >= min_coverage:
+            break
+    if best is None or best['device'] is None:
+        best = match({}, 0)
+        best['baud'] = None
+    best['port'] = port
+    return best
+
+def serial_ports():
+    '''
+    Serial ports of the host: pyserial's list, and /dev/ttyUSB*, /dev/ttyACM* on Linux.
+    '''
+    ports = []
+    try:
+        import serial.tools.list_ports
+        ports = [i.device for i in serial.tools.list_ports.comports()]
+    except ImportError:
+        pass
+    for pattern in ('/dev/ttyUSB*', '/dev/ttyACM*'):
+        for i in sorted(glob.glob(pattern)):
+            if i not in ports:
+                ports.append(i)
+    return ports
+
+def detect_ports(ports=None, names=None, time_budget=None):
+    '''
+    Units on serial ports, each port within time_budget seconds.
+    Returns:
+        list of the results of detect_port() of the ports with a unit.
+    '''
+    found = []
+    for port in (ports if ports is not None else serial_ports()):
+        result = detect_port(port, names, time_budget=time_budget)
+        if result['device'] is not None:
+            found.append(result)
+    return found
+
+def configure(unit):
+    '''
+    Fill 'baud' and 'packet_type' set to 'auto' in the config dict of a unit, as used by the
+    loggers: {'port':..., 'baud':..., 'packet_type':..., 'unit_type':...}.
+    Returns:
+        True if the unit was found or nothing was to detect.
+    '''
+    if unit.get('baud') != 'auto' and unit.get('packet_type') != 'auto':
+        return True
+    names = [unit['unit_type']] if unit.get('unit_type') in devices else None
+    candidates = [unit['baud']] if unit.get('baud') != 'auto' else None
+    result = detect_port(unit['port'], names, candidates)
+    if result['device'] is None:
+        print('No unit found on %s'% unit['port'])
+        return False
+    if unit.get('baud') == 'auto':
+        unit['baud'] = result['baud']
+    if unit.get('packet_type') == 'auto':
+        unit['packet_type'] = result['packet_type']
+    print('%s: %s at %u, %s packets'% (unit['port'], result['device'], unit['baud'],\
+                                       unit['packet_type']))
+    return True
+
+def summary(result):
+    if result['device'] is None:
+        return '%s: nothing found'% result['port']
+    types = ', '.join('%s %u'% (i, result['types'][i]) for i in sorted(result['types']))
+    return '%s: %s%s, %s packets (%s), %.0f%% of bytes in frames'% (\
+            result['port'], result['device'],\
+            ' at %u'% result['baud'] if result['baud'] is not None else '',\
+            result['packet_type'], types, 100.0 * result['coverage'])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Detect baud rate and packet type of units.')
+    parser.add_argument('sources', nargs='*', help='serial ports or raw captures, none for all ports')
+    parser.add_argument('-d', '--device', action='append', default=None, choices=sorted(devices),\
+                        help='device to consider, repeat for more than one')
+    parser.add_argument('-b', '--bauds', type=int, nargs='+', default=None)
+    parser.add_argument('-t', '--budget', type=float, default=None, help='seconds per port')
+    args = parser.parse_args(argv)
+    tstart = time.time()
+    sources = args.sources if args.sources else serial_ports()
+    for i in sources:
+        if os.path.isfile(i):
+            result = detect_file(i, args.device)
+        else:
+            result = detect_port(i, args.device, args.bauds, args.budget)
+        print(summary(result))
+    print('%u sources in %.1f s'% (len(sources), time.time() - tstart))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+'''
+Offline benchmarks of the decode, transport and write paths.
+    decode      driver parse_new_data, parse_* methods and vectorized decoding, per packet
+                type, on synthetic frames (serial_emulator) and on recorded captures
+    crc         CRC engines of the drivers and of framing.py
+    resync      driver and frame_scanner throughput at several corruption rates
+    ipc         Pipe transport of decoded packets between processes
+    logging     end-to-end latency from a byte arriving on an emulated port to the logger
+                process receiving the decoded packet, several units at once
+    writer      row by row csv, block csv, columnar table and raw writes
+Results are a flat dict of metric name -> value, saved as JSON with the run environment.
+Names ending in _per_s are throughputs (higher is better), names ending in _ms or _us are
+latencies (lower is better).
+    python benchmark.py run -o before.json
+    python benchmark.py run -o after.json --corpus capture.bin:imu38x:e2
+    python benchmark.py compare before.json after.json
+'''
+import os
+import sys
+import time
+import json
+import platform
+import argparse
+import tempfile
+import multiprocessing
+import numpy as np
+import framing
+import packet_decoder
+import link_metrics
+import columnar
+import imu38x
+import rtk330l
+import openimu
+import ins1000
+import serial_emulator
+import post_proccess_for_ins_test
+
+drivers = {'imu38x': imu38x.imu38x, 'rtk330l': rtk330l.rtk330l}
+# throughputs that dropped more than this fraction, or latencies that grew more, are regressions
+threshold = 0.10
+
+def timed(func, min_time=0.2, *args):
+    '''
+    Run func repeatedly for at least min_time.
+    Returns:
+        (seconds per call, result of the last call)
+    '''
+    n = 0
+    tstart = time.perf_counter()
+    while True:
+        result = func(*args)
+        n += 1
+        elapsed = time.perf_counter() - tstart
+        if elapsed >= min_time:
+            return elapsed / n, result
+
+def corpus(device, packet_type, n, impair=None, seed=0):
+    '''
+    n synthesized frames of one type as bytes.
+    '''
+    rates = {packet_type: 100.0}
+    source = serial_emulator.synth_source(device, rates, n / 100.0, impair, seed)
+    return b''.join(data for t, data in source)
+
+def new_driver(device, packet_type, file_name):
+    '''
+    A driver reading a data file, used to call parse_new_data() directly.
+    '''
+    unit = drivers[device](file_name, 0, packet_type)
+    unit.ser.close()
+    return unit
+
+def driver_decode(device, packet_type, data, file_name):
+    '''
+    Returns:
+        (seconds, frames decoded, driver metrics) of one parse_new_data() over data.
+    '''
+    unit = new_driver(device, packet_type, file_name)
+    t0 = time.perf_counter()
+    unit.parse_new_data(data)
+    return time.perf_counter() - t0, unit.metrics.frames_ok, unit.metrics
+
+def bench_decode(results, n_frames, recorded=()):
+    '''
+    Args:
+        recorded: list of (capture file, device, packet type).
+    '''
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    tmp.close()
+    for device in drivers:
+        for packet_type in sorted(serial_emulator.devices[device]):
+            data = corpus(device, packet_type, n_frames)
+            key = 'decode/%s/%s/'% (device, packet_type)
+            try:
+                elapsed, n, metrics = driver_decode(device, packet_type, data, tmp.name)
+            except Exception as e:
+                print('%s: %s'% (key, e))
+                continue
+            results[key + 'driver_bytes_per_s'] = len(data) / elapsed
+            results[key + 'driver_packets_per_s'] = n / elapsed
+            # parse_* of the payloads alone
+            unit = new_driver(device, packet_type, tmp.name)
+            size = serial_emulator.devices[device][packet_type][0]
+            payloads = [data[i+2:i+size-2] for i in range(0, len(data), size)]
+            def parse_all():
+                for p in payloads:
+                    unit.parse_packet(p)
+            dt, r = timed(parse_all, 0.2)
+            results[key + 'parse_packets_per_s'] = len(payloads) / dt
+            # vectorized path
+            if packet_type in packet_decoder.schema.get(device, {}):
+                decoder = packet_decoder.packet_decoder(packet_type, device)
+                def vectorized():
+                    scanner = framing.frame_scanner([packet_type])
+                    buf, frames = scanner.feed(data)
+                    pos = [i[1] for i in frames if i[4]]
+                    return decoder.decode_array(packet_decoder.payload_matrix(buf, pos, decoder.size))
+                dt, r = timed(vectorized, 0.2)
+                results[key + 'vectorized_packets_per_s'] = len(payloads) / dt
+    for file_name, device, packet_type in recorded:
+        f = open(file_name, 'rb')
+        data = f.read()
+        f.close()
+        key = 'recorded/%s/%s/'% (os.path.basename(file_name), packet_type)
+        elapsed, n, metrics = driver_decode(device, packet_type, data, tmp.name)
+        results[key + 'driver_bytes_per_s'] = len(data) / elapsed
+        results[key + 'driver_packets_per_s'] = n / elapsed
+        results[key + 'frames'] = n
+        results[key + 'crc_fail'] = metrics.crc_fail
+        results[key + 'resync'] = metrics.resync
+    os.remove(tmp.name)
+
+def bench_crc(results):
+    big = np.random.RandomState(0).randint(0, 256, 1 << 20).astype(np.uint8).tobytes()
+    # the byte by byte engines are slow, a smaller block for them
+    small = big[:1 << 12]
+    engines = [('framing', framing.calc_crc, big),\
+               ('imu38x', lambda p: imu38x.imu38x.calc_crc(None, p), small),\
+               ('rtk330l', lambda p: rtk330l.rtk330l.calc_crc(None, p), small),\
+               ('openimu', openimu.calc_crc, small),\
+               ('ins1000', ins1000.calc_crc, small)]
+    for name, func, data in engines:
+        dt, r = timed(func, 0.2, data)
+        results['crc/%s/bytes_per_s'% name] = len(data) / dt
+    # a frame of a typical size, per call overhead included
+    frame = big[:60]
+    dt, r = timed(lambda: [framing.calc_crc(frame) for i in range(1000)], 0.2)
+    results['crc/framing/frames_per_s'] = 1000 / dt
+
+def bench_resync(results, n_frames, rates=(0.0, 0.001, 0.01, 0.1)):
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    tmp.close()
+    for rate in rates:
+        impair = serial_emulator.impairments(rate, rate, rate, rate, seed=1)
+        data = corpus('imu38x', 'e2', n_frames, impair)
+        key = 'resync/%g/'% rate
+        elapsed, n, metrics = driver_decode('imu38x', 'e2', data, tmp.name)
+        results[key + 'driver_bytes_per_s'] = len(data) / elapsed
+        results[key + 'frames_ok_fraction'] = n / float(n_frames)
+        results[key + 'resync'] = metrics.resync
+        def scan():
+            scanner = framing.frame_scanner(imu38x.packet_def.keys())
+            scanner.feed(data)
+            return scanner
+        dt, scanner = timed(scan, 0.2)
+        results[key + 'scanner_bytes_per_s'] = len(data) / dt
+    os.remove(tmp.name)
+
+def ipc_sender(conn, n, msg):
+    for i in range(n):
+        conn.send(msg)
+    conn.send('exit')
+
+def bench_ipc(results, n_msgs):
+    ctx = multiprocessing.get_context('fork')
+    payload = corpus('imu38x', 'e2', 1)[5:-2]
+    msg = imu38x.parser_output['e2'](imu38x.decoders['e2'].decode(payload))
+    parent, child = ctx.Pipe(duplex=False)
+    p = ctx.Process(target=ipc_sender, args=(child, n_msgs, msg))
+    tstart = time.perf_counter()
+    p.start()
+    n = 0
+    while parent.recv() != 'exit':
+        n += 1
+    elapsed = time.perf_counter() - tstart
+    p.join()
+    results['ipc/pipe/e2_msgs_per_s'] = n / elapsed
+
+def logging_unit(port, baud, packet_type, conn):
+    unit = imu38x.imu38x(port, baud, packet_type, pipe=conn)
+    unit.start()
+
+def bench_logging(results, n_units=3, rate=100.0, duration=3.0, baud=230400):
+    '''
+    Units on emulated ports in real time, each decoded in its own process as by the
+    loggers. The arrival time of each frame on its port is known from the deterministic
+    source and the common t0, so the latency of every received packet is measured.
+    '''
+    ctx = multiprocessing.get_context('fork')
+    import unit_mux
+    t0 = time.perf_counter() + 0.5
+    sources = {}
+    for u in range(n_units):
+        sources['EMU%u'% u] = lambda u=u: serial_emulator.synth_source('imu38x', {'e2': rate},\
+                                                                      duration, seed=u)
+    original = serial_emulator.patch_serial(sources, True, t0)
+    mux = unit_mux.unit_mux(0.1, duration + 1.0, verbose=False)
+    procs = []
+    arrivals = {}
+    for port in sources:
+        arrivals[port] = [t for t, data in serial_emulator.paced(sources[port](), baud)]
+        parent, child = ctx.Pipe(duplex=False)
+        p = ctx.Process(target=logging_unit, args=(port, baud, 'e2', child))
+        p.daemon = True
+        p.start()
+        procs.append(p)
+        mux.add(port, parent)
+    import serial
+    serial.Serial = original
+    hist = link_metrics.latency_histogram()
+    received = dict((i, 0) for i in sources)
+    while time.perf_counter() < t0 + duration + 0.5:
+        for port, msg in mux.recv(0.1):
+            tnow = time.perf_counter()
+            k = received[port]
+            if k < len(arrivals[port]):
+                hist.add(max(tnow - (t0 + arrivals[port][k]), 0.0))
+            received[port] += 1
+    for p in procs:
+        p.terminate()
+        p.join()
+    s = hist.snapshot()
+    key = 'logging/%u_units/'% n_units
+    results[key + 'mean_ms'] = s['mean_us'] / 1000.0
+    results[key + 'p50_ms'] = s['p50_us'] / 1000.0
+    results[key + 'p99_ms'] = s['p99_us'] / 1000.0
+    results[key + 'max_ms'] = s['max_us'] / 1000.0
+    expected = sum(len(i) for i in arrivals.values())
+    results[key + 'received_fraction'] = sum(received.values()) / float(expected)
+
+def bench_writer(results, n_rows):
+    tmp_dir = tempfile.mkdtemp()
+    data = np.random.RandomState(0).randn(n_rows, 33)
+    # one formatted line per sample, as the loggers write
+    fmt = ', '.join(['%.9f'] * 33) + '\n'
+    rows = [tuple(i) for i in data.tolist()]
+    def csv_rows():
+        f = open(os.path.join(tmp_dir, 'rows.csv'), 'w')
+        for r in rows:
+            f.write(fmt % r)
+        f.close()
+    dt, r = timed(csv_rows, 0.2)
+    results['writer/csv_rows/rows_per_s'] = n_rows / dt
+    def csv_block():
+        f = open(os.path.join(tmp_dir, 'block.csv'), 'w')
+        for i in range(0, n_rows, 1000):
+            f.write(post_proccess_for_ins_test.format_rows(data[i:i+1000]))
+        f.close()
+    dt, r = timed(csv_block, 0.2)
+    results['writer/csv_block/rows_per_s'] = n_rows / dt
+    decoder = imu38x.decoders['e2']
+    payload = corpus('imu38x', 'e2', 1)[5:-2]
+    def table():
+        w = columnar.table_writer(os.path.join(tmp_dir, 'e2'), decoder, 1e9, 10000)
+        for i in range(n_rows):
+            w.add(payload, 0.0, i)
+        w.close()
+    dt, r = timed(table, 0.2)
+    results['writer/columnar/rows_per_s'] = n_rows / dt
+    raw = corpus('imu38x', 'e2', 1000)
+    def raw_write():
+        f = open(os.path.join(tmp_dir, 'raw.bin'), 'wb')
+        for i in range(0, len(raw), 130):
+            f.write(raw[i:i+130])
+        f.close()
+    dt, r = timed(raw_write, 0.2)
+    results['writer/raw_frames/bytes_per_s'] = len(raw) / dt
+    for i in os.listdir(tmp_dir):
+        p = os.path.join(tmp_dir, i)
+        if os.path.isdir(p):
+            for j in os.listdir(p):
+                os.remove(os.path.join(p, j))
+            os.rmdir(p)
+        else:
+            os.remove(p)
+    os.rmdir(tmp_dir)
+
+def environment():
+    commit = None
+    try:
+        import subprocess
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],\
+                                         cwd=os.path.dirname(os.path.abspath(__file__)),\
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        pass
+    return {'time': time.strftime('%Y-%m-%d %H:%M:%S'),\
+            'python': platform.python_version(),\
+            'numpy': np.__version__,\
+            'platform': platform.platform(),\
+            'cpus': os.cpu_count(),\
+            'commit': commit}
+
+def run(suites, quick=False, recorded=()):
+    n = 2000 if quick else 20000
+    results = {}
+    for name in suites:
+        tstart = time.time()
+        if name == 'decode':
+            bench_decode(results, n, recorded)
+        elif name == 'crc':
+            bench_crc(results)
+        elif name == 'resync':
+            bench_resync(results, n)
+        elif name == 'ipc':
+            bench_ipc(results, n * 5)
+        elif name == 'logging':
+            bench_logging(results, 3, 100.0, 2.0 if quick else 5.0)
+        elif name == 'writer':
+            bench_writer(results, n)
+        print('%s: %.1f s'% (name, time.time() - tstart))
+    return results
+
+def compare(old, new, limit=None):
+    '''
+    Compare two result files.
+    Returns:
+        list of (name, old value, new value, ratio, regression).
+    '''
+    if limit is None:
+        limit = threshold
+    out = []
+    for name in sorted(set(old) & set(new)):
+        a, b = old[name], new[name]
+        ratio = b / a if a else float('nan')
+        regression = False
+        if name.endswith('_per_s'):
+            regression = ratio < 1.0 - limit
+        elif name.endswith('_ms') or name.endswith('_us'):
+            regression = ratio > 1.0 + limit
+        out.append((name, a, b, ratio, regression))
+    return out
+
+all_suites = ['decode', 'crc', 'resync', 'ipc', 'logging', 'writer']
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of decode, transport and write paths.')
+    sub = parser.add_subparsers(dest='command')
+    p = sub.add_parser('run')
+    p.add_argument('-o', '--output', default='benchmark.json')
+    p.add_argument('-s', '--suites', nargs='+', default=all_suites, choices=all_suites)
+    p.add_argument('--quick', action='store_true', help='smaller corpora')
+    p.add_argument('--corpus', nargs='+', default=[],\
+                   help='recorded captures as file:device:type, for example log.bin:imu38x:e2')
+    p = sub.add_parser('compare')
+    p.add_argument('old')
+    p.add_argument('new')
+    p.add_argument('-t', '--threshold', type=float, default=threshold)
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        recorded = [tuple(i.rsplit(':', 2)) for i in args.corpus]
+        results = run(args.suites, args.quick, recorded)
+        json.dump({'environment': environment(), 'results': results},\
+                  open(args.output, 'w'), indent=1, sort_keys=True)
+        for name in sorted(results):
+            print('%-60s %14.6g'% (name, results[name]))
+        print('saved to %s'% args.output)
+    elif args.command == 'compare':
+        old = json.load(open(args.old))['results']
+        new = json.load(open(args.new))['results']
+        rows = compare(old, new, args.threshold)
+        n = 0
+        for name, a, b, ratio, regression in rows:
+            n += regression
+            print('%-60s %14.6g %14.6g %8.3f%s'% (name, a, b, ratio, '  REGRESSION' if regression else ''))
+        print('%u regressions'% n)
+        sys.exit(1 if n else 0)
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
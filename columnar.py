@@ -0,0 +1,176 @@
+'''
+Columnar storage of decoded packets.
+A table is a directory with one raw binary file per column (<name>.bin, native byte order)
+and a header file listing the columns. Rows are appended in batches, so a table can be
+read while it is still being written, and it is read back with np.memmap without parsing.
+Every table has two extra columns shared by all tables of a session:
+    host_time   host time when the packet was received, s
+    seq         index of the packet in the session stream, over all packet types
+'''
+import os
+import time
+import numpy as np
+
+header_file = 'columns.txt'
+
+def write_header(path, columns):
+    '''
+    Args:
+        path: table directory.
+        columns: list of (name, numpy dtype, width). width 1 for a scalar column.
+    '''
+    f = open(os.path.join(path, header_file), 'w')
+    for name, dtype, width in columns:
+        f.write('%s %s %u\n'% (name, np.dtype(dtype).str, width))
+    f.close()
+
+def read_header(path):
+    '''
+    Returns:
+        list of (name, numpy dtype, width)
+    '''
+    columns = []
+    f = open(os.path.join(path, header_file), 'r')
+    for line in f:
+        fields = line.split()
+        if len(fields) == 3:
+            columns.append((fields[0], np.dtype(fields[1]), int(fields[2])))
+    f.close()
+    return columns
+
+def write_table(path, arrays):
+    '''
+    Write a whole table at once.
+    Args:
+        path: table directory, created if it does not exist.
+        arrays: dict of column name -> array of shape (rows,) or (rows, width).
+    '''
+    if not os.path.exists(path):
+        os.makedirs(path)
+    columns = []
+    for name, v in arrays.items():
+        v = np.ascontiguousarray(v)
+        v.tofile(os.path.join(path, name + '.bin'))
+        columns.append((name, v.dtype, v.shape[1] if v.ndim > 1 else 1))
+    write_header(path, columns)
+
+class table_writer:
+    '''
+    Append packets of one type to a table.
+    Payloads are kept in memory and decoded with the vectorized path of a
+    packet_decoder.packet_decoder when the table is flushed.
+    '''
+    def __init__(self, path, decoder, flush_interval=1.0, flush_rows=10000):
+        '''
+        Args:
+            path: table directory, created if it does not exist. Existing columns are
+                truncated.
+            decoder: packet_decoder.packet_decoder of the packet type.
+            flush_interval: write buffered rows at least this often, seconds.
+            flush_rows: write buffered rows when there are this many.
+        '''
+        self.path = path
+        self.decoder = decoder
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        if not os.path.exists(path):
+            os.makedirs(path)
+        # decode an empty payload to get the type and width of each column
+        sample = decoder.decode_array(bytes(decoder.size))
+        self.columns = [('host_time', np.dtype(np.float64), 1), ('seq', np.dtype(np.uint64), 1)]
+        for name in decoder.names:
+            v = sample[name]
+            self.columns.append((name, v.dtype, v.shape[1] if v.ndim > 1 else 1))
+        write_header(path, self.columns)
+        self.files = {}
+        for name, dtype, width in self.columns:
+            self.files[name] = open(os.path.join(path, name + '.bin'), 'wb')
+        self.payloads = []
+        self.host_time = []
+        self.seq = []
+        self.rows = 0
+        self.flushes = 0
+        self.tflush = time.time()
+
+    def add(self, payload, host_time, seq):
+        '''
+        Add a packet.
+        Args:
+            payload: payload bytes.
+            host_time: host time when the packet was received, s.
+            seq: index of the packet in the session stream.
+        '''
+        self.payloads.append(payload)
+        self.host_time.append(host_time)
+        self.seq.append(seq)
+        if len(self.payloads) >= self.flush_rows or\
+           host_time - self.tflush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        '''
+        Decode buffered packets and append them to the column files.
+        '''
+        self.tflush = time.time()
+        if not self.payloads:
+            return
+        arrays = self.decoder.decode_array(b''.join(self.payloads))
+        arrays['host_time'] = np.array(self.host_time, dtype=np.float64)
+        arrays['seq'] = np.array(self.seq, dtype=np.uint64)
+        for name, dtype, width in self.columns:
+            f = self.files[name]
+            np.ascontiguousarray(arrays[name], dtype=dtype).tofile(f)
+            f.flush()
+        self.rows += len(self.payloads)
+        self.flushes += 1
+        self.payloads = []
+        self.host_time = []
+        self.seq = []
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+
+def load_table(path, mmap=True):
+    '''
+    Read a table.
+    Args:
+        path: table directory.
+        mmap: memory map the columns instead of reading them into memory.
+    Returns:
+        dict of column name -> array of shape (rows,) or (rows, width). Rows being
+        written at the end of a column are left out, so all columns have the same length.
+    '''
+    columns = read_header(path)
+    rows = None
+    for name, dtype, width in columns:
+        n = os.path.getsize(os.path.join(path, name + '.bin')) // (dtype.itemsize * width)
+        rows = n if rows is None else min(rows, n)
+    out = {}
+    for name, dtype, width in columns:
+        file_name = os.path.join(path, name + '.bin')
+        shape = (rows,) if width == 1 else (rows, width)
+        if rows == 0:
+            out[name] = np.zeros(shape, dtype=dtype)
+        elif mmap:
+            out[name] = np.memmap(file_name, dtype=dtype, mode='r', shape=shape)
+        else:
+            out[name] = np.fromfile(file_name, dtype=dtype, count=rows*width).reshape(shape)
+    return out
+
+def list_tables(session_dir):
+    '''
+    Returns:
+        names of the tables in a session directory.
+    '''
+    return sorted(i for i in os.listdir(session_dir)\
+                  if os.path.exists(os.path.join(session_dir, i, header_file)))
+
+def load_session(session_dir, mmap=True):
+    '''
+    Returns:
+        dict of table name -> table, see load_table().
+    '''
+    return dict((i, load_table(os.path.join(session_dir, i), mmap))\
+                for i in list_tables(session_dir))
@@ -0,0 +1,264 @@
+'''
+Compare the Euler angles of units logged side by side with each other and with a reference.
+For each pair: per-axis error time series with wrapped angle differences, statistics of
+the whole log, of static and dynamic segments, and of fixed time windows.
+Everything is vectorized, so a log of a million samples is processed in well under a second.
+'''
+import os
+import sys
+import time
+import numpy as np
+import log_loader
+
+# column layout of the logs
+#   time: column of the time interval between samples, s
+#   angles: name -> columns of roll, pitch and yaw, deg
+#   gyro: columns of the gyro used to find static segments, deg/s. None to use the angle
+#       rate of the first angle set instead.
+#   pairs: (unit, reference) to compare
+layouts = {
+    # log.txt of log_multiprocessing.py, no header
+    'multiprocessing': {'skip_header': 0,\
+                        'time': 0,\
+                        'angles': {'new': [1, 2, 3], 'old': [4, 5, 6], 'ref': [7, 8, 9]},\
+                        'gyro': [10, 11, 12],\
+                        'pairs': [('new', 'ref'), ('old', 'ref'), ('new', 'old')]},
+    # log.csv of log_for_vg_ahrs_test.py
+    'vg_ahrs': {'skip_header': 1,\
+                'time': 0,\
+                'angles': {'openimu': [8, 9, 10], 'imu381': [11, 12, 13]},\
+                'gyro': [5, 6, 7],\
+                'pairs': [('openimu', 'imu381')]},
+}
+axis_names = ['roll', 'pitch', 'yaw']
+percentiles = [50, 95, 99]
+
+def wrap_deg(x):
+    '''
+    Vectorized attitude.angle_range_pi in degrees: equivalent angles in (-180, 180].
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    return x - 360.0 * np.ceil((x - 180.0) * (1.0 / 360.0))
+
+def wrap_rad(x):
+    '''
+    Vectorized attitude.angle_range_pi: equivalent angles in (-pi, pi].
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    return x - 2.0 * np.pi * np.ceil((x - np.pi) * (0.5 / np.pi))
+
+def angle_error(angles, ref):
+    '''
+    Wrapped difference of two (n, 3) arrays of Euler angles, deg.
+    '''
+    return wrap_deg(np.asarray(angles) - np.asarray(ref))
+
+def load_log(file_name, skip_header=0):
+    '''
+    Load a comma separated log of numbers with log_loader.load.
+    Returns:
+        (rows, columns) array. An incomplete last row is dropped, empty fields are nan.
+    '''
+    return log_loader.load(file_name, skip_header=skip_header, delimiter=',')
+
+def abs_percentiles(err, q):
+    '''
+    np.percentile of abs(err) along axis 0 (linear interpolation). A contiguous copy is
+    partitioned once per percentile, from the highest down, each time only left of the
+    previous one: a partition with several kth at once costs several times more.
+    Returns:
+        (len(q), k) array.
+    '''
+    a = np.abs(err.T)
+    n = a.shape[1]
+    pos = np.asarray(q, dtype=np.float64) / 100.0 * (n - 1)
+    lo = np.floor(pos).astype(np.int64)
+    out = np.empty((len(q), a.shape[0]))
+    end = n
+    for i in np.argsort(-lo, kind='stable'):
+        k = lo[i]
+        if k < end:
+            a[:, :end].partition(k, axis=1)
+            stop = min(end + 1, n)
+            end = k
+        v = a[:, k]
+        # the next value is the smallest right of k, up to the one partitioned before
+        hi = a[:, k+1:stop].min(axis=1) if k + 1 < stop else v
+        out[i] = v + (hi - v) * (pos[i] - k)
+    return out
+
+def stats(err):
+    '''
+    Statistics of each column of err.
+    Returns:
+        dict of name -> (columns,) array. Empty input gives NaN.
+    '''
+    err = np.asarray(err)
+    err = err.reshape(err.shape[0], int(np.prod(err.shape[1:])) or 1)
+    out = {'n': np.full((err.shape[1],), err.shape[0])}
+    if err.shape[0] == 0:
+        for i in ['mean', 'std', 'rms', 'max'] + ['p%u'% p for p in percentiles]:
+            out[i] = np.full((err.shape[1],), np.nan)
+        return out
+    a = np.ascontiguousarray(err.T)
+    out['mean'] = a.mean(axis=1)
+    ms = np.einsum('ij,ij->i', a, a) / a.shape[1]
+    out['std'] = np.sqrt(np.maximum(ms - out['mean']**2, 0.0))
+    out['rms'] = np.sqrt(ms)
+    out['max'] = np.maximum(a.max(axis=1), -a.min(axis=1))
+    p = abs_percentiles(err, percentiles)
+    for i, pi in enumerate(percentiles):
+        out['p%u'% pi] = p[i]
+    return out
+
+def window_stats(t, err, window):
+    '''
+    RMS, 95th percentile and maximum of abs error of each column in time windows.
+    Args:
+        t: (n,) time, s, increasing.
+        err: (n, k) errors.
+        window: window length, s.
+    Returns:
+        start: (n_windows,) start time of each window, s.
+        n: (n_windows,) samples in each window.
+        rms, p95, max: (n_windows, k)
+    '''
+    idx = np.floor((t - t[0]) / window).astype(np.int64)
+    # first sample of each window
+    first = np.flatnonzero(np.r_[True, idx[1:] != idx[:-1]])
+    n = np.diff(np.r_[first, idx.size])
+    abs_err = np.abs(err)
+    rms = np.sqrt(np.add.reduceat(err * err, first, axis=0) / n[:, None])
+    mx = np.maximum.reduceat(abs_err, first, axis=0)
+    p95 = np.empty(rms.shape)
+    for i in range(first.size):
+        p95[i] = abs_percentiles(err[first[i]:first[i]+n[i]], [95])[0]
+    return t[first], n, rms, p95, mx
+
+def moving_mean(x, n):
+    '''
+    Centered moving mean of each column of x over n samples, from cumulative sums.
+    '''
+    n = max(int(n), 1)
+    c = np.zeros((x.shape[0]+1,) + x.shape[1:])
+    np.cumsum(x, axis=0, out=c[1:])
+    lo = np.clip(np.arange(x.shape[0]) - n // 2, 0, x.shape[0])
+    hi = np.clip(lo + n, 0, x.shape[0])
+    return (c[hi] - c[lo]) / (hi - lo).reshape((-1,) + (1,) * (x.ndim - 1))
+
+def static_mask(t, rate, threshold=1.0, window=1.0, min_duration=2.0):
+    '''
+    Find static segments.
+    Args:
+        t: (n,) time, s.
+        rate: (n, 3) angular rate, deg/s.
+        threshold: the unit is static when the norm of the smoothed rate is below it, deg/s.
+        window: smoothing window, s.
+        min_duration: static segments shorter than this are dynamic, s.
+    Returns:
+        (n,) bool array, True when static.
+    '''
+    if t.size < 2:
+        return np.zeros(t.shape, dtype=bool)
+    dt = np.median(np.diff(t))
+    n = window / dt if dt > 0 else 1
+    static = np.sqrt((moving_mean(rate, n)**2).sum(axis=1)) < threshold
+    # drop short static segments
+    edges = np.flatnonzero(np.diff(np.r_[0, static.astype(np.int8), 0]))
+    for start, end in zip(edges[0::2], edges[1::2]):
+        if t[end-1] - t[start] < min_duration:
+            static[start:end] = False
+    return static
+
+def compare(data, layout, window=60.0, static_threshold=1.0):
+    '''
+    Args:
+        data: (rows, columns) array of a log.
+        layout: entry of layouts.
+        window: length of the time windows, s.
+        static_threshold: angular rate threshold of static segments, deg/s.
+    Returns:
+        dict with 't', 'static' and for each pair 'unit-ref' a dict of:
+            'err': (n, 3) wrapped errors, deg.
+            'all', 'static', 'dynamic': stats().
+            'windows': window_stats().
+    '''
+    t = np.cumsum(data[:, layout['time']])
+    if layout['gyro'] is not None:
+        rate = data[:, layout['gyro']]
+    else:
+        first = data[:, list(layout['angles'].values())[0]]
+        rate = np.zeros(first.shape)
+        rate[1:] = wrap_deg(np.diff(first, axis=0)) / np.maximum(np.diff(t), 1e-6)[:, None]
+    static = static_mask(t, rate, static_threshold)
+    result = {'t': t, 'static': static}
+    # each angle set as a contiguous (3, n) array, errors are (n, 3) views of (3, n) arrays
+    #   so that the statistics of each axis run over contiguous memory
+    angles = dict((i, np.ascontiguousarray(data[:, j].T)) for i, j in layout['angles'].items())
+    for unit, ref in layout['pairs']:
+        err = angle_error(angles[unit], angles[ref]).T
+        result['%s-%s'% (unit, ref)] = {'err': err,\
+                                         'all': stats(err),\
+                                         'static': stats(err[static]),\
+                                         'dynamic': stats(err[~static]),\
+                                         'windows': window_stats(t, err, window)}
+    return result
+
+def write_summary(file_name, result):
+    '''
+    Write a compact summary: one line per pair, segment and axis.
+    '''
+    keys = ['n', 'mean', 'std', 'rms'] + ['p%u'% p for p in percentiles] + ['max']
+    f = open(file_name, 'w')
+    static = result['static']
+    f.write('# %u samples, %.1f s, %.1f%% static\n'% (static.size, result['t'][-1] - result['t'][0],\
+            100.0 * np.count_nonzero(static) / max(static.size, 1)))
+    f.write('pair,segment,axis,' + ','.join(keys) + '\n')
+    for name in result:
+        if name in ('t', 'static'):
+            continue
+        for segment in ('all', 'static', 'dynamic'):
+            s = result[name][segment]
+            for j, axis in enumerate(axis_names):
+                f.write('%s,%s,%s,%u,'% (name, segment, axis, s['n'][j]) +\
+                        ','.join('%.4f'% s[k][j] for k in keys[1:]) + '\n')
+    f.close()
+
+def write_windows(file_name, result):
+    '''
+    Write the window statistics: one line per pair and window.
+    '''
+    f = open(file_name, 'w')
+    f.write('pair,start (s),n,' + ','.join('rms_%s,p95_%s,max_%s'% (i, i, i) for i in axis_names) + '\n')
+    for name in result:
+        if name in ('t', 'static'):
+            continue
+        start, n, rms, p95, mx = result[name]['windows']
+        for i in range(start.size):
+            f.write('%s,%.1f,%u,'% (name, start[i], n[i]) +\
+                    ','.join('%.4f,%.4f,%.4f'% (rms[i, j], p95[i, j], mx[i, j]) for j in range(3)) +\
+                    '\n')
+    f.close()
+
+if __name__ == "__main__":
+    # python compare.py log.txt [multiprocessing|vg_ahrs] [window]
+    file_name = 'log.txt'
+    layout = 'multiprocessing'
+    window = 60.0
+    num_of_args = len(sys.argv)
+    if num_of_args > 1:
+        file_name = sys.argv[1]
+        if num_of_args > 2:
+            layout = sys.argv[2]
+            if num_of_args > 3:
+                window = float(sys.argv[3])
+    tstart = time.time()
+    data = load_log(file_name, layouts[layout]['skip_header'])
+    tload = time.time()
+    result = compare(data, layouts[layout], window)
+    base = os.path.splitext(file_name)[0]
+    write_summary(base + '_summary.csv', result)
+    write_windows(base + '_windows.csv', result)
+    print('%u samples, loaded in %.3f s, compared in %.3f s'% (data.shape[0], tload - tstart,\
+          time.time() - tload))
+    print(open(base + '_summary.csv').read())
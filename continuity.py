@@ -0,0 +1,237 @@
+'''
+Continuity check of packet counters and ITOW.
+Gaps (dropped packets), duplicates and reordered packets are detected from the counter
+carried in each packet, either live one sample at a time (continuity_checker) or
+vectorized over a decoded log (check_array).
+'''
+import collections
+import numpy as np
+
+# one week in ms
+itow_wrap = 7 * 24 * 3600 * 1000
+# packet type: [index of the counter in the tuple returned by the parser, rollover]
+counter_def = {'S0': [0, 65536],\
+               'S1': [0, 65536],\
+               'SH': [0, 65536],\
+               'A1': [4, itow_wrap],\
+               'A2': [4, itow_wrap],\
+               'z1': [0, 4294967296],\
+               's1': [0, 4294967296],\
+               'sd': [0, 4294967296],\
+               'E3': [0, 4294967296],\
+               'MG': [0, 4294967296],\
+               'SA': [0, 4294967296]}
+# event kinds
+GAP = 'gap'
+DUPLICATE = 'duplicate'
+REORDER = 'reorder'
+# number of deltas used to learn the counter period when it is not given. Until a period is
+#   learned only the latest ones are kept, a stuck counter does not grow the window.
+learn_size = 16
+report_header = 'unit,row,kind,prev,value,missing\n'
+
+class continuity_checker:
+    '''
+    Streaming continuity check of one counter.
+    A sample is a gap if the counter advanced by more than 1.5 periods, a duplicate if it
+    advanced by less than half a period, and reordered if it went backwards. Reordered
+    samples do not move the reference, so a swapped pair is reported once.
+    '''
+    def __init__(self, wrap, period=None, unit='', metrics=None, max_events=10000):
+        '''
+        Args:
+            wrap: counter rollover, 65536 for U2 counters, itow_wrap for ITOW in ms.
+            period: counter increment between two consecutive packets. None to learn it
+                from the most common increment of the first samples.
+            unit: unit name written in the gap report.
+            metrics: optional link_metrics instance, its gaps and missing counters are updated.
+            max_events: at most this many events are kept. Counters keep counting after that.
+        '''
+        self.wrap = wrap
+        self.half_wrap = wrap // 2
+        self.period = period
+        self.unit = unit
+        self.metrics = metrics
+        self.max_events = max_events
+        self.prev = None
+        self.row = -1
+        self.learning = collections.deque(maxlen=learn_size + 1)
+        self.events = []
+        self.gaps = 0
+        self.missing = 0
+        self.duplicates = 0
+        self.reorders = 0
+
+    def update(self, value, row=None):
+        '''
+        Check a new counter value.
+        Args:
+            value: counter value of the new sample.
+            row: row index of the sample in the log. None to count samples from 0.
+        Returns:
+            None if the sample is continuous, otherwise the event kind.
+        '''
+        self.row = self.row + 1 if row is None else row
+        if self.period is None:
+            # the window only gains an increment when the value changes, a constant value
+            #   can not make the period learnable
+            changed = not self.learning or self.learning[-1][1] != value
+            self.learning.append((self.row, value))
+            if len(self.learning) > learn_size and changed:
+                self.period = self.learn_period([i[1] for i in self.learning])
+                if self.period is not None:
+                    learned = list(self.learning)
+                    self.learning.clear()
+                    for i in learned:
+                        self.check(i[1], i[0])
+            return None
+        return self.check(value, self.row)
+
+    def check(self, value, row):
+        prev = self.prev
+        if prev is None:
+            self.prev = value
+            return None
+        d = (value - prev) % self.wrap
+        if d > self.half_wrap:
+            self.reorders += 1
+            return self.add_event(row, REORDER, prev, value, 0)
+        self.prev = value
+        k = int(d / self.period + 0.5)
+        if k == 1:
+            return None
+        if k == 0:
+            self.duplicates += 1
+            return self.add_event(row, DUPLICATE, prev, value, 0)
+        self.gaps += 1
+        self.missing += k - 1
+        if self.metrics is not None:
+            self.metrics.gaps += 1
+            self.metrics.missing += k - 1
+        return self.add_event(row, GAP, prev, value, k - 1)
+
+    def add_event(self, row, kind, prev, value, missing):
+        if len(self.events) < self.max_events:
+            self.events.append((row, kind, prev, value, missing))
+        return kind
+
+    def learn_period(self, values):
+        '''
+        Most common positive increment of values, None if there is none.
+        '''
+        d = np.mod(np.diff(np.array(values, dtype=np.int64)), self.wrap)
+        d = d[(d > 0) & (d <= self.half_wrap)]
+        if d.size == 0:
+            return None
+        increments, counts = np.unique(d, return_counts=True)
+        return int(increments[np.argmax(counts)])
+
+    def summary(self):
+        return {'unit': self.unit, 'period': self.period, 'gaps': self.gaps,\
+                'missing': self.missing, 'duplicates': self.duplicates,\
+                'reorders': self.reorders}
+
+    def write_report(self, file_name, append=False):
+        write_gap_report(file_name, self.events, self.unit, append)
+
+def checker_for(packet_type, period=None, unit='', metrics=None):
+    '''
+    Create a checker for the counter of a packet type.
+    Returns:
+        (checker, index of the counter in the parsed packet), (None, None) if the packet
+        type has no counter.
+    '''
+    if packet_type not in counter_def:
+        return None, None
+    idx, wrap = counter_def[packet_type]
+    return continuity_checker(wrap, period, unit, metrics), idx
+
+def check_array(values, wrap, period=None):
+    '''
+    Vectorized continuity check over a whole decoded log.
+    Same rules as continuity_checker.
+    Args:
+        values: counter values, 1D array.
+        wrap: counter rollover.
+        period: counter increment, None to use the most common increment.
+    Returns:
+        list of events (row, kind, prev, value, missing). An event at row i is between
+        the sample at row i and the latest sample before it.
+    '''
+    values = np.asarray(values).astype(np.int64)
+    if values.size < 2:
+        return []
+    # unwrap rollovers
+    d = np.diff(values)
+    half_wrap = wrap // 2
+    corr = np.zeros(values.shape, dtype=np.int64)
+    corr[1:] = np.cumsum((d < -half_wrap).astype(np.int64) - (d > half_wrap))
+    unwrapped = values + corr * wrap
+    if period is None:
+        pos = d[(d > 0) & (d <= half_wrap)]
+        if pos.size == 0:
+            return []
+        increments, counts = np.unique(pos, return_counts=True)
+        period = int(increments[np.argmax(counts)])
+    # reordered samples do not move the reference
+    ref = np.maximum.accumulate(unwrapped)[:-1]
+    step = unwrapped[1:] - ref
+    k = np.floor(step / period + 0.5).astype(np.int64)
+    reorder = step < 0
+    duplicate = (~reorder) & (k == 0)
+    gap = (~reorder) & (k > 1)
+    rows = np.nonzero(reorder | duplicate | gap)[0]
+    events = []
+    for i in rows:
+        if reorder[i]:
+            kind = REORDER
+        elif duplicate[i]:
+            kind = DUPLICATE
+        else:
+            kind = GAP
+        events.append((int(i+1), kind, int(ref[i] % wrap), int(values[i+1]),\
+                       int(k[i] - 1) if kind == GAP else 0))
+    return events
+
+def write_gap_report(file_name, events, unit='', append=False):
+    '''
+    Write events to a CSV gap report.
+    '''
+    f = open(file_name, 'a' if append else 'w')
+    if not append or f.tell() == 0:
+        f.write(report_header)
+    for row, kind, prev, value, missing in events:
+        f.write('%s,%u,%s,%u,%u,%u\n'% (unit, row, kind, prev, value, missing))
+    f.close()
+
+def load_gap_report(file_name, unit=None, kinds=(GAP,)):
+    '''
+    Read a gap report.
+    Args:
+        file_name: gap report written by write_gap_report.
+        unit: only events of this unit, None for all units.
+        kinds: only events of these kinds.
+    Returns:
+        sorted numpy array of row indices.
+    '''
+    rows = []
+    f = open(file_name, 'r')
+    f.readline()
+    for line in f:
+        fields = line.strip().split(',')
+        if len(fields) < 6:
+            continue
+        if unit is not None and fields[0] != unit:
+            continue
+        if fields[2] in kinds:
+            rows.append(int(fields[1]))
+    f.close()
+    return np.sort(np.array(rows, dtype=np.int64))
+
+def window_has_gaps(gap_rows, idx0, n):
+    '''
+    True if any event falls inside the window of rows [idx0, n).
+    An event at idx0 is between idx0-1 and idx0, so it is outside the window.
+    '''
+    gap_rows = np.asarray(gap_rows)
+    return bool(np.any((gap_rows > idx0) & (gap_rows < n)))
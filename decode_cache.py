@@ -0,0 +1,181 @@
+'''
+Content-addressed cache of decoded raw logs.
+A raw log is decoded once with the vectorized path of packet_decoder and stored as a
+columnar table (see columnar.py) under cache_dir. The key is the hash of the raw bytes, the
+device, the packet type and packet_decoder.VERSION, so a copied or renamed log hits the cache
+and a schema change misses it. The least recently used entries are removed when the cache
+grows over max_bytes.
+'''
+import os
+import sys
+import time
+import json
+import shutil
+import hashlib
+import columnar
+import packet_decoder
+
+cache_dir = os.path.join(os.path.expanduser('~'), '.openimu_decode_cache')
+# total size of the cached tables, bytes
+max_bytes = 4*1024*1024*1024
+# hashes of raw logs by path, size and mtime, so that an unchanged log is not hashed again
+hash_file = 'hashes.json'
+block_size = 16*1024*1024
+# hashes of this process, by path, size and mtime
+hashes = {}
+
+def file_hash(file_name):
+    '''
+    Hash of the bytes of a file. Reused from the hash index while the size and the
+    modification time of the file do not change.
+    '''
+    path = os.path.abspath(file_name)
+    st = os.stat(path)
+    if (path, st.st_size, st.st_mtime_ns) in hashes:
+        return hashes[(path, st.st_size, st.st_mtime_ns)]
+    index_file = os.path.join(cache_dir, hash_file)
+    try:
+        index = json.load(open(index_file, 'r'))
+    except (OSError, ValueError):
+        index = {}
+    if path in index and index[path][0] == st.st_size and index[path][1] == st.st_mtime_ns:
+        hashes[(path, st.st_size, st.st_mtime_ns)] = index[path][2]
+        return index[path][2]
+    h = hashlib.blake2b(digest_size=20)
+    f = open(path, 'rb')
+    while True:
+        data = f.read(block_size)
+        if not data:
+            break
+        h.update(data)
+    f.close()
+    digest = h.hexdigest()
+    index[path] = [st.st_size, st.st_mtime_ns, digest]
+    hashes[(path, st.st_size, st.st_mtime_ns)] = digest
+    try:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        tmp = index_file + '.tmp'
+        json.dump(index, open(tmp, 'w'))
+        os.replace(tmp, index_file)
+    except OSError:
+        pass
+    return digest
+
+def key(file_name, packet_type, device='imu38x'):
+    s = '%s:%s:%s:%s'% (file_hash(file_name), device, packet_type, packet_decoder.VERSION)
+    return hashlib.sha1(s.encode()).hexdigest()
+
+def entry_size(path):
+    return sum(os.path.getsize(os.path.join(path, i)) for i in os.listdir(path))
+
+def entries():
+    '''
+    Returns:
+        list of (last used time, size in bytes, path) of the cached tables.
+    '''
+    out = []
+    if not os.path.isdir(cache_dir):
+        return out
+    for i in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, i)
+        header = os.path.join(path, columnar.header_file)
+        if os.path.exists(header):
+            out.append((os.path.getmtime(header), entry_size(path), path))
+    return out
+
+def evict(limit=None):
+    '''
+    Remove the least recently used tables until the cache is not larger than limit bytes.
+    Returns:
+        number of tables removed.
+    '''
+    if limit is None:
+        limit = max_bytes
+    tables = sorted(entries())
+    total = sum(i[1] for i in tables)
+    n = 0
+    for last_used, size, path in tables:
+        if total <= limit:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        n += 1
+    return n
+
+def get(file_name, packet_type, device='imu38x'):
+    '''
+    Returns:
+        dict of field name -> memory mapped array, or None if the log is not cached.
+    '''
+    path = os.path.join(cache_dir, key(file_name, packet_type, device))
+    header = os.path.join(path, columnar.header_file)
+    if not os.path.exists(header):
+        return None
+    # mark as recently used
+    os.utime(header)
+    return columnar.load_table(path)
+
+def put(file_name, packet_type, arrays, device='imu38x'):
+    '''
+    Store decoded arrays of a log. The table is written to a temporary directory and
+    renamed, so a reader never sees a partial table.
+    '''
+    path = os.path.join(cache_dir, key(file_name, packet_type, device))
+    tmp = '%s.%u.tmp'% (path, os.getpid())
+    columnar.write_table(tmp, arrays)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # cached meanwhile by another process
+        shutil.rmtree(tmp, ignore_errors=True)
+    evict()
+
+def decode_file(file_name, packet_type, device='imu38x'):
+    '''
+    packet_decoder.decode_file() through the cache.
+    Returns:
+        dict of field name -> array, in schema order.
+    '''
+    arrays = get(file_name, packet_type, device)
+    if arrays is None:
+        arrays = packet_decoder.decode_file(file_name, packet_type, device)
+        try:
+            put(file_name, packet_type, arrays, device)
+        except OSError as e:
+            print('Cannot cache decoded %s: %s'% (file_name, e))
+    names = packet_decoder.packet_decoder(packet_type, device).names
+    return dict((i, arrays[i]) for i in names)
+
+def rows(arrays, names, block=4096):
+    '''
+    Iterate over decoded arrays row by row.
+    Rows are converted to Python values block rows at a time, so memory does not grow with
+    the length of the log, and memory mapped arrays are read as rows are taken.
+    Returns:
+        generator of tuples of field values in the order of names, as packet_decoder.decode().
+    '''
+    n = arrays[names[0]].shape[0] if names else 0
+    for start in range(0, n, block):
+        for row in zip(*[arrays[i][start:start+block].tolist() for i in names]):
+            yield row
+
+if __name__ == "__main__":
+    # decode a raw log through the cache
+    #   python decode_cache.py log.bin s1 [imu38x|rtk330l]
+    # show the size of the cache, or remove all of it
+    #   python decode_cache.py
+    #   python decode_cache.py clear
+    if len(sys.argv) > 2:
+        device = sys.argv[3] if len(sys.argv) > 3 else 'imu38x'
+        tstart = time.time()
+        hit = get(sys.argv[1], sys.argv[2], device) is not None
+        arrays = decode_file(sys.argv[1], sys.argv[2], device)
+        n = list(arrays.values())[0].shape[0] if arrays else 0
+        print('%u %s packets, %s in %.3f s'% (n, sys.argv[2], 'cached' if hit else 'decoded',\
+              time.time() - tstart))
+    else:
+        if len(sys.argv) > 1 and sys.argv[1] == 'clear':
+            evict(0)
+        tables = entries()
+        print('%u tables, %.1f MB in %s'% (len(tables), sum(i[1] for i in tables) / 1e6, cache_dir))
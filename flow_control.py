@@ -0,0 +1,200 @@
+'''
+Bounded queues between the process reading a unit and the logger process.
+A driver sends decoded records to a unit_link instead of the sending end of its Pipe. The
+records wait in a queue of at most max_items and a thread sends them to the Pipe, so a
+logger that falls behind never blocks the reading of the serial port. When the queue is full
+a record is handled by the policy of the link:
+    block           wait for room. Nothing is dropped, but the serial port is not read
+                    meanwhile and its input buffer may overflow.
+    drop_oldest     drop the oldest record in the queue.
+    drop_newest     drop the new record.
+    spill           append the record to a spill file. Spilled records are moved back to the
+                    queue in order as soon as it has room, so records are only spilled while
+                    the queue is full. Nothing is dropped and the port is always read.
+Raw bytes do not go through the queue: the drivers write them to their raw sink as soon as
+they are read, before decoding (see the raw argument of imu38x.imu38x).
+Drop and spill counters are kept in the link_metrics of the driver and, for the logger
+process, in a shared array (see shared_counters and counters).
+'''
+import pickle
+import tempfile
+import threading
+import collections
+import multiprocessing
+
+policies = ('block', 'drop_oldest', 'drop_newest', 'spill')
+# names of the shared counters
+counter_names = ('sent', 'dropped', 'spilled', 'queue_high')
+
+def shared_counters():
+    '''
+    Counters of a link readable by the logger process, passed to the unit process.
+    '''
+    return multiprocessing.Array('q', len(counter_names))
+
+def counters(shared):
+    '''
+    Returns:
+        dict of counter name -> value of shared counters.
+    '''
+    return dict(zip(counter_names, shared[:]))
+
+class unit_link:
+    '''
+    Sending end of a unit's Pipe with a bounded queue and a sender thread.
+    '''
+    def __init__(self, conn, policy='spill', max_items=1000, spill_file=None, shared=None,\
+                 metrics=None):
+        '''
+        Args:
+            conn: sending end of the Pipe.
+            policy: one of policies.
+            max_items: records the queue holds.
+            spill_file: spill file of the spill policy, None for a temporary file.
+            shared: shared_counters() updated for the logger process, or None.
+            metrics: link_metrics.link_metrics updated with the drop and spill counters,
+                or None. Usually set to the metrics of the driver once it is created.
+        '''
+        if policy not in policies:
+            raise ValueError('Unsupported flow control policy: %s'% policy)
+        self.conn = conn
+        self.policy = policy
+        self.max_items = max_items
+        self.spill_file = spill_file
+        self.shared = shared
+        self.metrics = metrics
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.spill = None           # spill file object
+        self.spill_read = 0         # offset of the next spilled record
+        self.n_spill = 0            # spilled records not yet sent
+        self.sent = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.queue_high = 0
+        self.closing = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send(self, msg):
+        '''
+        Queue a record. Control messages ('exit') are never dropped.
+        '''
+        with self.cond:
+            if self.n_spill:
+                # records spilled before this one are queued first
+                self.refill()
+            if self.n_spill:
+                self.to_spill(msg)
+            elif isinstance(msg, str) or len(self.queue) < self.max_items:
+                self.queue.append(msg)
+            elif self.policy == 'block':
+                while len(self.queue) >= self.max_items:
+                    self.cond.wait()
+                self.queue.append(msg)
+            elif self.policy == 'drop_oldest':
+                self.queue.popleft()
+                self.queue.append(msg)
+                self.count_drop()
+            elif self.policy == 'drop_newest':
+                self.count_drop()
+            else:
+                self.to_spill(msg)
+            if len(self.queue) > self.queue_high:
+                self.queue_high = len(self.queue)
+                if self.metrics is not None:
+                    self.metrics.queue_high = self.queue_high
+            self.cond.notify_all()
+
+    def count_drop(self):
+        self.dropped += 1
+        if self.metrics is not None:
+            self.metrics.dropped += 1
+        self.publish()
+
+    def publish(self):
+        if self.shared is not None:
+            self.shared[:] = [self.sent, self.dropped, self.spilled, self.queue_high]
+
+    def to_spill(self, msg):
+        if self.spill is None:
+            if self.spill_file is None:
+                self.spill = tempfile.TemporaryFile()
+            else:
+                self.spill = open(self.spill_file, 'w+b')
+        self.spill.seek(0, 2)
+        pickle.dump(msg, self.spill, pickle.HIGHEST_PROTOCOL)
+        self.n_spill += 1
+        self.spilled += 1
+        if self.metrics is not None:
+            self.metrics.spilled += 1
+        self.publish()
+
+    def from_spill(self):
+        self.spill.seek(self.spill_read)
+        msg = pickle.load(self.spill)
+        self.spill_read = self.spill.tell()
+        self.n_spill -= 1
+        if self.n_spill == 0:
+            # all read back, reuse the file from the start
+            self.spill.seek(0)
+            self.spill.truncate()
+            self.spill_read = 0
+        return msg
+
+    def refill(self):
+        '''
+        Move spilled records to the queue while it has room. Called with self.cond held.
+        '''
+        while self.n_spill and len(self.queue) < self.max_items:
+            self.queue.append(self.from_spill())
+
+    def run(self):
+        '''
+        Sender thread: send queued records in order, refilling the queue from the spill.
+        '''
+        while True:
+            with self.cond:
+                while not self.queue and not self.n_spill and not self.closing:
+                    self.cond.wait()
+                if not self.queue:
+                    self.refill()
+                if self.queue:
+                    msg = self.queue.popleft()
+                    self.cond.notify_all()
+                else:
+                    break
+            # may block while the logger is behind, the driver keeps queuing meanwhile
+            self.conn.send(msg)
+            self.sent += 1
+            self.publish()
+
+    def close(self, timeout=None):
+        '''
+        Send all queued and spilled records and stop the sender thread.
+        Records not sent within timeout are counted as dropped.
+        '''
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        self.thread.join(timeout)
+        with self.cond:
+            if self.thread.is_alive():
+                # the sender is blocked by the logger. What it has not taken is dropped, and
+                #   the spill is left open, the sender may still be using it.
+                n = len(self.queue) + self.n_spill
+                self.queue.clear()
+                self.n_spill = 0
+                self.dropped += n
+                if self.metrics is not None:
+                    self.metrics.dropped += n
+            elif self.spill is not None:
+                self.spill.close()
+                self.spill = None
+            self.publish()
+
+def status_line(name, shared):
+    c = counters(shared)
+    return '%s: %u sent, %u dropped, %u spilled, queue high %u'% (\
+            name, c['sent'], c['dropped'], c['spilled'], c['queue_high'])
@@ -0,0 +1,247 @@
+'''
+Assemble FM multi-chip raw-counts packets into one array per sample.
+An FM packet carries 7 counts (3 accel, 3 gyro, 1 temp) of 4 chips. Chips 4*sensorSubset to
+4*sensorSubset+3 are in the packet, and packets with the same sampleIdx are taken at the
+same moment. A sample of n_chips chips is complete when all n_chips/4 subsets are received.
+'''
+import sys
+import struct
+import numpy as np
+import framing
+
+chips_per_packet = 4
+# 3 accel, 3 gyro, 1 temp
+values_per_chip = 7
+ACCEL = slice(0, 3)
+GYRO = slice(3, 6)
+TEMP = 6
+payload_size = 116
+counts_offset = 0
+tail_struct = struct.Struct('>2H')     # sensorSubset, sampleIdx
+tail_offset = 112
+
+class fm_store:
+    '''
+    Preallocated arrays of assembled samples. Capacity doubles when full.
+    '''
+    def __init__(self, n_chips, capacity=4096):
+        self.n_chips = n_chips
+        self.n_subsets = n_chips // chips_per_packet
+        self.counts = np.zeros((capacity, n_chips, values_per_chip), dtype=np.int32)
+        self.sample_idx = np.zeros((capacity,), dtype=np.uint16)
+        self.received = np.zeros((capacity, self.n_subsets), dtype=bool)
+        self.n = 0
+
+    def new_row(self, sample_idx):
+        if self.n == self.counts.shape[0]:
+            self.grow(2 * self.n)
+        row = self.n
+        self.n += 1
+        self.sample_idx[row] = sample_idx
+        return row
+
+    def grow(self, capacity):
+        n = self.counts.shape[0]
+        counts = np.zeros((capacity, self.n_chips, values_per_chip), dtype=np.int32)
+        counts[:n] = self.counts
+        sample_idx = np.zeros((capacity,), dtype=np.uint16)
+        sample_idx[:n] = self.sample_idx
+        received = np.zeros((capacity, self.n_subsets), dtype=bool)
+        received[:n] = self.received
+        self.counts, self.sample_idx, self.received = counts, sample_idx, received
+
+    def complete(self):
+        '''
+        True for samples of which all chips are received.
+        '''
+        return self.received[:self.n].all(axis=1)
+
+    def arrays(self, complete_only=False):
+        '''
+        Returns:
+            counts: (n, n_chips, 7) int32 array.
+            sample_idx: (n,) uint16 array.
+            received: (n, n_subsets) bool array, which chip subsets are received.
+        '''
+        if complete_only:
+            idx = self.complete()
+            return self.counts[:self.n][idx], self.sample_idx[:self.n][idx],\
+                   self.received[:self.n][idx]
+        return self.counts[:self.n], self.sample_idx[:self.n], self.received[:self.n]
+
+    def save(self, file_name):
+        counts, sample_idx, received = self.arrays()
+        np.savez(file_name, counts=counts, sample_idx=sample_idx, received=received)
+
+class fm_assembler:
+    '''
+    Group FM packets by sampleIdx into the rows of an fm_store.
+    Packets of at most `window` different samples can be interleaved. When a packet of a
+    newer sample arrives and more than `window` samples are waiting, the oldest one is
+    closed incomplete.
+    '''
+    def __init__(self, n_chips=16, capacity=4096, window=4):
+        if n_chips % chips_per_packet:
+            raise ValueError('n_chips must be a multiple of %u'% chips_per_packet)
+        self.store = fm_store(n_chips, capacity)
+        self.n_subsets = n_chips // chips_per_packet
+        self.window = window
+        self.pending = {}       # sampleIdx -> row in store, in order of arrival
+        self.packets = 0
+        self.complete = 0
+        self.incomplete = 0
+        self.duplicates = 0
+        self.out_of_range = 0
+        # callback with the row index of each sample when it is closed
+        self.on_sample = None
+
+    def add_payload(self, payload):
+        '''
+        Add an FM packet payload, 116 bytes.
+        Returns:
+            (sampleIdx, sensorSubset) of the packet.
+        '''
+        subset, sample_idx = tail_struct.unpack_from(payload, tail_offset)
+        counts = np.frombuffer(payload, dtype='>i4', count=chips_per_packet*values_per_chip,\
+                               offset=counts_offset)
+        self.add_counts(sample_idx, subset, counts)
+        return sample_idx, subset
+
+    def add(self, data):
+        '''
+        Add an FM packet decoded by imu38x.parse_FM, 28 counts + sensorSubset + sampleIdx.
+        '''
+        self.add_counts(data[29], data[28], data[0:28])
+        return data[29], data[28]
+
+    def add_counts(self, sample_idx, subset, counts):
+        self.packets += 1
+        if subset >= self.n_subsets:
+            self.out_of_range += 1
+            return
+        store = self.store
+        row = self.pending.get(sample_idx)
+        if row is None:
+            row = store.new_row(sample_idx)
+            self.pending[sample_idx] = row
+            if len(self.pending) > self.window:
+                # close the oldest sample, dicts keep insertion order
+                oldest = next(iter(self.pending))
+                self.close(oldest)
+        chip0 = subset * chips_per_packet
+        if store.received[row, subset]:
+            self.duplicates += 1
+        store.counts[row, chip0:chip0+chips_per_packet] =\
+            np.reshape(counts, (chips_per_packet, values_per_chip))
+        store.received[row, subset] = True
+        if store.received[row].all():
+            self.close(sample_idx)
+
+    def close(self, sample_idx):
+        row = self.pending.pop(sample_idx)
+        if self.store.received[row].all():
+            self.complete += 1
+        else:
+            self.incomplete += 1
+        if self.on_sample is not None:
+            self.on_sample(row)
+
+    def flush(self):
+        '''
+        Close all waiting samples at the end of the data.
+        '''
+        for sample_idx in list(self.pending.keys()):
+            self.close(sample_idx)
+
+    def report(self):
+        return {'packets': self.packets, 'samples': self.store.n,\
+                'complete': self.complete, 'incomplete': self.incomplete,\
+                'pending': len(self.pending), 'duplicates': self.duplicates,\
+                'out_of_range': self.out_of_range}
+
+def assemble_payloads(payloads, n_chips=16):
+    '''
+    Vectorized assembly of FM payloads in file order. A new sample starts whenever
+    sampleIdx changes, so packets of different samples must not be interleaved.
+    Args:
+        payloads: (N, 116) uint8 array of FM payloads.
+        n_chips: number of chips.
+    Returns:
+        fm_store with one row per sample.
+    '''
+    n_subsets = n_chips // chips_per_packet
+    payloads = np.ascontiguousarray(payloads, dtype=np.uint8)
+    counts = payloads[:, 0:tail_offset].copy().view('>i4').reshape(-1, chips_per_packet,\
+                                                                   values_per_chip)
+    tail = payloads[:, tail_offset:payload_size].copy().view('>u2')
+    subset = tail[:, 0].astype(np.int64)
+    sample_idx = tail[:, 1]
+    ok = subset < n_subsets
+    counts, subset, sample_idx = counts[ok], subset[ok], sample_idx[ok]
+    new_sample = np.ones(sample_idx.shape, dtype=bool)
+    new_sample[1:] = sample_idx[1:] != sample_idx[:-1]
+    row = np.cumsum(new_sample) - 1
+    n = int(row[-1]) + 1 if row.size else 0
+    store = fm_store(n_chips, max(n, 1))
+    store.n = n
+    store.sample_idx[:n] = sample_idx[new_sample]
+    store.received[row, subset] = True
+    chip = subset[:, None] * chips_per_packet + np.arange(chips_per_packet)
+    store.counts[row[:, None], chip] = counts.astype(np.int32)
+    return store
+
+def decode_file(file_name, n_chips=16):
+    '''
+    Assemble all FM packets of a binary log.
+    Returns:
+        fm_store with one row per sample.
+    '''
+    scanner = framing.frame_scanner(['FM'])
+    payloads = []
+    f = open(file_name, 'rb')
+    while True:
+        data = f.read(4*1024*1024)
+        if not data:
+            break
+        buf, frames = scanner.feed(data)
+        for offset, pos, packet_type, n, crc_ok in frames:
+            if crc_ok and n == payload_size:
+                payloads.append(bytes(buf[pos+framing.header_size:pos+framing.header_size+n]))
+    f.close()
+    payloads = np.frombuffer(b''.join(payloads), dtype=np.uint8).reshape(-1, payload_size)
+    return assemble_payloads(payloads, n_chips)
+
+def log_fm(port, baud, file_name, n_chips=16):
+    '''
+    Assemble FM packets from a serial port or a data file (baud 0) and save them to
+    file_name (.npz) when the port closes or on Ctrl-C.
+    '''
+    import imu38x
+    unit = imu38x.imu38x(port, baud, 'FM')
+    assembler = fm_assembler(n_chips)
+    # payloads go to the assembler instead of being decoded into tuples
+    unit.parser = assembler.add_payload
+    try:
+        unit.start()
+    except KeyboardInterrupt:
+        pass
+    assembler.flush()
+    assembler.store.save(file_name)
+    print(assembler.report())
+    return assembler
+
+if __name__ == "__main__":
+    port = 'COM7'
+    baud = 115200
+    file_name = 'fm.npz'
+    n_chips = 16
+    num_of_args = len(sys.argv)
+    if num_of_args > 1:
+        port = sys.argv[1]
+        if num_of_args > 2:
+            baud = int(sys.argv[2])
+            if num_of_args > 3:
+                file_name = sys.argv[3]
+                if num_of_args > 4:
+                    n_chips = int(sys.argv[4])
+    log_fm(port, baud, file_name, n_chips)
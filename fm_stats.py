@@ -0,0 +1,312 @@
+'''
+Statistics of multi-chip FM data for chip screening.
+Per chip and axis: mean and variance (Welford), the same binned by chip temperature over a
+rolling window, the temperature slope of each axis, and chips that are outliers compared with
+the others.
+Memory is O(1) per chip per temperature bin, so the engine can run live while logging
+(attach it to an fm_array.fm_assembler) or over a decoded file (update_arrays).
+'''
+import sys
+import numpy as np
+import fm_array
+
+axis_names = ['ax', 'ay', 'az', 'wx', 'wy', 'wz', 'temp']
+# time constant of the temperature-binned statistics, samples
+bin_window = 10000
+
+class grouped_welford:
+    '''
+    Mean and variance of 7 values per group, merged batch by batch (Chan et al.),
+    which is equivalent to Welford's update one sample at a time.
+    With a window, samples are weighted by exp(-age/window), age in samples: the count, mean
+    and M2 of a group are decayed to the time of the new samples before they are added, so
+    the statistics follow recent samples with O(1) memory.
+    '''
+    def __init__(self, n_groups, n_values=fm_array.values_per_chip, window=None):
+        '''
+        Args:
+            window: time constant, samples. None to weigh all samples equally.
+        '''
+        self.n_values = n_values
+        self.decay = np.exp(-1.0 / window) if window is not None else 1.0
+        self.count = np.zeros((n_groups,))
+        self.mean = np.zeros((n_groups, n_values))
+        self.m2 = np.zeros((n_groups, n_values))
+        self.last = np.zeros((n_groups,))      # time the group was decayed to
+
+    def grow(self, n_groups):
+        n = self.count.shape[0]
+        if n_groups <= n:
+            return
+        self.count = np.hstack((self.count, np.zeros((n_groups-n,))))
+        self.mean = np.vstack((self.mean, np.zeros((n_groups-n, self.n_values))))
+        self.m2 = np.vstack((self.m2, np.zeros((n_groups-n, self.n_values))))
+        self.last = np.hstack((self.last, np.zeros((n_groups-n,))))
+
+    def decay_to(self, keys, t):
+        '''
+        Decay the statistics of groups to time t.
+        '''
+        if self.decay == 1.0:
+            return
+        w = self.decay ** (t - self.last[keys])
+        self.count[keys] *= w
+        self.m2[keys] *= w[:, None]
+        self.last[keys] = t
+
+    def update(self, keys, values, t=None):
+        '''
+        Args:
+            keys: (N,) group index of each row of values.
+            values: (N, n_values) array.
+            t: (N,) time of each row, samples. Only used with a window.
+        '''
+        n_groups = self.count.shape[0]
+        if self.decay != 1.0 and t is not None:
+            t_end = float(np.max(t)) if len(t) else 0.0
+            weights = self.decay ** (t_end - np.asarray(t, dtype=np.float64))
+            self.decay_to(np.arange(n_groups), t_end)
+        else:
+            weights = None
+        count_b = np.bincount(keys, weights, minlength=n_groups).astype(np.float64)
+        has = count_b > 0
+        if not has.any():
+            return
+        mean_b = np.zeros((n_groups, self.n_values))
+        m2_b = np.zeros((n_groups, self.n_values))
+        for i in range(self.n_values):
+            x = values[:, i] if weights is None else values[:, i] * weights
+            mean_b[has, i] = np.bincount(keys, x, n_groups)[has] / count_b[has]
+            d = values[:, i] - mean_b[keys, i]
+            m2_b[:, i] = np.bincount(keys, d*d if weights is None else d*d*weights, n_groups)
+        # merge the batch into the running statistics
+        count = self.count + count_b
+        delta = mean_b - self.mean
+        w = np.zeros((n_groups,))
+        w[has] = count_b[has] / count[has]
+        self.mean[has] += delta[has] * w[has, None]
+        self.m2[has] += m2_b[has] + delta[has]**2 * (self.count[has] * w[has])[:, None]
+        self.count = count
+
+    def update_unique(self, keys, values, t=None):
+        '''
+        Welford's update when each group is in keys at most once, for example one sample
+        of all chips. Much faster than update() for a single sample.
+        Args:
+            t: time of the sample, samples. Only used with a window.
+        '''
+        if t is not None:
+            self.decay_to(keys, t)
+        count = self.count[keys] + 1.0
+        delta = values - self.mean[keys]
+        mean = self.mean[keys] + delta / count[:, None]
+        self.m2[keys] += delta * (values - mean)
+        self.mean[keys] = mean
+        self.count[keys] = count
+
+    def var(self):
+        out = np.full(self.m2.shape, np.nan)
+        ok = self.count > 1
+        out[ok] = self.m2[ok] / (self.count[ok, None] - 1)
+        return out
+
+class fm_stats:
+    def __init__(self, n_chips=16, bin_width=100.0, outlier_k=5.0, window=bin_window):
+        '''
+        Args:
+            n_chips: number of chips.
+            bin_width: width of temperature bins, in temperature counts.
+            outlier_k: a chip is an outlier if its robust z-score is above outlier_k.
+            window: the temperature-binned statistics weigh a sample by exp(-age/window),
+                age in samples, so they follow the recent behavior of each bin. None to keep
+                the whole session.
+        '''
+        self.n_chips = n_chips
+        self.bin_width = bin_width
+        self.outlier_k = outlier_k
+        self.overall = grouped_welford(n_chips)
+        self.binned = grouped_welford(0, window=window)
+        self.bins = {}          # temperature bin index -> slot in self.binned
+        self.samples = 0
+
+    def update(self, counts, valid=None):
+        '''
+        Add one sample.
+        Args:
+            counts: (n_chips, 7) array of one sample.
+            valid: (n_chips,) bool array, chips received in this sample. None for all.
+        '''
+        values = counts.astype(np.float64)
+        chip = np.arange(self.n_chips)
+        if valid is not None:
+            values, chip = values[valid], chip[valid]
+        self.samples += 1
+        self.overall.update_unique(chip, values)
+        slot = np.empty(chip.shape, dtype=np.int64)
+        bin_idx = np.floor(values[:, fm_array.TEMP] / self.bin_width).astype(np.int64)
+        for i in range(bin_idx.size):
+            b = int(bin_idx[i])
+            if b not in self.bins:
+                self.bins[b] = len(self.bins)
+                self.binned.grow(len(self.bins) * self.n_chips)
+            slot[i] = self.bins[b]
+        self.binned.update_unique(slot * self.n_chips + chip, values, self.samples)
+
+    def update_arrays(self, counts, valid=None):
+        '''
+        Add many samples.
+        Args:
+            counts: (N, n_chips, 7) array.
+            valid: (N, n_chips) bool array, None for all.
+        '''
+        n, n_chips, n_values = counts.shape
+        values = counts.reshape(-1, n_values).astype(np.float64)
+        chip = np.tile(np.arange(n_chips), n)
+        t = np.repeat(np.arange(self.samples + 1, self.samples + n + 1), n_chips)
+        if valid is not None:
+            ok = valid.reshape(-1)
+            values, chip, t = values[ok], chip[ok], t[ok]
+        self.samples += n
+        self.overall.update(chip, values)
+        # temperature bins, slots are added when a new bin shows up
+        bin_idx = np.floor(values[:, fm_array.TEMP] / self.bin_width).astype(np.int64)
+        uniq, inv = np.unique(bin_idx, return_inverse=True)
+        for b in uniq:
+            if int(b) not in self.bins:
+                self.bins[int(b)] = len(self.bins)
+        self.binned.grow(len(self.bins) * n_chips)
+        slot = np.array([self.bins[int(b)] for b in uniq], dtype=np.int64)[inv.reshape(-1)]
+        self.binned.update(slot * n_chips + chip, values, t)
+
+    def update_store(self, store, complete_only=False):
+        '''
+        Add all samples of an fm_array.fm_store.
+        '''
+        counts, sample_idx, received = store.arrays(complete_only)
+        valid = np.repeat(received, fm_array.chips_per_packet, axis=1)
+        self.update_arrays(counts, valid)
+
+    def attach(self, assembler):
+        '''
+        Update the statistics live with every sample closed by an fm_array.fm_assembler.
+        '''
+        store = assembler.store
+        def on_sample(row):
+            valid = np.repeat(store.received[row], fm_array.chips_per_packet)
+            self.update(store.counts[row], valid)
+        assembler.on_sample = on_sample
+
+    def mean(self):
+        return self.overall.mean
+
+    def std(self):
+        return np.sqrt(self.overall.var())
+
+    def binned_stats(self):
+        '''
+        Returns:
+            bins: sorted temperature bin indices, the bin of index b is
+                [b*bin_width, (b+1)*bin_width).
+            count: (n_bins, n_chips) number of samples, weighted by their age with a window.
+            mean: (n_bins, n_chips, 7)
+            std: (n_bins, n_chips, 7)
+        '''
+        # bins not updated lately are aged to the latest sample
+        self.binned.decay_to(np.arange(self.binned.count.shape[0]), self.samples)
+        bins = sorted(self.bins.keys())
+        slots = np.array([self.bins[b] for b in bins], dtype=np.int64)
+        shape = (len(self.bins), self.n_chips)
+        count = self.binned.count.reshape(shape)[slots]
+        mean = self.binned.mean.reshape(shape + (-1,))[slots]
+        std = np.sqrt(self.binned.var().reshape(shape + (-1,))[slots])
+        return np.array(bins), count, mean, std
+
+    def temp_slope(self):
+        '''
+        Slope of each axis against chip temperature, weighted least squares over the
+        temperature bins.
+        Returns:
+            (n_chips, 6) array, counts per temperature count. NaN if a chip has data in
+            fewer than 2 bins.
+        '''
+        bins, count, mean, std = self.binned_stats()
+        t = mean[:, :, fm_array.TEMP]                   # (n_bins, n_chips)
+        w = count
+        sw = w.sum(axis=0)
+        slope = np.full((self.n_chips, fm_array.TEMP), np.nan)
+        ok = (np.count_nonzero(w, axis=0) > 1)
+        if not ok.any():
+            return slope
+        t_mean = (w * t).sum(axis=0)[ok] / sw[ok]
+        dt = (t[:, ok] - t_mean)
+        stt = (w[:, ok] * dt * dt).sum(axis=0)
+        for i in range(fm_array.TEMP):
+            x = mean[:, ok, i]
+            x_mean = (w[:, ok] * x).sum(axis=0) / sw[ok]
+            stx = (w[:, ok] * dt * (x - x_mean)).sum(axis=0)
+            slope[ok, i] = np.where(stt > 0, stx / np.where(stt > 0, stt, 1.0), np.nan)
+        return slope
+
+    def outliers(self, k=None):
+        '''
+        Chips that differ from the other chips, by robust z-score (median and MAD across
+        chips) of the bias, the noise and the temperature slope of each axis.
+        Returns:
+            dict of 'bias', 'noise', 'slope' -> list of (chip, axis name, z-score)
+        '''
+        if k is None:
+            k = self.outlier_k
+        result = {}
+        for name, x in (('bias', self.mean()[:, 0:fm_array.TEMP]),\
+                        ('noise', self.std()[:, 0:fm_array.TEMP]),\
+                        ('slope', self.temp_slope())):
+            z = robust_z(x)
+            chips, axes = np.nonzero(np.abs(np.nan_to_num(z)) > k)
+            result[name] = [(int(c), axis_names[a], float(z[c, a])) for c, a in zip(chips, axes)]
+        return result
+
+    def report(self):
+        return {'samples': self.samples,\
+                'count': self.overall.count.tolist(),\
+                'mean': self.mean().tolist(),\
+                'std': self.std().tolist(),\
+                'temp_slope': self.temp_slope().tolist(),\
+                'outliers': self.outliers()}
+
+def robust_z(x):
+    '''
+    Robust z-score of each row of x compared with all rows, column by column.
+    0.6745 makes the MAD of normally distributed data equal to its standard deviation.
+    '''
+    med = np.nanmedian(x, axis=0)
+    mad = np.nanmedian(np.abs(x - med), axis=0)
+    mad = np.where(mad > 0, mad, np.nan)
+    return 0.6745 * (x - med) / mad
+
+if __name__ == "__main__":
+    # statistics of a decoded .npz from fm_array.py, or of a binary log
+    file_name = 'fm.npz'
+    n_chips = 16
+    bin_width = 100.0
+    num_of_args = len(sys.argv)
+    if num_of_args > 1:
+        file_name = sys.argv[1]
+        if num_of_args > 2:
+            n_chips = int(sys.argv[2])
+            if num_of_args > 3:
+                bin_width = float(sys.argv[3])
+    if file_name.endswith('.npz'):
+        npz = np.load(file_name)
+        stats = fm_stats(npz['counts'].shape[1], bin_width)
+        stats.update_arrays(npz['counts'],\
+                            np.repeat(npz['received'], fm_array.chips_per_packet, axis=1))
+    else:
+        store = fm_array.decode_file(file_name, n_chips)
+        stats = fm_stats(n_chips, bin_width)
+        stats.update_store(store)
+    np.set_printoptions(precision=3, suppress=True, linewidth=150)
+    print('samples: %u'% stats.samples)
+    print('mean:\n%s'% stats.mean())
+    print('std:\n%s'% stats.std())
+    print('temperature slope:\n%s'% stats.temp_slope())
+    print('outliers: %s'% stats.outliers())
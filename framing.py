@@ -0,0 +1,152 @@
+'''
+Framing helpers for the 5555 packet protocol shared by imu38x and rtk330l.
+A frame is: 0x55 0x55, 2-byte type code, 1-byte payload length, payload, 2-byte CRC.
+The CRC is calculated over the type code, the length byte and the payload.
+'''
+import binascii
+
+preamble = b'\x55\x55'
+# 2-byte preamble + 2-byte type + 1-byte len
+header_size = 5
+# header + 2-byte crc
+overhead = 7
+
+def calc_crc(payload):
+    '''
+    Calculates CRC per 380 manual (CRC-CCITT, polynomial 0x1021, initial value 0x1D0F).
+    binascii.crc_hqx implements exactly this CRC in C.
+    Args:
+        payload: bytes-like object, type code + length byte + payload.
+    Returns:
+        16-bit CRC.
+    '''
+    return binascii.crc_hqx(payload, 0x1D0F)
+
+def build_frame(packet_type, payload):
+    '''
+    Build a complete frame.
+    Args:
+        packet_type: 2-char packet type, for example 'A1', or 2-byte type code.
+        payload: payload bytes, at most 255 bytes.
+    Returns:
+        frame bytes, preamble and CRC included.
+    '''
+    if isinstance(packet_type, str):
+        packet_type = packet_type.encode('latin-1')
+    body = bytes(packet_type) + bytes((len(payload),)) + bytes(payload)
+    return preamble + body + calc_crc(body).to_bytes(2, 'big')
+
+class frame_scanner:
+    '''
+    Split a 5555-framed byte stream into frames.
+    Data can be fed in blocks of any size. An incomplete frame at the end of a block is
+    kept and completed by the next block, so frames are found regardless of block boundaries.
+    '''
+    def __init__(self, types=None, offset=0):
+        '''
+        Args:
+            types: collection of 2-char type codes accepted as a frame header, for example
+                imu38x.packet_def.keys(). None to accept any type code. Restricting the types
+                avoids reporting random 5555 sequences in corrupted data as CRC failures.
+            offset: stream offset of the first byte fed, for example the start offset when
+                scanning part of a file.
+        '''
+        self.types = None if types is None else set(types)
+        self.bf = bytearray()
+        self.offset = offset    # stream offset of self.bf[0]
+        # statistics
+        self.bytes_in = 0
+        self.frames = 0         # frames with correct CRC
+        self.crc_fail = 0       # frames with wrong CRC
+        self.resync = 0         # how many times the scanner lost sync and had to search
+        self.discarded = 0      # bytes skipped while searching for the next frame
+        self.type_count = {}    # frames with correct CRC, per type
+        self.type_fail = {}     # frames with wrong CRC, per type
+        # not in sync before the first frame, bytes before it are not a resync
+        self.in_sync = False
+
+    def feed(self, data):
+        '''
+        Add new data and find all complete frames.
+        Args:
+            data: new bytes.
+        Returns:
+            buf: buffer holding the frames. It is only valid until the next call to feed().
+            frames: list of (offset, pos, packet_type, payload_len, crc_ok). offset is the
+                stream offset of the frame, buf[pos:pos+payload_len+7] is the frame.
+        '''
+        self.bytes_in += len(data)
+        if self.bf:
+            self.bf += data
+            buf = self.bf
+        else:
+            buf = data
+        frames = []
+        pos = self.scan(buf, frames)
+        self.bf = bytearray(buf[pos:])
+        self.offset += pos
+        return buf, frames
+
+    def flush(self):
+        '''
+        Discard bytes left in the buffer at the end of the stream.
+        '''
+        if self.bf:
+            self._skip(len(self.bf))
+            self.offset += len(self.bf)
+            self.bf = bytearray()
+
+    def scan(self, buf, frames):
+        '''
+        Find frames in buf. Returns the position of the first unprocessed byte.
+        '''
+        find = buf.find
+        crc_hqx = binascii.crc_hqx
+        types = self.types
+        base = self.offset
+        end = len(buf)
+        pos = 0
+        while True:
+            idx = find(preamble, pos, end)
+            if idx < 0:
+                # a trailing 0x55 may be the first byte of the next preamble
+                keep = end - 1 if end > pos and buf[end-1] == 0x55 else end
+                if keep > pos:
+                    self._skip(keep - pos)
+                return keep
+            if idx > pos:
+                self._skip(idx - pos)
+                pos = idx
+            # not enough bytes for type and length
+            if idx + header_size > end:
+                return idx
+            packet_type = buf[idx+2:idx+4].decode('latin-1')
+            if types is not None and packet_type not in types:
+                self._skip(1)
+                pos = idx + 1
+                continue
+            n = buf[idx+4]
+            frame_end = idx + n + overhead
+            # not enough bytes for the whole frame
+            if frame_end > end:
+                return idx
+            crc = crc_hqx(buf[idx+2:idx+header_size+n], 0x1D0F)
+            crc_ok = crc == (buf[frame_end-2] << 8 | buf[frame_end-1])
+            frames.append((base + idx, idx, packet_type, n, crc_ok))
+            if crc_ok:
+                self.frames += 1
+                self.type_count[packet_type] = self.type_count.get(packet_type, 0) + 1
+                self.in_sync = True
+                pos = frame_end
+            else:
+                self.crc_fail += 1
+                self.type_fail[packet_type] = self.type_fail.get(packet_type, 0) + 1
+                # remove the first byte and search for the next frame
+                self._skip(1)
+                pos = idx + 1
+
+    def _skip(self, n):
+        if self.in_sync:
+            self.resync += 1
+            self.in_sync = False
+        self.discarded += n
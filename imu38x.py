@@ -2,9 +2,11 @@ import os
 import time
 import sys
 import math
-import serial
-import serial.tools.list_ports
 import struct
+import link_metrics
+import continuity
+import packet_decoder
+import decode_cache
 
 preamble = bytearray.fromhex('5555')
 # payload + 2-byte header + 2-byte type + 1-byte len + 2-byte crc
@@ -25,19 +27,38 @@ packet_def = {'A1': [39, bytearray.fromhex('4131')],\
               'id': [154, bytearray.fromhex('6964')],\
               'sd': [57, bytearray.fromhex('7364')],\
               'FM': [123, bytearray.fromhex('464D')]}
+# compiled decoders of the packets parsed with packet_decoder
+decoders = dict((i, packet_decoder.packet_decoder(i, 'imu38x')) for i in ['s1', 'e1', 'e2', 'a1'])
+# output of the parser from the decoded fields in schema order, for the packets of decoders
+parser_output = {'s1': lambda d: (d[0], d[2], d[3], d[5]),\
+                 'e1': lambda d: (d[0], d[2], d[4], d[3], d[5], d[6], d[1]),\
+                 'e2': lambda d: (d[0], 0, d[3], d[5], d[9], d[7], d[2],\
+                                  (0,0,0), (0,0,0), 0, d[4], d[12], d[11]),\
+                 'a1': tuple}
+# replay data files of the packets of decoders from the decode cache
+use_decode_cache = True
+# FM: four chips, 7 (3 accel, 3 gyo and 1 temp) for each, sensorSubset and sampleIdx
+fm_struct = struct.Struct('>28i2H')
 
 class imu38x:
-    def __init__(self, port, baud=115200, packet_type='A2', pipe=None):
+    def __init__(self, port, baud=115200, packet_type='A2', pipe=None, log_interval=None,\
+                 raw=None):
         '''
         Initialize and then start ports search and autobaud process
         If baud <= 0, then port is actually a data file.
+        If log_interval is not None, link metrics are printed every log_interval seconds.
+        If raw is not None, bytes read from the port are written to it before being decoded,
+        raw is a file object or any object with write().
         '''
         self.port = port
         self.baud = baud
+        self.packet_type = packet_type
         # is file or serial port
         self.physical_port = True
         self.file_size = 0
         if baud > 0:
+            # pyserial is only imported for a serial port, not for file replay
+            import serial
             self.ser = serial.Serial(self.port, self.baud)
             self.open = self.ser.isOpen()
         else:
@@ -48,6 +69,11 @@ class imu38x:
         self.latest = []
         self.ready = False
         self.pipe = pipe
+        self.raw = raw
+        # records are stamped for latency_trace if the pipe is a latency_trace.traced_pipe
+        self.traced = hasattr(pipe, 'stamp')
+        # time to receive a byte, 10 bits per byte, to estimate when a frame arrived
+        self.byte_time = 10.0 / baud if baud > 0 else 0.0
         # self.header = A2_header     # packet type hex, default A2
         self.size = 0
         self.header = None
@@ -62,6 +88,11 @@ class imu38x:
         # serial data buffer
         self.bf = bytearray(self.size*2)
         self.nbf = 0    # how bytes in self.bf
+        # link health
+        self.metrics = link_metrics.link_metrics(str(port), log_interval)
+        # counter/ITOW continuity, gaps are counted in self.metrics
+        self.continuity, self.counter_idx = continuity.checker_for(packet_type, unit=str(port),\
+                                                                   metrics=self.metrics)
 
     def start(self, reset=False, reset_cmd='5555725300FC88'):
         if self.open:
@@ -70,7 +101,9 @@ class imu38x:
                 if reset is True:
                     self.ser.write(bytearray.fromhex(reset_cmd))
                 self.ser.reset_input_buffer()
-            while True:
+            # a data file decoded before is replayed from the decode cache
+            replayed = not self.physical_port and self.replay_cached()
+            while not replayed:
                 if self.physical_port:
                     read_size = self.ser.in_waiting
                 else:
@@ -81,6 +114,9 @@ class imu38x:
                     if not self.physical_port:
                         break
                 else:
+                    # raw bytes first, they are kept whatever happens to decoded data
+                    if self.raw is not None:
+                        self.raw.write(data)
                     # parse new coming data
                     self.parse_new_data(data)
             #close port or file
@@ -89,11 +125,36 @@ class imu38x:
             if self.pipe is not None:
                 self.pipe.send('exit')
 
+    def replay_cached(self):
+        '''
+        Replay a data file decoded by decode_cache, decoding it first if it is not cached.
+        Returns:
+            True if replayed, False if the packet type is not replayed from the cache.
+        '''
+        if not use_decode_cache or self.packet_type not in parser_output:
+            return False
+        decoder = decoders[self.packet_type]
+        to_output = parser_output[self.packet_type]
+        arrays = decode_cache.decode_file(self.port, self.packet_type, 'imu38x')
+        metrics = self.metrics
+        for row in decode_cache.rows(arrays, decoder.names):
+            self.latest = to_output(row)
+            metrics.frames_ok += 1
+            if self.continuity is not None:
+                self.continuity.update(self.latest[self.counter_idx])
+            if self.pipe is not None:
+                self.pipe.send(self.latest)
+        metrics.tick()
+        return True
+
     def parse_new_data(self, data):
         '''
         add new data in the buffer
         '''
+        metrics = self.metrics
+        t_read = time.perf_counter()
         n = len(data)
+        metrics.bytes_in += n
         for i in range(n):
             self.bf[self.nbf] = data[i]
             self.nbf += 1
@@ -105,25 +166,50 @@ class imu38x:
                     calculated_crc = self.calc_crc(self.bf[2:self.bf[4]+5])
                     # decode
                     if packet_crc == calculated_crc:
+                        t0 = time.perf_counter()
                         self.latest = self.parse_packet(self.bf[2:self.bf[4]+5])
-                        if self.latest[0]%5 == 0:
-                            print(self.latest) 
+                        t1 = time.perf_counter()
+                        metrics.parse_latency.add(t1 - t0)
+                        metrics.frames_ok += 1
+                        if self.continuity is not None:
+                            self.continuity.update(self.latest[self.counter_idx])
                         if self.pipe is not None:
+                            if self.traced:
+                                # the last byte of the frame arrived before the bytes after it
+                                #   in the block, the block was read as soon as it arrived
+                                self.pipe.stamp(t_read - (n - 1 - i) * self.byte_time, t_read, t1)
                             self.pipe.send(self.latest)
                         # remove decoded data from the buffer
                         self.nbf -= self.size
                         for i in range(self.nbf):
                             self.bf[i] = self.bf[i+self.size]
                     else:
-                        print('crc fail: %s %s %s %s'% (self.size, self.nbf, packet_crc, calculated_crc))
-                        print(" ".join("{:02X}".format(self.bf[i]) for i in range(0, self.nbf)))
+                        metrics.crc_fail += 1
                         # remove the first byte from the buffer
                         self.nbf -= 1
                         for i in range(self.nbf):
                             self.bf[i] = self.bf[i+1]
-                        self.nbf = self.sync_packet(self.bf, self.nbf, preamble)
+                        self.resync(1)
                 else:
-                    self.nbf = self.sync_packet(self.bf, self.nbf, preamble)
+                    self.resync(0)
+        metrics.tick()
+
+    def resync(self, dropped):
+        '''
+        search for the next packet header, and count bytes dropped from the buffer
+        '''
+        nbf = self.nbf
+        self.nbf = self.sync_packet(self.bf, self.nbf, preamble)
+        dropped += nbf - self.nbf
+        if dropped:
+            self.metrics.resync += 1
+            self.metrics.bytes_discarded += dropped
+
+    def get_metrics(self):
+        '''
+        snapshot of link health metrics
+        '''
+        return self.metrics.snapshot()
 
     def get_latest(self):
         return self.latest
@@ -365,13 +451,7 @@ class imu38x:
         '''
         parse s1 packet
         '''
-        fmt = '=IQffffffffff'
-        data = struct.unpack(fmt, payload)
-        timer = data[0]
-        acc = data[2:5]
-        gyro = data[5:8]
-        temp = data[11]
-        return timer, acc, gyro, temp
+        return parser_output['s1'](decoders['s1'].decode(payload))
 
     def parse_id(self, payload):
         '''
@@ -449,48 +529,7 @@ class imu38x:
                 =================================
                           NumOfBytes =  75 bytes
         '''
-        timer = (math.pow(4, 12) * payload[0] + math.pow(4, 8) * payload[1] + \
-            math.pow(4, 4) * payload[2] + payload[3])
-        
-        euler = (math.pow(4, 28) * payload[4] + math.pow(4, 24) * payload[5] + \
-            math.pow(4, 20) * payload[6] + math.pow(4, 16) * payload[7] + math.pow(4, 12) * \
-            payload[8] + math.pow(4, 8) * payload[9] + math.pow(4, 4) * payload[10] + \
-            payload[11])
-
-        roll = (math.pow(4, 12) * payload[12] + math.pow(4, 8) * payload[13] + \
-            math.pow(4,4) * payload[14] + payload[15])
-
-        pitch = (math.pow(4,12) * payload[16] + math.pow(4,8) * payload[17] + \
-            math.pow(4, 4) * payload[18] + payload[19])
-
-        yaw = (math.pow(4, 12) * payload[20] + math.pow(4, 8) * payload[21] + \
-            math.pow(4, 4) * payload[22] + payload[23])
-
-        accels = [0 for x in range(3)]
-        for i in range(3):
-            accels_float = (math.pow(4, 12) * payload[4*i+24] + math.pow(4, 8) * payload[4*i+25] + \
-                math.pow(4, 4) * payload[4*i+26] + payload[4*i+27])
-            accels[i] = accels_float
-
-        gyros = [0 for x in range(3)]
-        for i in range(3):
-            gyros_float = (math.pow(4, 12) * payload[4*i+36] + math.pow(4, 8) * payload[4*i+37] + \
-                math.pow(4, 4) * payload[4*i+38] + payload[4*i+39])
-            gyros[i] = gyros_float
-
-        gyro_bias = [0 for x in range(3)]
-        for i in range(3):
-            gyros_bias_float = (math.pow(4, 12) * payload[4*i+48] + math.pow(4, 8) * payload[4*i+49] + \
-                math.pow(4, 4) * payload[4*i+50] + payload[4*i+51])
-            gyro_bias[i] = gyros_bias_float
-
-        mags = [0 for x in range(3)]
-        for i in range(3):
-            mags_float = (math.pow(4, 12) * payload[4*i+60] + math.pow(4, 8) * payload[4*i+61] + \
-                math.pow(4, 4) * payload[4*i+62] + payload[4*i+63])
-            mags[i] = mags_float
-
-        return timer, euler, roll, pitch, yaw, accels, gyros, gyro_bias, mags
+        return parser_output['e1'](decoders['e1'].decode(payload))
 
     def parse_e2(self, payload):
         '''
@@ -512,65 +551,10 @@ class imu38x:
                 =================================
                           NumOfBytes = 123 bytes
         '''
-        fmt = '=I'          # timer
-        fmt += 'd'          # time double
-        fmt += 'fff'        # Euler angles
-        fmt += 'fff'        # accel
-        fmt += 'fff'        # accel bias
-        fmt += 'fff'        # gyro
-        fmt += 'fff'        # gyro bias
-        fmt += 'fff'        # velocity
-        fmt += 'fff'        # mag
-        fmt += 'ddd'        # lla
-        fmt += 'B'          # opMode
-        fmt += 'B'          # linAccelSw
-        fmt += 'B'          # turnSw
-        data = struct.unpack(fmt, payload)
-        timer = data[0]
-        euler = data[2:5]
-        acc = data[5:8]
-        acc_bias = data[8:11]
-        gyro = data[11:14]
-        gyro_bias = data[14:17]
-        velocity = data[17:20]
-        mag = data[20:23]
-        lla = data[23:26]
-        op_mode = data[26]
-        lin_accel_sw = data[27]
-        turn_sw = data[28]
-        return timer, 0, acc, gyro, lla, velocity, euler,\
-            (0,0,0), (0,0,0), 0, acc_bias, turn_sw, lin_accel_sw
+        return parser_output['e2'](decoders['e2'].decode(payload))
 
     def parse_a1(self, payload):
-        timeITOW = (math.pow(4, 12) * payload[0] + math.pow(4, 8) * payload[1] + \
-            math.pow(4, 4) * payload[2] + payload[3])
-
-        time = (math.pow(4, 28) * payload[4] + math.pow(4, 24) * payload[5] + \
-            math.pow(4, 20) * payload[6] + math.pow(4, 16) * payload[7] + math.pow(4, 12) * \
-            payload[8] + math.pow(4, 8) * payload[9] + math.pow(4, 4) * payload[10] + \
-            payload[11])
-
-        roll = (math.pow(4, 12) * payload[12] + math.pow(4, 8) * payload[13] + \
-            math.pow(4,4) * payload[14] + payload[15])
-
-        pitch = (math.pow(4,12) * payload[16] + math.pow(4,8) * payload[17] + \
-            math.pow(4, 4) * payload[18] + payload[19])
-
-        corrected_gyros = [0 for x in range(3)]
-        for i in range(3):
-            corrected_gyros[i] = (math.pow(4, 12) * payload[4*i+20] + math.pow(4, 8) * payload[4*i+21] + \
-                math.pow(4, 4) * payload[4*i+22] + payload[4*i+23])
-
-        accels = [0 for x in range(3)]
-        for i in range(3):
-            accels[i] = (math.pow(4, 12) * payload[4*i+32] + math.pow(4, 8) * payload[4*i+33] + \
-                math.pow(4, 4) * payload[4*i+34] + payload[4*i+35])
-
-        op_mode = payload[44]
-        linear_accel_sw = payload[45]
-        turn_sw = payload[46]
-
-        return timeITOW, time, roll, pitch, corrected_gyros, accels, op_mode, linear_accel_sw, turn_sw
+        return parser_output['a1'](decoders['a1'].decode(payload))
 
     def parse_a2(self, payload):
         #   1 uint32_t (4 bytes) = 4 bytes,     itow
@@ -672,7 +656,6 @@ class imu38x:
         # gnss fix type
         gnss_fix_type = gnss_states[1]
         # reserved
-        print(['MG', tow, ground_speed, gnss_update, gnss_fix_type])
         return counter, acc_master, gyro_master
 
     def parse_SA(self, payload):
@@ -693,7 +676,6 @@ class imu38x:
         steering_angle_rate = struct.unpack('>h', payload[6:8])[0] * 1260 / pow_2_16
         # algorihtm states
         steering_states = payload[8:10]
-        print(['SA', steering_states])
         # reserved
         return counter, steering_angle, steering_angle_rate, steering_states
 
@@ -766,13 +748,9 @@ class imu38x:
         108	TempCounts4	    I4 	- 	counts 	Temperature  (Chip#= sensorSubset *4+3)
         112 sensorSubset 	U2 	- 	number	Multiply by 4 to get first sensor chip number in the packet 
         114	sampleIdx 	    U2 	- 	number	Sample idx. Packets with the same sample idx present sensors data taken at the same moment of time. 
+        Packets of the same sampleIdx are grouped into one array per sample by fm_array.py.
         '''
-        fmt = '>i'*28   # four chips, 7 (3 accel, 3 gyo and 1 temp) for each
-        fmt += '>H'*2
-        data = struct.unpack(fmt, payload)
-        print(data[-1])
-        # reserved
-        return data
+        return fm_struct.unpack(payload)
 
     def sync_packet(self, bf, bf_len, preamble):
         idx = -1
@@ -1,32 +1,42 @@
 import math
-import serial
-import serial.tools.list_ports
 import struct
 import numpy as np
+import time
+import link_metrics
+import continuity
 
 nav_size = 127
 payload_len = 119
 nav_header = bytearray.fromhex('af 20 05 0d')
 
 class ins1000:
-    def __init__(self, port, baud=230400, pipe=None):
+    def __init__(self, port, baud=230400, pipe=None, log_interval=None):
         '''Initialize and then start ports search and autobaud process
+        If log_interval is not None, link metrics are printed every log_interval seconds.
         '''
         self.port = port
         self.baud = baud
+        import serial
         self.ser = serial.Serial(self.port, self.baud)
         self.open = self.ser.isOpen()
         self.latest = []
         self.pipe = pipe
+        # link health
+        self.metrics = link_metrics.link_metrics(str(port), log_interval)
+        # continuity of the nav time, s, checked in ms. Gaps are counted in self.metrics
+        self.continuity = continuity.continuity_checker(continuity.itow_wrap, unit=str(port),\
+                                                        metrics=self.metrics)
 
     def start(self):
         if self.open:
             bf = bytearray(nav_size*2)
             n_bytes = 0
+            metrics = self.metrics
             while True:
                 data = self.ser.read(nav_size)
                 ## parse new
                 n = len(data)
+                metrics.bytes_in += n
                 for i in range(n):
                     bf[n_bytes + i] = data[i]
                 n_bytes += n
@@ -39,7 +49,11 @@ class ins1000:
                         calculated_crc = calc_crc(bf[6:payload_len+6])
                         # decode
                         if packet_crc == calculated_crc:
+                            t0 = time.perf_counter()
                             self.latest = parse_nav(bf[6:nav_size])
+                            metrics.parse_latency.add(time.perf_counter() - t0)
+                            metrics.frames_ok += 1
+                            self.continuity.update(int(round(self.latest[0][0] * 1000.0)))
                             if self.pipe is not None:
                                     self.pipe.send(self.latest)
                             # remove decoded data from the buffer
@@ -47,14 +61,29 @@ class ins1000:
                             for i in range(n_bytes):
                                 bf[i] = bf[i+nav_size]
                         else:
-                            print('ins1000 crc fail')
-                            n_bytes = sync_packet(bf, n_bytes, nav_header)
+                            metrics.crc_fail += 1
+                            n_bytes = self.resync(bf, n_bytes)
                     else:
-                        n_bytes = sync_packet(bf, n_bytes, nav_header)
+                        n_bytes = self.resync(bf, n_bytes)
                     # print(''.join('{:#x} '.format(x) for x in bf) )
+                metrics.tick()
+
+    def resync(self, bf, n_bytes):
+        '''
+        search for the next packet header, and count bytes dropped from the buffer
+        '''
+        new_n_bytes = sync_packet(bf, n_bytes, nav_header)
+        if new_n_bytes != n_bytes:
+            self.metrics.resync += 1
+            self.metrics.bytes_discarded += n_bytes - new_n_bytes
+        return new_n_bytes
+
     def get_latest(self):
         return self.latest
 
+    def get_metrics(self):
+        return self.metrics.snapshot()
+
 def parse_nav(payload):
     time_idx0 = 0
     lat_idx0 = 8
@@ -0,0 +1,172 @@
+'''
+Per-sample latency tracing from the serial port to the log file.
+A record is stamped with time.perf_counter() at each stage of its way:
+    arrival     last byte of the frame received by the OS, estimated from the position of the
+                frame in the block read and the baud rate
+    read        block returned by ser.read()
+    decode      packet parsed
+    send        handed to the pipe, in the unit process
+    recv        taken out of the pipe, in the logger process
+    write       line holding the sample written and flushed
+perf_counter() is a system-wide monotonic clock on Linux, Windows and macOS, so stamps taken
+in the unit process and in the logger process can be compared.
+The time between consecutive stamps is added to a latency histogram per unit and stage, and
+the histograms are printed and exported as JSON lines every interval seconds, with the fraction
+of the records written within a threshold (link_metrics.latency_threshold, 10 ms).
+    unit process:   driver(port, baud, packet, pipe=latency_trace.traced_pipe(conn))
+    logger process: trace = latency_trace.tracer(interval, 'latency.jsonl')
+                    msg = trace.received(name, conn.recv())
+                    ... write msg ...
+                    trace.written()
+'''
+import time
+import json
+import link_metrics
+
+# stage name -> (stamp index at start, stamp index at end)
+stages = [('buffer', 0, 1),\
+          ('decode', 1, 2),\
+          ('enqueue', 2, 3),\
+          ('pipe', 3, 4),\
+          ('writer', 4, 5),\
+          ('total', 0, 5)]
+# first item of a traced message
+marker = 'trace'
+
+class traced_pipe:
+    '''
+    Sending end of a unit's Pipe, sending the stamps of a record with it.
+    A driver calls stamp() before send() for each decoded record. Messages without stamps
+    ('exit', or records of a driver not stamping them) are sent unchanged.
+    '''
+    def __init__(self, conn):
+        self.conn = conn
+        self.stamps = None
+
+    def stamp(self, t_arrival, t_read, t_decode):
+        self.stamps = (t_arrival, t_read, t_decode)
+
+    def send(self, msg):
+        if self.stamps is None:
+            self.conn.send(msg)
+        else:
+            t_arrival, t_read, t_decode = self.stamps
+            self.stamps = None
+            self.conn.send((marker, msg, t_arrival, t_read, t_decode, time.perf_counter()))
+
+    def close(self):
+        self.conn.close()
+
+class tracer:
+    '''
+    Latency histograms of traced records, per unit and stage.
+    '''
+    def __init__(self, interval=10.0, file_name=None, verbose=True, threshold=None):
+        '''
+        Args:
+            interval: print and export the histograms every interval seconds. None to only
+                export when closed.
+            file_name: JSON lines file the histograms of each interval are appended to,
+                None to not export.
+            verbose: print a line per unit every interval.
+            threshold: latency budget, s, the fraction of the latencies within it is printed
+                and exported. None for link_metrics.latency_threshold.
+        '''
+        self.interval = interval
+        self.file_name = file_name
+        self.verbose = verbose
+        self.threshold = threshold
+        self.pending = {}       # unit -> stamps of the latest record not yet written
+        self.hists = {}         # unit -> stage -> histogram of this interval
+        self.totals = {}        # unit -> stage -> histogram since the start
+        self.texport = time.perf_counter()
+        self.f = open(file_name, 'a') if file_name is not None else None
+
+    def histograms(self):
+        return dict((i[0], link_metrics.latency_histogram(threshold=self.threshold))\
+                    for i in stages)
+
+    def received(self, name, item):
+        '''
+        Stamp a message taken out of the pipe of a unit.
+        Returns:
+            the message as sent by the driver.
+        '''
+        if type(item) is not tuple or len(item) != 6 or item[0] != marker:
+            return item
+        self.pending[name] = list(item[2:]) + [time.perf_counter()]
+        return item[1]
+
+    def written(self, names=None):
+        '''
+        The latest received record of each unit (or of the units in names) was written.
+        '''
+        tnow = time.perf_counter()
+        for name in (list(self.pending) if names is None else names):
+            stamps = self.pending.pop(name, None)
+            if stamps is None:
+                continue
+            stamps.append(tnow)
+            if name not in self.hists:
+                self.hists[name] = self.histograms()
+            hists = self.hists[name]
+            for stage, i, j in stages:
+                hists[stage].add(max(stamps[j] - stamps[i], 0.0))
+        if self.interval is not None and tnow - self.texport >= self.interval:
+            self.export(tnow)
+
+    def export(self, tnow=None):
+        '''
+        Print and export the histograms of the interval, and add them to the totals.
+        '''
+        if tnow is None:
+            tnow = time.perf_counter()
+        units = {}
+        for name in self.hists:
+            units[name] = dict((stage, h.snapshot()) for stage, h in self.hists[name].items())
+            if self.verbose:
+                print(status_line(name, self.hists[name]))
+            if name not in self.totals:
+                self.totals[name] = self.histograms()
+            for stage, h in self.hists[name].items():
+                self.totals[name][stage].merge(h)
+        if self.f is not None and units:
+            self.f.write(json.dumps({'time': time.time(), 'interval': tnow - self.texport,\
+                                     'units': units}) + '\n')
+            self.f.flush()
+        self.hists = {}
+        self.texport = tnow
+
+    def summary(self):
+        '''
+        Returns:
+            dict of unit -> stage -> snapshot of the histogram since the start.
+        '''
+        return dict((name, dict((stage, h.snapshot()) for stage, h in self.totals[name].items()))\
+                    for name in self.totals)
+
+    def close(self):
+        '''
+        Export the last interval and print the totals.
+        '''
+        self.export()
+        if self.verbose:
+            for name in self.totals:
+                print(status_line(name, self.totals[name], 'total '))
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+def status_line(name, hists, prefix=''):
+    '''
+    One line per unit: p50/p99 of each stage, the maximum total latency, in ms, and the
+    fraction of the total latencies within the threshold.
+    '''
+    parts = ['%s: %u'% (name, hists['total'].count)]
+    for stage, i, j in stages:
+        h = hists[stage]
+        parts.append('%s %.2f/%.2f'% (stage, h.percentile(50) / 1000.0, h.percentile(99) / 1000.0))
+    total = hists['total']
+    parts.append('max %.2f ms'% (total.max * 1000.0))
+    parts.append('%.2f%% within %.0f ms'% (100.0 * total.fraction_below(), total.threshold * 1000.0))
+    return prefix + ', '.join(parts)
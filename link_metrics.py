@@ -0,0 +1,166 @@
+'''
+Link health metrics of a driver instance.
+Counters are plain attributes updated by the drivers on the hot path. Reading them is done
+through snapshot(), and an optional status line can be printed periodically.
+'''
+import time
+
+# latencies at most this long are counted by latency_histogram.fraction_below(), s
+latency_threshold = 0.010
+
+class latency_histogram:
+    '''
+    Histogram of latencies in microseconds, with log2-spaced octaves split into sub_buckets
+    linear buckets each, so a bucket is at most 1/sub_buckets of its lower bound wide (12.5%
+    with 8). Latencies below sub_buckets us have a bucket per microsecond.
+    '''
+    def __init__(self, octaves=24, sub_buckets=8, threshold=None):
+        '''
+        Args:
+            octaves: latencies up to 2^octaves us are counted in their bucket, longer ones in
+                the last bucket.
+            sub_buckets: buckets per octave, a power of 2.
+            threshold: latencies at most threshold seconds are counted apart, see
+                fraction_below(). None for latency_threshold.
+        '''
+        self.sub_buckets = sub_buckets
+        self.sub_bits = sub_buckets.bit_length() - 1
+        self.buckets = [0] * ((octaves - self.sub_bits + 1) * sub_buckets)
+        self.threshold = threshold if threshold is not None else latency_threshold
+        self.count = 0
+        self.below = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def index(self, us):
+        '''
+        Bucket of a latency in us.
+        '''
+        shift = us.bit_length() - 1 - self.sub_bits
+        if shift <= 0:
+            i = us
+        else:
+            i = shift * self.sub_buckets + (us >> shift)
+        return min(i, len(self.buckets) - 1)
+
+    def upper(self, i):
+        '''
+        Upper bound of bucket i, us.
+        '''
+        shift = max(i // self.sub_buckets - 1, 0)
+        return (i - shift * self.sub_buckets + 1) << shift
+
+    def add(self, seconds):
+        self.buckets[self.index(int(seconds * 1e6))] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds <= self.threshold:
+            self.below += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        '''
+        Upper bound of the bucket holding the p-th percentile, at most the maximum, us.
+        '''
+        if self.count == 0:
+            return 0.0
+        target = p / 100.0 * self.count
+        n = 0
+        for i in range(len(self.buckets)):
+            n += self.buckets[i]
+            if n >= target:
+                break
+        return min(float(self.upper(i)), 1e6 * self.max)
+
+    def fraction_below(self):
+        '''
+        Fraction of the latencies at most threshold seconds.
+        '''
+        return self.below / float(self.count) if self.count else 1.0
+
+    def merge(self, other):
+        for i in range(len(self.buckets)):
+            self.buckets[i] += other.buckets[i]
+        self.count += other.count
+        self.below += other.below
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def snapshot(self):
+        '''
+        Returns:
+            dict of statistics, buckets holds [upper bound us, count] of the non-empty buckets.
+        '''
+        return {'count': self.count,\
+                'mean_us': 1e6 * self.total / self.count if self.count else 0.0,\
+                'max_us': 1e6 * self.max,\
+                'p50_us': self.percentile(50),\
+                'p99_us': self.percentile(99),\
+                'threshold_us': 1e6 * self.threshold,\
+                'below_threshold': self.fraction_below(),\
+                'buckets': [[self.upper(i), n] for i, n in enumerate(self.buckets) if n]}
+
+class link_metrics:
+    '''
+    Counters of a serial link or a data file being decoded.
+    '''
+    def __init__(self, name='', log_interval=None):
+        '''
+        Args:
+            name: name shown in the periodic status line, for example the port name.
+            log_interval: print a status line every log_interval seconds. None to disable.
+        '''
+        self.name = name
+        self.log_interval = log_interval
+        self.bytes_in = 0           # bytes received
+        self.frames_ok = 0          # frames with correct CRC
+        self.crc_fail = 0           # frames with wrong CRC
+        self.bytes_discarded = 0    # bytes dropped while searching for the next frame
+        self.resync = 0             # how many times bytes were dropped to find the next frame
+        self.gaps = 0               # counter/ITOW gaps
+        self.missing = 0            # samples lost in counter/ITOW gaps
+        self.dropped = 0            # decoded records dropped by flow control, see flow_control.py
+        self.spilled = 0            # decoded records spilled to disk by flow control
+        self.queue_high = 0         # most records waiting in the flow control queue
+        self.parse_latency = latency_histogram()
+        self.tstart = time.time()
+        self.tlog = self.tstart
+
+    def snapshot(self):
+        '''
+        Returns:
+            dict of all counters and the parse latency histogram.
+        '''
+        return {'name': self.name,\
+                'elapsed': time.time() - self.tstart,\
+                'bytes_in': self.bytes_in,\
+                'frames_ok': self.frames_ok,\
+                'crc_fail': self.crc_fail,\
+                'bytes_discarded': self.bytes_discarded,\
+                'resync': self.resync,\
+                'gaps': self.gaps,\
+                'missing': self.missing,\
+                'dropped': self.dropped,\
+                'spilled': self.spilled,\
+                'queue_high': self.queue_high,\
+                'parse_latency': self.parse_latency.snapshot()}
+
+    def status_line(self):
+        return '%s: %u bytes, %u frames, %u crc fail, %u resync, %u bytes discarded, '\
+               '%u gaps (%u missing), %u dropped, %u spilled, parse p50 %.0fus p99 %.0fus'% (\
+                self.name, self.bytes_in, self.frames_ok, self.crc_fail, self.resync,\
+                self.bytes_discarded, self.gaps, self.missing, self.dropped, self.spilled,\
+                self.parse_latency.percentile(50), self.parse_latency.percentile(99))
+
+    def tick(self):
+        '''
+        Print the status line if log_interval has elapsed since the last one.
+        Called by the drivers once per chunk of data, not once per packet.
+        '''
+        if self.log_interval is None:
+            return
+        tnow = time.time()
+        if tnow - self.tlog >= self.log_interval:
+            self.tlog = tnow
+            print(self.status_line())
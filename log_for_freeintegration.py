@@ -1,14 +1,19 @@
 import math
-import serial
-import serial.tools.list_ports
 from multiprocessing import Process, Pipe, Array
 import time
 import struct
 import numpy as np
 import attitude
+import orientation
 import imu38x
+import continuity
+import unit_mux
+import flow_control
+import raw_capture
+import autodetect
 import post_proccess_for_free_integration
 
+# 'baud' and 'packet_type' can be 'auto', to be detected when logging starts, see autodetect.py
 units = [
             {
                 'name':'bad',\
@@ -32,47 +37,61 @@ units = [
 
 log_dir = './log_data/'
 log_file = 'log.csv'
+# counter gaps found during logging
+gap_file = 'gaps.csv'
+# wait at most recv_timeout seconds for data from any unit
+recv_timeout = 0.1
+# a unit that sends nothing for silent_timeout seconds is silent, and the next unit paces logging
+silent_timeout = 1.0
+# records waiting for the logger in each unit process, and what to do when there are more,
+#   see flow_control.policies
+queue_size = 1000
+queue_policy = 'spill'
+# raw bytes of each unit are written to log_dir + name + raw_ext before decoding, with host
+#   timestamps, see raw_capture.py
+raw_ext = '.bin'
 
 
-def log_imu38x(port, baud, packet, pipe):
-    imu38x_unit = imu38x.imu38x(port, baud, packet_type=packet, pipe=pipe)
-    imu38x_unit.start()
+def log_imu38x(port, baud, packet, pipe, shared=None, raw_file=None):
+    link = flow_control.unit_link(pipe, queue_policy, queue_size, shared=shared)
+    raw = raw_capture.raw_capture(raw_file) if raw_file is not None else None
+    imu38x_unit = imu38x.imu38x(port, baud, packet_type=packet, pipe=link, raw=raw)
+    link.metrics = imu38x_unit.metrics
+    raw_capture.exit_on_terminate()
+    try:
+        imu38x_unit.start()
+    finally:
+        if raw is not None:
+            raw.close()
+        link.close(1.0)
 
-def orientation(data, ori):
+def check_counter(unit, latest, row):
+    '''
+    check counter continuity of a sample received from a unit
     '''
-    change coordiante according to ori.
-    Args:
-        data: nx3 numpy array
-        ori: a string including +x, -x +y, -y, +z, -z, for example: '-y+x+z'
-    Return:
-        data after coordinate change
+    if unit['continuity'] is not None:
+        unit['continuity'].update(latest[unit['counter_idx']], row)
+
+def log_line(f, time_interval, cntr, acc, gyro):
     '''
-    map = {'+x': [0, 1],\
-           '-x': [0, -1],\
-           '+y': [1, 1],\
-           '-y': [1, -1],\
-           '+z': [2, 1],\
-           '-z': [2, -1]}
-    ori = ori.lower()
-    idx_x = int(0)
-    sgn_x = 1
-    idx_y = int(1)
-    sgn_y = 1
-    idx_z = int(2)
-    sgn_z = 1
-    if len(ori) == 6:
-        if ori[0:2] in map:
-            idx_x = int(map[ori[0:2]][0])
-            sgn_x = map[ori[0:2]][1]
-        if ori[2:4] in map:
-            idx_y = int(map[ori[2:4]][0])
-            sgn_y = map[ori[2:4]][1]
-        if ori[4:6] in map:
-            idx_z = int(map[ori[4:6]][0])
-            sgn_z = map[ori[4:6]][1]
-        data[0], data[1], data[2] =\
-            sgn_x * data[idx_x], sgn_y * data[idx_y], sgn_z * data[idx_z]
-    return data
+    log one line of data to file
+    '''
+    fmt = "%f, %u, "                    # itow, packet timer
+    fmt += "%f, %f, %f, %f, %f, %f, "   # 1st unit's acc and gyro
+    fmt += "%f, %f, %f, %f, %f, %f, "   # 2nd unit's acc and gyro
+    fmt += "%f, %f, %f, %f, %f, %f, "   # lla/vel
+    fmt += "%f, %f, %f\n"               # Euler angles.
+    lines = fmt% (\
+                    time_interval, cntr,\
+                    acc[0], acc[1], acc[2],\
+                    gyro[0], gyro[1], gyro[2],\
+                    acc[3], acc[4], acc[5],\
+                    gyro[3], gyro[4], gyro[5],\
+                    0, 0, 0, 0, 0, 0,\
+                    0, 0, 0
+                    )
+    f.write(lines)
+    f.flush()
 
 if __name__ == "__main__":
     #### create log file
@@ -89,8 +108,10 @@ if __name__ == "__main__":
     #### connect to units
     enabled_units = []
     num_units = 0
+    mux = unit_mux.unit_mux(recv_timeout, silent_timeout)
+    unit_idx = {}
     for i in units:
-        if i['enable']:
+        if i['enable'] and autodetect.configure(i):
             enabled_units.append(i)
             num_units += 1
             ### create pipes
@@ -98,59 +119,70 @@ if __name__ == "__main__":
             if i['unit_type'].lower() == 'imu38x':
                 process_target = log_imu38x
             i['pipe'] = Pipe()
+            i['flow'] = flow_control.shared_counters()
             i['process'] = Process( target=process_target,\
                                     args=(i['port'], i['baud'],\
-                                    i['packet_type'], i['pipe'][1])
+                                    i['packet_type'], i['pipe'][1],\
+                                    i['flow'], log_dir + i['name'] + raw_ext)
                                   )
             i['process'].daemon = True
             i['process'].start()
+            i['continuity'], i['counter_idx'] = continuity.checker_for(i['packet_type'],\
+                                                                      unit=i['name'])
+            i['ori'] = orientation.from_config(i)
+            unit_idx[i['name']] = num_units-1
+            mux.add(i['name'], i['pipe'][0])
             print('Connected to ' + i['name'] + ' on ' + i['port'])
     #### start log
     # start time, to calculate recv interval
     tstart = time.time()
-    cntr = np.zeros((3,))
+    cntr = np.zeros((num_units,))
     acc = np.zeros((3*num_units,))
     gyro = np.zeros((3*num_units,))
+    row = 0
     try:
-        while num_units:
-            # 1. timer interval
-            tnow = time.time()
-            time_interval = tnow-tstart
-            tstart = tnow
-            # 2. get latest data
-            for i in range(num_units):
-                latest = None
-                if i == 0:
-                    latest = enabled_units[i]['pipe'][0].recv()
-                else:
-                    while enabled_units[i]['pipe'][0].poll():
-                        latest = enabled_units[i]['pipe'][0].recv()
-                if latest is not None:
-                    cntr[i] = latest[0]
-                    acc[i*3:(i+1)*3] = latest[1]
-                    gyro[i*3:(i+1)*3] = latest[2]
-            # 3. log data to file
-            fmt = "%f, %u, "                    # itow, packet timer
-            fmt += "%f, %f, %f, %f, %f, %f, "   # 1st unit's acc and gyro
-            fmt += "%f, %f, %f, %f, %f, %f, "   # 2nd unit's acc and gyro
-            fmt += "%f, %f, %f, %f, %f, %f, "   # lla/vel
-            fmt += "%f, %f, %f\n"               # Euler angles.
-            lines = fmt% (\
-                            time_interval, cntr[0],\
-                            acc[0], acc[1], acc[2],\
-                            gyro[0], gyro[1], gyro[2],\
-                            acc[3], acc[4], acc[5],\
-                            gyro[3], gyro[4], gyro[5],\
-                            0, 0, 0, 0, 0, 0,\
-                            0, 0, 0
-                            )
-            f.write(lines)
-            f.flush()
+        while num_units and not mux.all_closed():
+            # 1. get data from all units, a line is logged for each sample of the pacing unit,
+            #   which is the first unit still sending data
+            msgs = mux.recv()
+            pace = mux.pace()
+            for name, latest in msgs:
+                if isinstance(latest, str):
+                    continue
+                i = unit_idx[name]
+                check_counter(enabled_units[i], latest, row)
+                cntr[i] = latest[0]
+                acc[i*3:(i+1)*3] = latest[1]
+                gyro[i*3:(i+1)*3] = latest[2]
+                if enabled_units[i]['ori'] is not None:
+                    enabled_units[i]['ori'].apply(acc[i*3:(i+1)*3])
+                    enabled_units[i]['ori'].apply(gyro[i*3:(i+1)*3])
+                if name != pace:
+                    continue
+                # 2. timer interval
+                tnow = time.time()
+                time_interval = tnow-tstart
+                tstart = tnow
+                # 3. log data to file. The counter column is always the first unit's, so
+                #   that it does not switch units when another unit paces logging.
+                log_line(f, time_interval, cntr[0], acc, gyro)
+                row += 1
     except KeyboardInterrupt:
-        print("Stop logging, preparing data for simulation...")
-        f.close()
-        for i in enabled_units:
-            i['process'].terminate()
-            i['process'].join()
-        post_proccess_for_free_integration.post_processing(data_file)
+        pass
+    print("Stop logging, preparing data for simulation...")
+    f.close()
+    gap_report = log_dir + gap_file
+    append = False
+    for i in enabled_units:
+        i['process'].terminate()
+        i['process'].join()
+        print(flow_control.status_line(i['name'], i['flow']))
+        if i['continuity'] is not None:
+            print(i['continuity'].summary())
+            i['continuity'].write_report(gap_report, append)
+            append = True
+    if not append:
+        gap_report = None
+    post_proccess_for_free_integration.post_processing(data_file, gap_report=gap_report,\
+                                                       units=[i['name'] for i in enabled_units])
     
\ No newline at end of file
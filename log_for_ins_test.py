@@ -1,25 +1,31 @@
 import math
-import serial
-import serial.tools.list_ports
 from multiprocessing import Process, Pipe, Array
 import time
 import struct
 import numpy as np
 import attitude
+import orientation
 import openimu
 import imu38x
 import ins1000
-import kml.dynamic_kml as kml
+import trajectory_export
 import post_proccess_for_ins_test
-from tkinter import filedialog
+import ref_interp
+import raw_capture
 import os
+import sys
 
 #port:  file name, baud: 0 , means open logged data, ascII
 #### INS381
-file_path = filedialog.askopenfilename(
-                                      initialdir=os.getcwd(),
-                                      title="Please select a file name for processing:",
-                                    )
+# the data file is the first argument, or is picked in a file dialog
+if len(sys.argv) > 1:
+    file_path = sys.argv[1]
+else:
+    from tkinter import filedialog
+    file_path = filedialog.askopenfilename(
+                                          initialdir=os.getcwd(),
+                                          title="Please select a file name for processing:",
+                                        )
 print(file_path)
 ins381_unit = {'port':file_path,\
             'baud':0,\
@@ -40,56 +46,35 @@ log_dir = os.path.dirname(file_path)
 # log_file = 'log.csv'
 log_file = os.path.basename(file_path).replace('.txt', '_decoded.csv')
 print('start time:', tm)
+# raw capture of the INS381 with host timestamps, see raw_capture.py. Only when logging a
+#   serial port, None to disable.
+raw_file = os.path.join(log_dir, time.strftime("raw_%Y%m%d_%H%M%S.bin", time.localtime()))
 # log duration
 log_duraton = float("inf")    #float("inf")
-# dynamic kml
+# live kml/geojson tracks in ./kml/, decimated, with a separate latest position file
 enable_kml = True
+# INS1000 latency compared with the INS381, s, see ref_interp.estimate_latency
+ref_latency = 0.0
+# converts the INS381 gps_itow (ms) to the INS1000 time base (s)
+itow_scale = 0.001
+# all INS1000 records, resampled at the logged INS381 times when logging ends
+ref = ref_interp.ref_interp(ref_latency)
 
-def log_imu38x(port, baud, packet, pipe):
-    imu38x_unit = imu38x.imu38x(port, baud, packet_type=packet, pipe=pipe)
-    imu38x_unit.start(reset=True, reset_cmd='55555352007E4F')
+def log_imu38x(port, baud, packet, pipe, raw_file=None):
+    raw = raw_capture.raw_capture(raw_file) if raw_file is not None and baud > 0 else None
+    imu38x_unit = imu38x.imu38x(port, baud, packet_type=packet, pipe=pipe, raw=raw)
+    raw_capture.exit_on_terminate()
+    try:
+        imu38x_unit.start(reset=True, reset_cmd='55555352007E4F')
+    finally:
+        if raw is not None:
+            raw.close()
 
 def log_ins1000(port, baud, pipe):
     ins = ins1000.ins1000(port, baud, pipe)
     ins.start()
 
 
-def orientation(data, ori):
-    '''
-    change coordiante according to ori.
-    Args:
-        data: nx3 numpy array
-        ori: a string including +x, -x +y, -y, +z, -z, for example: '-y+x+z'
-    Return:
-        data after coordinate change
-    '''
-    map = {'+x': [0, 1],\
-           '-x': [0, -1],\
-           '+y': [1, 1],\
-           '-y': [1, -1],\
-           '+z': [2, 1],\
-           '-z': [2, -1]}
-    ori = ori.lower()
-    idx_x = int(0)
-    sgn_x = 1
-    idx_y = int(1)
-    sgn_y = 1
-    idx_z = int(2)
-    sgn_z = 1
-    if len(ori) == 6:
-        if ori[0:2] in map:
-            idx_x = int(map[ori[0:2]][0])
-            sgn_x = map[ori[0:2]][1]
-        if ori[2:4] in map:
-            idx_y = int(map[ori[2:4]][0])
-            sgn_y = map[ori[2:4]][1]
-        if ori[4:6] in map:
-            idx_z = int(map[ori[4:6]][0])
-            sgn_z = map[ori[4:6]][1]
-        data[0], data[1], data[2] =\
-            sgn_x * data[idx_x], sgn_y * data[idx_y], sgn_z * data[idx_z]
-    return data
-
 def end_log(f, p_ins381, p_ins1000):
     print("Stop logging, preparing data for simulation...")
     f.close()
@@ -99,6 +84,16 @@ def end_log(f, p_ins381, p_ins1000):
     if ins1000_unit['enable']:
         p_ins1000.terminate()
         p_ins1000.join()
+        if ref.n:
+            ref.save(os.path.join(log_dir, 'ref.npz'))
+        # at least 2 records to interpolate between
+        if ref.n >= 2:
+            ref_file = data_file.replace('.csv', '_ref.csv')
+            n_valid = ref_interp.resample_log(ref, data_file, ref_file, itow_scale)
+            print('INS1000 reference resampled at %u INS381 samples: %s'% (n_valid, ref_file))
+    if enable_kml:
+        ins381_track.close()
+        ins1000_track.close()
     post_proccess_for_ins_test.post_processing(data_file)
 
 if __name__ == "__main__":
@@ -118,7 +113,7 @@ if __name__ == "__main__":
         process_target = log_imu38x
         p_ins381 = Process(target=process_target,\
                         args=(ins381_unit['port'], ins381_unit['baud'],\
-                              ins381_unit['packet_type'], child_conn_nxp)
+                              ins381_unit['packet_type'], child_conn_nxp, raw_file)
                        )
         p_ins381.daemon = True
         p_ins381.start()
@@ -166,6 +161,7 @@ if __name__ == "__main__":
     ins381_lla = np.zeros((3,))
     ins381_vel = np.zeros((3,))
     ins381_euler = np.zeros((3,))
+    ins381_ori = orientation.from_config(ins381_unit)
     # data from ins1000
     ref_lla = np.zeros((3,))
     ref_vel = np.zeros((3,))
@@ -176,7 +172,9 @@ if __name__ == "__main__":
     num_sat = 0
     pps = 0
     # logging
-    counter = 0
+    if enable_kml:
+        ins381_track = trajectory_export.trajectory_writer('./kml/ins381', 'ffff0000')
+        ins1000_track = trajectory_export.trajectory_writer('./kml/ins1000', 'ff0000ff')
     log_start_time = time.time()
     try:
         while True:
@@ -203,15 +201,16 @@ if __name__ == "__main__":
                 ins381_lla = np.array(latest_ins381[4])
                 ins381_vel = np.array(latest_ins381[5])
                 ins381_euler = np.array(latest_ins381[6])
-                if 'orientation' in ins381_unit:
-                    ins381_acc = orientation(ins381_acc, ins381_unit['orientation'])
-                    ins381_gyro = orientation(ins381_gyro, ins381_unit['orientation'])
+                if ins381_ori is not None:
+                    ins381_ori.apply(ins381_acc)
+                    ins381_ori.apply(ins381_gyro)
             # 3. ins1000 time, lla, vel and quat
             if ins1000_unit['enable']:
                 # ins1000 can be of higher sampling rate, get the latest one
                 latest_ref = None
                 while parent_conn_ins1000.poll():
                     latest_ref = parent_conn_ins1000.recv()
+                    ref.add(latest_ref)
                 if latest_ref is not None:
                     ref_lla = np.array(latest_ref[1])
                     ref_vel = np.array(latest_ref[2])
@@ -255,10 +254,8 @@ if __name__ == "__main__":
             # print(ins381_lla, fix_type, num_sat, gps_update, pps, gps_itow)
             f.write(lines)
             f.flush()
-            counter += 1
-            if enable_kml and counter == 10:
-                counter = 0
-                kml.gen_kml('./kml/ins381.kml', ins381_lla, ins381_euler[2], 'ffff0000')
-                kml.gen_kml('./kml/ins1000.kml', ref_lla, ref_euler[0], 'ff0000ff')
+            if enable_kml:
+                ins381_track.add(ins381_lla, ins381_euler[2])
+                ins1000_track.add(ref_lla, ref_euler[0])
     except KeyboardInterrupt:
         end_log(f, p_ins381, p_ins1000)
@@ -1,6 +1,4 @@
 import math
-import serial
-import serial.tools.list_ports
 from multiprocessing import Process, Pipe, Array
 import time
 import struct
@@ -9,8 +7,9 @@ import attitude
 import openimu
 import imu38x
 import ins1000
-import kml.dynamic_kml as kml
 import post_proccess_for_ins_test
+import allan
+import raw_capture
 
 #### INS381
 mtlt_01 = {'port':'COM30',\
@@ -39,10 +38,27 @@ log_dir = './log_data/'
 log_file1 = '1.csv'
 log_file2 = '2.csv'
 log_file3 = '3.csv'
+# raw capture of each unit with host timestamps next to its csv, see raw_capture.py.
+#   None to disable.
+raw_ext = '.bin'
+# sample rate of the units, Hz. When set, the Allan deviation of acc and gyro is estimated
+#   while logging and the noise terms are printed at the end. None to disable.
+allan_rate = None
+# samples buffered before updating the Allan deviation
+allan_block = 1000
 
-def log_imu38x(port, baud, packet, pipe):
-    imu38x_unit = imu38x.imu38x(port, baud, packet_type=packet, pipe=pipe)
-    imu38x_unit.start()
+def log_imu38x(port, baud, packet, pipe, raw_file=None):
+    raw = raw_capture.raw_capture(raw_file) if raw_file is not None else None
+    imu38x_unit = imu38x.imu38x(port, baud, packet_type=packet, pipe=pipe, raw=raw)
+    raw_capture.exit_on_terminate()
+    try:
+        imu38x_unit.start()
+    finally:
+        if raw is not None:
+            raw.close()
+
+def raw_file(log_file):
+    return log_dir + log_file.replace('.csv', raw_ext) if raw_ext is not None else None
 
 if __name__ == "__main__":
     print('%s is mtlt_01.' % mtlt_01['port'])
@@ -56,7 +72,7 @@ if __name__ == "__main__":
         process_target = log_imu38x
         p1 = Process(target=process_target,\
                      args=(mtlt_01['port'], mtlt_01['baud'],\
-                     mtlt_01['packet_type'], child_conn_1)
+                     mtlt_01['packet_type'], child_conn_1, raw_file(log_file1))
                     )
         p1.daemon = True
         p1.start()
@@ -66,7 +82,7 @@ if __name__ == "__main__":
         process_target = log_imu38x
         p2 = Process(target=process_target,\
                      args=(mtlt_02['port'], mtlt_02['baud'],\
-                     mtlt_02['packet_type'], child_conn_2)
+                     mtlt_02['packet_type'], child_conn_2, raw_file(log_file2))
                     )
         p2.daemon = True
         p2.start()
@@ -76,7 +92,7 @@ if __name__ == "__main__":
         process_target = log_imu38x
         p3 = Process(target=process_target,\
                      args=(mtlt_03['port'], mtlt_03['baud'],\
-                     mtlt_03['packet_type'], child_conn_3)
+                     mtlt_03['packet_type'], child_conn_3, raw_file(log_file3))
                     )
         p3.daemon = True
         p3.start()
@@ -116,6 +132,14 @@ if __name__ == "__main__":
     acc3 = np.zeros((3,))
     gyro3 = np.zeros((3,))
     euler3 = np.zeros((3,))
+    # streaming Allan deviation of acc and gyro of each unit
+    allan_units = []
+    if allan_rate is not None:
+        for i in (mtlt_01, mtlt_02, mtlt_03):
+            if i['enable']:
+                i['allan'] = allan.allan_stream(allan_rate, 6)
+                i['allan_buf'] = []
+                allan_units.append(i)
 
     # logging
     fmt = "%f, %u, "                    # time_interval, packet timer
@@ -144,6 +168,13 @@ if __name__ == "__main__":
                 acc3 = np.array(latest3[2])
                 gyro3 = np.array(latest3[1])
                 euler3 = np.array(latest3[0])
+            for i, acc, gyro in ((mtlt_01, acc1, gyro1), (mtlt_02, acc2, gyro2),\
+                                 (mtlt_03, acc3, gyro3)):
+                if 'allan' in i:
+                    i['allan_buf'].append(np.hstack((acc, gyro)))
+                    if len(i['allan_buf']) >= allan_block:
+                        i['allan'].update(np.array(i['allan_buf']))
+                        i['allan_buf'] = []
 
             # 5. log data to file
             lines = fmt% (\
@@ -173,4 +204,9 @@ if __name__ == "__main__":
         if mtlt_01['enable']:
             p1.terminate()
             p1.join()
+        for i in allan_units:
+            i['allan'].update(np.array(i['allan_buf']).reshape(-1, 6))
+            taus, dev, counts = i['allan'].result()
+            print('Allan deviation of %s:'% i['port'])
+            print(allan.report(taus, dev, ['ax', 'ay', 'az', 'wx', 'wy', 'wz']))
         post_proccess_for_ins_test.post_processing(data_file1)
@@ -1,15 +1,17 @@
 import math
-import serial
-import serial.tools.list_ports
 from multiprocessing import Process, Pipe, Array
 import time
-import struct
 import numpy as np
 import attitude
+import orientation
 import imu38x
-import socket
+import telemetry
+import latency_trace
+import raw_capture
+import autodetect
 
 #### openimu
+# 'baud' and 'packet_type' can be 'auto', to be detected when logging starts, see autodetect.py
 openimu_unit = {'port':'COM7',\
             'baud':230400,\
             'packet_type':'e1',\
@@ -26,55 +28,42 @@ imu381_unit = {'port':'COM30',\
 
 log_dir = './log_data/'
 log_file = 'log.csv'
+# udp telemetry: '<broadcast>', a unicast IP or a multicast group
+PORT = 10600
+network = '<broadcast>'
+# datagrams per second, samples in between are batched
+telemetry_rate = 20.0
+telemetry_float32 = False
+# latency of the samples from the serial port to the log file, printed and appended to
+#   trace_file every trace_interval seconds. trace_file None to only print. The fraction of
+#   the samples written within trace_threshold seconds is reported.
+trace_interval = 10.0
+trace_file = log_dir + 'latency.jsonl'
+trace_threshold = 0.010
+# raw capture of each unit with host timestamps, log_dir + openimu/imu381 + raw_ext, see
+#   raw_capture.py. None to disable.
+raw_ext = '.bin'
 
 
-def log_imu38x(port, baud, packet, pipe):
-    imu38x_unit = imu38x.imu38x(port, baud, packet_type=packet, pipe=pipe)
-    imu38x_unit.start()
-
-def orientation(data, ori):
-    '''
-    change coordiante according to ori.
-    Args:
-        data: nx3 numpy array
-        ori: a string including +x, -x +y, -y, +z, -z, for example: '-y+x+z'
-    Return:
-        data after coordinate change
-    '''
-    map = {'+x': [0, 1],\
-           '-x': [0, -1],\
-           '+y': [1, 1],\
-           '-y': [1, -1],\
-           '+z': [2, 1],\
-           '-z': [2, -1]}
-    ori = ori.lower()
-    idx_x = int(0)
-    sgn_x = 1
-    idx_y = int(1)
-    sgn_y = 1
-    idx_z = int(2)
-    sgn_z = 1
-    if len(ori) == 6:
-        if ori[0:2] in map:
-            idx_x = int(map[ori[0:2]][0])
-            sgn_x = map[ori[0:2]][1]
-        if ori[2:4] in map:
-            idx_y = int(map[ori[2:4]][0])
-            sgn_y = map[ori[2:4]][1]
-        if ori[4:6] in map:
-            idx_z = int(map[ori[4:6]][0])
-            sgn_z = map[ori[4:6]][1]
-        data[0], data[1], data[2] =\
-            sgn_x * data[idx_x], sgn_y * data[idx_y], sgn_z * data[idx_z]
-    return data
+def log_imu38x(port, baud, packet, pipe, raw_file=None):
+    raw = raw_capture.raw_capture(raw_file) if raw_file is not None else None
+    imu38x_unit = imu38x.imu38x(port, baud, packet_type=packet,\
+                                pipe=latency_trace.traced_pipe(pipe), raw=raw)
+    raw_capture.exit_on_terminate()
+    try:
+        imu38x_unit.start()
+    finally:
+        if raw is not None:
+            raw.close()
 
 if __name__ == "__main__":
-    # udp
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    PORT = 10600
-    network = '<broadcast>'
+    # udp, same fields as log_multiprocessing.py: openimu roll/pitch, imu381 roll/pitch,
+    #   ref roll/pitch and accel, zeros when not available
+    publisher = telemetry.telemetry_publisher(9, network, PORT, telemetry_rate, telemetry_float32)
     #### find ports
+    for i in (openimu_unit, imu381_unit):
+        if i['enable'] and not autodetect.configure(i):
+            i['enable'] = False
     if not openimu_unit['enable']:
         openimu_unit['port'] = None
     if not imu381_unit['enable']:
@@ -90,7 +79,8 @@ if __name__ == "__main__":
         process_target = log_imu38x
         p_openimu = Process(target=process_target,\
                             args=(openimu_unit['port'], openimu_unit['baud'],\
-                                  openimu_unit['packet_type'], child_conn_openimu)
+                                  openimu_unit['packet_type'], child_conn_openimu,\
+                                  log_dir + 'openimu' + raw_ext if raw_ext else None)
                            )
         p_openimu.daemon = True
         p_openimu.start()
@@ -101,7 +91,8 @@ if __name__ == "__main__":
         process_target = log_imu38x
         p_imu381 = Process(target=process_target,\
                            args=(imu381_unit['port'], imu381_unit['baud'],\
-                           imu381_unit['packet_type'], child_conn_imu381)
+                           imu381_unit['packet_type'], child_conn_imu381,\
+                           log_dir + 'imu381' + raw_ext if raw_ext else None)
                        )
         p_imu381.daemon = True
         p_imu381.start()
@@ -127,6 +118,9 @@ if __name__ == "__main__":
     openimu_gyro = np.zeros((3,))
     openimu_euler = np.zeros((3,))
     imu381_euler = np.zeros((3,))
+    openimu_ori = orientation.from_config(openimu_unit)
+    imu381_ori = orientation.from_config(imu381_unit)
+    trace = latency_trace.tracer(trace_interval, trace_file, threshold=trace_threshold)
     # logging
     try:
         while True:
@@ -136,26 +130,26 @@ if __name__ == "__main__":
             tstart = tnow
             # 2. openimu, timer, acc and gyro, Euler angles
             if openimu_unit['enable']:
-                latest_openimu = parent_conn_openimu.recv()
+                latest_openimu = trace.received('openimu', parent_conn_openimu.recv())
                 openimu_timer = latest_openimu[0]
                 openimu_euler = np.array(latest_openimu[1])
                 openimu_gyro = np.array(latest_openimu[2])
                 openimu_acc = np.array(latest_openimu[3])
-                if 'orientation' in openimu_unit:
-                    openimu_acc = orientation(openimu_acc, openimu_unit['orientation'])
-                    openimu_gyro = orientation(openimu_gyro, openimu_unit['orientation'])
+                if openimu_ori is not None:
+                    openimu_ori.apply(openimu_acc)
+                    openimu_ori.apply(openimu_gyro)
             if imu381_unit['enable']:
                 latest_imu381 = None
                 while parent_conn_imu381.poll():
-                    latest_imu381 = parent_conn_imu381.recv()
+                    latest_imu381 = trace.received('imu381', parent_conn_imu381.recv())
                 # imu381_timer = latest_imu381[0]
                 # imu381_acc = np.array(latest_imu381[3])
                 # imu381_gyro = np.array(latest_imu381[2])
                 if latest_imu381 is not None:
                     imu381_euler = np.array(latest_imu381[0])
-                # if 'orientation' in openimu_unit:
-                #     imu381_acc = orientation(imu381_acc, imu381_unit['orientation'])
-                #     imu381_gyro = orientation(imu381_gyro, imu381_unit['orientation'])
+                # if imu381_ori is not None:
+                #     imu381_ori.apply(imu381_acc)
+                #     imu381_ori.apply(imu381_gyro)
             # 3. log data to file
             fmt = "%f, %u, "                    # itow, packet timer
             fmt += "%.9f, %.9f, %.9f, %.9f, %.9f, %.9f, "   # openimu acc and gyro
@@ -168,15 +162,17 @@ if __name__ == "__main__":
                             imu381_euler[0], imu381_euler[1], imu381_euler[2])
             f.write(lines)
             f.flush()
+            trace.written()
             # 4. send over UDP
-            packed_data = struct.pack('dddddddddd', openimu_euler[0], openimu_euler[1],\
-                                        imu381_euler[0], imu381_euler[1],\
-                                        0, 0,\
-                                        0, 0, 0, 0)
-            s.sendto(packed_data, (network, PORT))
+            publisher.publish((openimu_euler[0], openimu_euler[1],\
+                               imu381_euler[0], imu381_euler[1],\
+                               0, 0,\
+                               0, 0, 0), tnow)
     except KeyboardInterrupt:
         print("Stop logging, preparing data for simulation...")
         f.close()
+        publisher.close()
+        trace.close()
         if openimu_unit['enable']:
             p_openimu.terminate()
             p_openimu.join()
@@ -0,0 +1,254 @@
+'''
+Fast loading of the comma separated logs written by the loggers, and of NavView exports.
+Large logs are read in chunks of whole lines, so memory does not grow with the length of
+the log, and chunks can be parsed in parallel because each one is a byte range of the file.
+load() parses a whole log into one preallocated array and caches it as a .npy sidecar
+next to the log, so that the next run maps the cached array instead of parsing text.
+'''
+import io
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+chunk_bytes = 16*1024*1024
+# number of threads parsing chunks, None for the number of CPUs
+threads = None
+# cache parsed logs as <log>.npy
+use_cache = True
+
+# layouts of the logs
+#   delimiter: column delimiter
+#   skip_header: lines before the data
+#   header: start of the first line, to recognize the log. None if there is no fixed header.
+#   columns: column names, None if unknown
+layouts = {
+    # log_for_ins_test.py
+    'ins_test': {'delimiter': ',',\
+                 'skip_header': 1,\
+                 'header': 'itow (s), openimu timer, ',\
+                 'columns': ['itow', 'timer', 'ax', 'ay', 'az', 'wx', 'wy', 'wz',\
+                             'lat', 'lon', 'alt', 'vn', 've', 'vd', 'roll', 'pitch', 'yaw',\
+                             'ref_lat', 'ref_lon', 'ref_alt', 'ref_vn', 'ref_ve', 'ref_vd',\
+                             'ref_roll', 'ref_pitch', 'ref_yaw', 'hdop', 'hacc', 'vacc',\
+                             'gps_update', 'fix_type', 'num_sat', 'pps']},
+    # log_for_freeintegration.py, the header lists fewer columns than each line has
+    'freeintegration': {'delimiter': ',',\
+                        'skip_header': 1,\
+                        'header': 'recv_interval (s), openimu timer,ax (m/s2), ay (m/s2), az (m/s2),'\
+                                  'wx (deg/s), wy (deg/s), wz (deg/s),roll (deg), pitch (deg), yaw (deg),'\
+                                  'ref_roll',\
+                        'columns': ['recv_interval', 'timer', 'ax0', 'ay0', 'az0', 'wx0', 'wy0', 'wz0',\
+                                    'ax1', 'ay1', 'az1', 'wx1', 'wy1', 'wz1',\
+                                    'lat', 'lon', 'alt', 'vn', 've', 'vd', 'yaw', 'pitch', 'roll']},
+    # log_for_mtlt_test.py
+    'mtlt': {'delimiter': ',',\
+             'skip_header': 1,\
+             'header': 'recv_interval (s), openimu timer,ax (m/s2), ay (m/s2), az (m/s2),'\
+                       'wx (deg/s), wy (deg/s), wz (deg/s),roll (deg), pitch (deg), yaw (deg)\n',\
+             'columns': ['recv_interval', 'timer', 'ax', 'ay', 'az', 'wx', 'wy', 'wz',\
+                         'roll', 'pitch', 'yaw']},
+    # tab separated NavView export: time, acc (g), gyro (deg/s), ...
+    'nav_view': {'delimiter': '\t',\
+                 'skip_header': 15,\
+                 'header': None,\
+                 'columns': None},
+}
+
+def chunk_ranges(file_name, size=chunk_bytes, skip_header=1):
+    '''
+    Split a file into byte ranges of whole lines.
+    Args:
+        size: approximate size of a chunk, bytes.
+        skip_header: number of lines at the start of the file that are not data.
+    Returns:
+        generator of (start, end) byte offsets.
+    '''
+    f = open(file_name, 'rb')
+    for i in range(skip_header):
+        f.readline()
+    start = f.tell()
+    file_size = os.fstat(f.fileno()).st_size
+    while start < file_size:
+        f.seek(min(start + size, file_size))
+        # complete the last line of the chunk
+        f.readline()
+        end = min(f.tell(), file_size)
+        yield start, end
+        start = end
+    f.close()
+
+def read_range(file_name, start, end, usecols=None, delimiter=','):
+    '''
+    Parse the lines in a byte range of a file.
+    Returns:
+        (rows, columns) array. Empty lines are skipped.
+    '''
+    f = open(file_name, 'rb')
+    f.seek(start)
+    text = f.read(end - start)
+    f.close()
+    return parse(text, usecols, delimiter)
+
+def parse(text, usecols=None, delimiter=','):
+    '''
+    Parse delimited numbers with the C parser of np.loadtxt.
+    When it fails, delimiters ending the lines (NavView ends its rows with a tab) are removed,
+    then an incomplete last line, for example of a log still being written, is dropped. Other
+    empty fields are parsed by np.genfromtxt as nan, and lines with a different number of
+    columns are skipped.
+    Returns:
+        2-D array, (0, 0) when there is no data.
+    '''
+    if not text.strip():
+        return np.zeros((0, 0))
+    try:
+        return np.loadtxt(io.BytesIO(text), delimiter=delimiter, usecols=usecols, ndmin=2)
+    except ValueError:
+        pass
+    text = re.sub(re.escape(delimiter.encode()) + rb'[ \t]*(?=\r?$)', b'', text, flags=re.M)
+    last = text.rstrip().rfind(b'\n')
+    for i in (text, text[:last+1]):
+        if not i.strip():
+            return np.zeros((0, 0))
+        try:
+            return np.loadtxt(io.BytesIO(i), delimiter=delimiter, usecols=usecols, ndmin=2)
+        except ValueError:
+            pass
+    return np.genfromtxt(io.BytesIO(text), delimiter=delimiter, usecols=usecols, ndmin=2,\
+                         invalid_raise=False)
+
+def read_chunks(file_name, size=chunk_bytes, skip_header=1, usecols=None, delimiter=','):
+    '''
+    Read a log chunk by chunk.
+    Returns:
+        generator of (rows, columns) arrays.
+    '''
+    for start, end in chunk_ranges(file_name, size, skip_header):
+        data = read_range(file_name, start, end, usecols, delimiter)
+        if data.shape[0]:
+            yield data
+
+def guess_layout(file_name):
+    '''
+    Recognize a log by its first line.
+    Returns:
+        name of the layout in layouts, None if unknown.
+    '''
+    f = open(file_name, 'r', errors='replace')
+    lines = [f.readline() for i in range(layouts['nav_view']['skip_header'] + 1)]
+    f.close()
+    first = lines[0]
+    # longest header first, the header of mtlt is the start of the header of freeintegration
+    for name in sorted(layouts, key=lambda i: -len(layouts[i]['header'] or '')):
+        header = layouts[name]['header']
+        if header is not None and first.startswith(header):
+            return name
+    if '\t' in lines[-1]:
+        # NavView exports are tab separated after a text header of 15 lines
+        return 'nav_view'
+    return None
+
+def column_index(layout, names):
+    '''
+    Column indices of names in a layout.
+    '''
+    columns = layouts[layout]['columns']
+    return [columns.index(i) for i in names]
+
+def cache_file(file_name):
+    return file_name + '.npy'
+
+def load_cache(file_name):
+    '''
+    Cached array of a log, None if there is no cache or the log changed since it was cached.
+    The cache is valid when its modification time equals that of the log.
+    '''
+    cache = cache_file(file_name)
+    try:
+        if os.stat(cache).st_mtime_ns != os.stat(file_name).st_mtime_ns:
+            return None
+        # copy-on-write map: loads instantly and can be modified in memory
+        return np.load(cache, mmap_mode='c')
+    except (OSError, ValueError):
+        return None
+
+def save_cache(file_name, data):
+    '''
+    Save the cache of a log and stamp it with the modification time of the log.
+    The cache is only an optimization, a log in a read-only directory is not cached.
+    '''
+    cache = cache_file(file_name)
+    tmp = cache + '.tmp.npy'
+    try:
+        st = os.stat(file_name)
+        np.save(tmp, data)
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp, cache)
+    except OSError:
+        pass
+
+def load(file_name, layout=None, usecols=None, cache=None, n_threads=None, skip_header=None,\
+         delimiter=None):
+    '''
+    Load a whole log.
+    Chunks are parsed by a pool of threads into one preallocated float64 array.
+    Args:
+        file_name: log file.
+        layout: name of the layout in layouts, None to recognize it by the header.
+        usecols: columns to return, None for all.
+        cache: use and update the .npy cache, None for use_cache. Only whole logs are
+            cached, usecols are taken from the cached array.
+        n_threads: number of threads, None for threads.
+        skip_header, delimiter: override those of the layout, for logs of other tools.
+    Returns:
+        (rows, columns) array.
+    '''
+    if layout is None:
+        layout = guess_layout(file_name)
+        if layout is None:
+            layout = 'ins_test'
+    if cache is None:
+        cache = use_cache
+    if cache:
+        data = load_cache(file_name)
+        if data is not None:
+            return data if usecols is None else data[:, usecols]
+    if n_threads is None:
+        n_threads = threads if threads is not None else (os.cpu_count() or 1)
+    fmt = dict(layouts[layout])
+    if skip_header is not None:
+        fmt['skip_header'] = skip_header
+    if delimiter is not None:
+        fmt['delimiter'] = delimiter
+    ranges = list(chunk_ranges(file_name, chunk_bytes, fmt['skip_header']))
+    read = lambda r: read_range(file_name, r[0], r[1], None if cache else usecols, fmt['delimiter'])
+    if n_threads > 1 and len(ranges) > 1:
+        pool = ThreadPoolExecutor(n_threads)
+        chunks = list(pool.map(read, ranges))
+        pool.shutdown()
+    else:
+        chunks = [read(i) for i in ranges]
+    chunks = [i for i in chunks if i.shape[0]]
+    n_cols = max([i.shape[1] for i in chunks] + [0])
+    data = np.empty((sum(i.shape[0] for i in chunks), n_cols))
+    row = 0
+    for i in chunks:
+        data[row:row+i.shape[0]] = i
+        row += i.shape[0]
+    if cache:
+        save_cache(file_name, data)
+        if usecols is not None:
+            data = data[:, usecols]
+    return data
+
+if __name__ == "__main__":
+    # parse and cache logs
+    #   python log_loader.py log1.csv [log2.csv ...]
+    for file_name in sys.argv[1:]:
+        tstart = time.time()
+        data = load(file_name)
+        print('%s: %s, %u rows x %u columns in %.3f s'% (file_name, guess_layout(file_name),\
+              data.shape[0], data.shape[1], time.time() - tstart))
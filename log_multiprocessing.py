@@ -1,31 +1,45 @@
 import math
-import serial
-import serial.tools.list_ports
 import threading
 from multiprocessing import Process, Pipe, Array
 import time
-import socket
-import struct
 import numpy as np
 import attitude
 import imu38x
 import ins1000
+import unit_mux
+import telemetry
+import latency_trace
+import autodetect
 
 a2_size = 37
 nav_size = 127
 enable_ref = False
+# find the ports and bauds of the units by the packets they send, see detect_com_ports
+autodetect_ports = False
+# wait at most recv_timeout seconds for data from any unit
+recv_timeout = 0.1
+# a unit that sends nothing for silent_timeout seconds is silent
+silent_timeout = 1.0
 
-s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+# udp telemetry: '<broadcast>', a unicast IP or a multicast group
 PORT = 10600
 network = '<broadcast>'
+# datagrams per second, samples in between are batched
+telemetry_rate = 20.0
+telemetry_float32 = False
+# latency of the samples from the serial port to the log file, printed and appended to
+#   trace_file every trace_interval seconds. trace_file None to only print. The fraction of
+#   the samples written within trace_threshold seconds is reported.
+trace_interval = 10.0
+trace_file = 'latency.jsonl'
+trace_threshold = 0.010
 
 def log_new(port, baud, pipe):
-    new_unit = imu38x.imu38x(port, baud, 'A1', pipe=pipe)
+    new_unit = imu38x.imu38x(port, baud, 'A1', pipe=latency_trace.traced_pipe(pipe))
     new_unit.start()
 
 def log_old(port, baud, pipe):
-    old_unit = imu38x.imu38x(port, baud, pipe=pipe)
+    old_unit = imu38x.imu38x(port, baud, pipe=latency_trace.traced_pipe(pipe))
     old_unit.start()
 
 def log_ref(port, baud, pipe):
@@ -35,6 +49,7 @@ def log_ref(port, baud, pipe):
 def get_com_ports():
     new_port = None
     old_port = None
+    import serial.tools.list_ports
     # automatically choose com ports
     while new_port is None or old_port is None:
         port_list = list(serial.tools.list_ports.comports())
@@ -56,11 +71,30 @@ def get_com_ports():
                 old_port = 'COM' + str(port_nums[0])
     return new_port, old_port
 
+def detect_com_ports():
+    '''
+    Ports and bauds of the units by the packets they send, see autodetect.py: the unit with
+    the new algorithm sends A1 packets, the unit with the old algorithm A2 packets.
+    Returns:
+        new port, new baud, old port, old baud. None for a unit not found.
+    '''
+    found = {}
+    for i in autodetect.detect_ports(names=['imu38x']):
+        print(autodetect.summary(i))
+        found[i['packet_type']] = i
+    new = found.get('A1', {})
+    old = found.get('A2', {})
+    return new.get('port'), new.get('baud'), old.get('port'), old.get('baud')
+
 if __name__ == "__main__":
     # find ports
     new_port = 'COM7'
     old_port = 'COM30'
     ref_port = None
+    new_baud = 115200
+    old_baud = 115200
+    if autodetect_ports:
+        new_port, new_baud, old_port, old_baud = detect_com_ports()
     # if not enable_ref:
     #     [new_port, old_port] = get_com_ports()
     #     ref_port = None
@@ -73,8 +107,8 @@ if __name__ == "__main__":
     parent_conn_old, child_conn_old = Pipe()
     # data
 
-    p_new = Process(target=log_new, args=(new_port, 115200, child_conn_new))
-    p_old = Process(target=log_old, args=(old_port, 115200, child_conn_old))
+    p_new = Process(target=log_new, args=(new_port, new_baud, child_conn_new))
+    p_old = Process(target=log_old, args=(old_port, old_baud, child_conn_old))
     p_new.daemon = True
     p_old.daemon = True
     p_new.start()
@@ -90,47 +124,66 @@ if __name__ == "__main__":
     f = open(file, 'w+')
     f.truncate()
 
+    # receive from all units without blocking on any one of them
+    mux = unit_mux.unit_mux(recv_timeout, silent_timeout)
+    mux.add('new', parent_conn_new)
+    mux.add('old', parent_conn_old)
+    if enable_ref:
+        mux.add('ref', parent_conn_ref)
+
     # starting time
     tstart = time.time()
 
     # start logging
-    latest_new = []
-    latest_old = [[0.0, 0.0, 0.0]]
+    latest_new = ([0.0, 0.0, 0.0], [0.0, 0.0, 0.0], [0.0, 0.0, 0.0])
+    latest_old = ([0.0, 0.0, 0.0], [0.0, 0.0, 0.0], [0.0, 0.0, 0.0])
     latest_ref = np.zeros((3,))
+    latest_quat = None
+    # new roll/pitch, old roll/pitch, ref roll/pitch, new accel xyz
+    publisher = telemetry.telemetry_publisher(9, network, PORT, telemetry_rate, telemetry_float32)
+    trace = latency_trace.tracer(trace_interval, trace_file, threshold=trace_threshold)
     while True:
-        # wait for data ready
-        tnow = time.time()
-        time_interval = tnow-tstart
-        tstart = tnow
-        # print(data_new[:])
-        # time.sleep(1)
-        latest_new = parent_conn_new.recv()
-        latest_old = parent_conn_old.recv()
-        if( enable_ref and parent_conn_ref.poll()):
-            quat = parent_conn_ref.recv()[3]
-            latest_ref = attitude.quat2euler(quat)
-            latest_ref[0] = latest_ref[0] * attitude.R2D
-            latest_ref[1] = latest_ref[1] * attitude.R2D
-            latest_ref[2] = latest_ref[2] * attitude.R2D
-            # print(latest_ref)
-        # print(d1)
-        lines = "%f, %f, %f, %f, %f, %f, %f, %f, %f, %f, %f, %f, %f, %f, %f, %f, %e, %e, %e, %f, %f, %f, %f, %f, %f\n" % (\
-                time_interval,\
-                latest_new[0][0], latest_new[0][1], latest_new[0][2],\
-                latest_old[0][0], latest_old[0][1], latest_old[0][2],\
-                latest_ref[2], latest_ref[1], latest_ref[0],\
-                latest_new[1][0], latest_new[1][1], latest_new[1][2],\
-                latest_new[2][0], latest_new[2][1], latest_new[2][2],\
-                latest_new[2][0], latest_new[2][1], latest_new[2][2],\
-                latest_old[1][0], latest_old[1][1], latest_old[1][2],\
-                latest_old[2][0], latest_old[2][1], latest_old[2][2])
-        f.write(lines)
-        f.flush()
-        # udp
-        packed_data = struct.pack('dddddddddd', latest_new[0][0], latest_new[0][1],\
-                                    latest_old[0][0], latest_old[0][1],\
-                                    latest_ref[2], latest_ref[1],\
-                                    latest_new[2][0], latest_new[2][1], latest_new[2][2],\
-                                    latest_new[2][0]
-                                    )
-        s.sendto(packed_data, (network, PORT))
+        # wait for data from any unit. A line is logged for each sample of the unit with the
+        #   new algorithm, or of the unit with the old algorithm when the new one is silent.
+        msgs = mux.recv()
+        pace = mux.pace(['new', 'old'])
+        for name, latest in msgs:
+            latest = trace.received(name, latest)
+            if isinstance(latest, str):
+                continue
+            if name == 'ref':
+                latest_quat = latest[3]
+                continue
+            if name == 'new':
+                latest_new = latest
+            else:
+                latest_old = latest
+            if name != pace:
+                continue
+            tnow = time.time()
+            time_interval = tnow-tstart
+            tstart = tnow
+            if latest_quat is not None:
+                latest_ref = attitude.quat2euler(latest_quat)
+                latest_ref[0] = latest_ref[0] * attitude.R2D
+                latest_ref[1] = latest_ref[1] * attitude.R2D
+                latest_ref[2] = latest_ref[2] * attitude.R2D
+                latest_quat = None
+            lines = "%f, %f, %f, %f, %f, %f, %f, %f, %f, %f, %f, %f, %f, %f, %f, %f, %e, %e, %e, %f, %f, %f, %f, %f, %f\n" % (\
+                    time_interval,\
+                    latest_new[0][0], latest_new[0][1], latest_new[0][2],\
+                    latest_old[0][0], latest_old[0][1], latest_old[0][2],\
+                    latest_ref[2], latest_ref[1], latest_ref[0],\
+                    latest_new[1][0], latest_new[1][1], latest_new[1][2],\
+                    latest_new[2][0], latest_new[2][1], latest_new[2][2],\
+                    latest_new[2][0], latest_new[2][1], latest_new[2][2],\
+                    latest_old[1][0], latest_old[1][1], latest_old[1][2],\
+                    latest_old[2][0], latest_old[2][1], latest_old[2][2])
+            f.write(lines)
+            f.flush()
+            trace.written()
+            # udp
+            publisher.publish((latest_new[0][0], latest_new[0][1],\
+                               latest_old[0][0], latest_old[0][1],\
+                               latest_ref[2], latest_ref[1],\
+                               latest_new[2][0], latest_new[2][1], latest_new[2][2]), tnow)
@@ -1,5 +1,6 @@
 import serial
 import time
+import raw_capture
 
 # serial config
 port = 'com7'
@@ -16,10 +17,9 @@ if ser.isOpen():
 else:
     print("Fail to open %s"% port)
     exit()
-# open log file
+# open log file, with host timestamps of the chunks in log_file + '.ts'
 data_file = log_dir + log_file
-f = open(data_file, 'wb+')
-f.truncate()
+f = raw_capture.raw_capture(data_file)
 
 # reset unit
 print('Reset unit.')
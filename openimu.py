@@ -1,30 +1,40 @@
 import math
-import serial
-import serial.tools.list_ports
 import struct
+import time
+import link_metrics
+import continuity
 
 z1_size = 47
 z1_header = bytearray.fromhex('5555')
 class openimu:
-    def __init__(self, port, baud=115200, pipe=None):
+    def __init__(self, port, baud=115200, pipe=None, log_interval=None):
         '''Initialize and then start ports search and autobaud process
+        If log_interval is not None, link metrics are printed every log_interval seconds.
         '''
         self.port = port
         self.baud = baud
+        import serial
         self.ser = serial.Serial(self.port, self.baud)
         self.open = self.ser.isOpen()
         self.latest = []
         self.ready = False
         self.pipe = pipe
+        # link health
+        self.metrics = link_metrics.link_metrics(str(port), log_interval)
+        # timer continuity, gaps are counted in self.metrics
+        self.continuity, self.counter_idx = continuity.checker_for('z1', unit=str(port),\
+                                                                   metrics=self.metrics)
 
     def start(self):
         if self.open:
             bf = bytearray(z1_size*2)
             n_bytes = 0
+            metrics = self.metrics
             while True:
                 data = self.ser.read(z1_size)
                 ## parse new
                 n = len(data)
+                metrics.bytes_in += n
                 for i in range(n):
                     bf[n_bytes + i] = data[i]
                 n_bytes += n
@@ -35,7 +45,11 @@ class openimu:
                         calculated_crc = calc_crc(bf[2:bf[4]+5])
                         # decode
                         if packet_crc == calculated_crc:
+                            t0 = time.perf_counter()
                             self.latest = parse_z1(bf[5:bf[4]+5])
+                            metrics.parse_latency.add(time.perf_counter() - t0)
+                            metrics.frames_ok += 1
+                            self.continuity.update(self.latest[self.counter_idx])
                             # print(self.latest)
                             if self.pipe is not None:
                                 self.pipe.send(self.latest)
@@ -44,14 +58,28 @@ class openimu:
                             for i in range(n_bytes):
                                 bf[i] = bf[i+z1_size]
                         else:
-                            print('openimu crc fail')
-                            n_bytes = sync_packet(bf, n_bytes, z1_header)
+                            metrics.crc_fail += 1
+                            n_bytes = self.resync(bf, n_bytes)
                     else:
-                        n_bytes = sync_packet(bf, n_bytes, z1_header)
+                        n_bytes = self.resync(bf, n_bytes)
+                metrics.tick()
+
+    def resync(self, bf, n_bytes):
+        '''
+        search for the next packet header, and count bytes dropped from the buffer
+        '''
+        new_n_bytes = sync_packet(bf, n_bytes, z1_header)
+        if new_n_bytes != n_bytes:
+            self.metrics.resync += 1
+            self.metrics.bytes_discarded += n_bytes - new_n_bytes
+        return new_n_bytes
 
     def get_latest(self):
         return self.latest
 
+    def get_metrics(self):
+        return self.metrics.snapshot()
+
 def parse_z1(payload):
     '''
     parse z1 packet
@@ -0,0 +1,175 @@
+'''
+Command line entry point of the log tools.
+    python openimu_log.py capture COM7 230400 -o log.bin     raw serial capture
+    python openimu_log.py decode log.bin e2 -o e2_table      decode through decode_cache
+    python openimu_log.py inspect log.bin --summary          see read_bin.py
+    python openimu_log.py postprocess log_decoded.csv        see post_proccess_for_ins_test.py
+    python openimu_log.py postprocess capture_dir --replay   see replay_pipeline.py
+    python openimu_log.py detect /dev/ttyUSB0                see autodetect.py
+    python openimu_log.py startup                            startup time of each command
+Only the modules a command needs are imported, when it runs: numpy is not imported to
+capture, pyserial not to decode, and nothing imports tkinter or matplotlib. Short jobs, for
+example thousands of decode jobs of a batch, do not pay for what they do not use.
+'''
+import sys
+import time
+import argparse
+
+# modules imported by each command, used by the startup benchmark
+command_modules = {'capture': ['serial'],\
+                   'decode': ['decode_cache', 'columnar'],\
+                   'inspect': ['read_bin'],\
+                   'detect': ['autodetect'],\
+                   'postprocess': ['post_proccess_for_ins_test', 'replay_pipeline']}
+
+def capture(args):
+    '''
+    Write raw bytes of a serial port to a file until Ctrl+C or the duration ends.
+    '''
+    import serial
+    ser = serial.Serial(args.port, args.baud)
+    f = open(args.output, 'wb')
+    if args.reset is not None:
+        ser.write(bytearray.fromhex(args.reset))
+    ser.reset_input_buffer()
+    n = 0
+    tstart = time.time()
+    print('Capturing %s at %u to %s.'% (args.port, args.baud, args.output))
+    try:
+        while args.duration is None or time.time() - tstart < args.duration:
+            if ser.in_waiting:
+                data = ser.read(ser.in_waiting)
+                f.write(data)
+                n += len(data)
+            else:
+                time.sleep(0.001)
+    except KeyboardInterrupt:
+        pass
+    ser.close()
+    f.close()
+    print('%u bytes in %.1f s'% (n, time.time() - tstart))
+
+def decode(args):
+    '''
+    Decode all packets of a type in a raw log through the decode cache, and optionally
+    write them as a columnar table.
+    '''
+    import decode_cache
+    tstart = time.time()
+    arrays = decode_cache.decode_file(args.file, args.type, args.device)
+    n = list(arrays.values())[0].shape[0] if arrays else 0
+    if args.output is not None:
+        import columnar
+        columnar.write_table(args.output, arrays)
+    print('%u %s packets in %.3f s'% (n, args.type, time.time() - tstart))
+
+def inspect(argv):
+    import read_bin
+    read_bin.main(argv)
+
+def detect(argv):
+    import autodetect
+    autodetect.main(argv)
+
+def postprocess(args):
+    '''
+    Simulation files of decoded logs (post_proccess_for_ins_test.py), or of raw captures
+    and directories of raw captures (replay_pipeline.py) with --replay.
+    '''
+    import os
+    tstart = time.time()
+    if args.replay:
+        import replay_pipeline
+        dirs = [i for i in args.files if os.path.isdir(i)]
+        files = [i for i in args.files if not os.path.isdir(i)]
+        results = [replay_pipeline.process_dir(i, args.output, args.jobs, args.type) for i in dirs]
+        if len(files) == 1:
+            results.append({files[0]: replay_pipeline.process(files[0], args.output, args.type)})
+        elif files:
+            # each capture to <output>/<capture name>/, as the captures of a directory
+            results.append(replay_pipeline.process_files(files, args.output, args.jobs, args.type))
+        for result in results:
+            for j in result:
+                print('%s: %u rows'% (j, result[j]))
+    else:
+        import post_proccess_for_ins_test
+        if len(args.files) > 1:
+            rows = post_proccess_for_ins_test.post_processing_sessions(args.files, args.jobs)
+        else:
+            rows = [post_proccess_for_ins_test.post_processing(args.files[0], args.output)]
+        for i, n in zip(args.files, rows):
+            print('%s: %u rows'% (i, n))
+    print('%.3f s'% (time.time() - tstart))
+
+def startup(args):
+    '''
+    Startup time of the commands: each one is measured as a new interpreter importing this
+    module and the modules the command imports, repeated args.repeat times.
+    '''
+    import os
+    import subprocess
+    here = os.path.dirname(os.path.abspath(__file__))
+    def run(code):
+        times = []
+        for i in range(args.repeat):
+            t0 = time.perf_counter()
+            p = subprocess.run([sys.executable, '-c', code], cwd=here,\
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            times.append(time.perf_counter() - t0)
+        times.sort()
+        return times[len(times)//2], p.returncode == 0
+    tests = [('python', 'pass'), ('openimu_log', 'import openimu_log')]
+    for name in sorted(command_modules):
+        tests.append((name, 'import openimu_log, ' + ', '.join(command_modules[name])))
+    print('%-12s %10s'% ('command', 'median ms'))
+    for name, code in tests:
+        t, ok = run(code)
+        print('%-12s %10.1f%s'% (name, t * 1000.0, '' if ok else '  (import failed)'))
+
+# commands whose arguments are all passed to the main() of their module. They are dispatched
+#   before argparse, which would take options such as -s or --help for its own.
+passthrough = {'inspect': inspect, 'detect': detect}
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] in passthrough:
+        return passthrough[argv[0]](argv[1:])
+    parser = argparse.ArgumentParser(description='Capture, decode, inspect and post-process logs.')
+    sub = parser.add_subparsers(dest='command')
+    p = sub.add_parser('capture', help='raw serial capture')
+    p.add_argument('port')
+    p.add_argument('baud', type=int)
+    p.add_argument('-o', '--output', default='log.bin', help='raw log file')
+    p.add_argument('-d', '--duration', type=float, default=None, help='capture duration, s')
+    p.add_argument('--reset', default=None, help='command sent before capturing, in hex')
+    p.set_defaults(func=capture)
+    p = sub.add_parser('decode', help='decode a raw log through the decode cache')
+    p.add_argument('file')
+    p.add_argument('type', help='packet type, for example e2')
+    p.add_argument('--device', default='imu38x', choices=['imu38x', 'rtk330l'])
+    p.add_argument('-o', '--output', default=None, help='write a columnar table to this dir')
+    p.set_defaults(func=decode)
+    # listed for the help only, see passthrough
+    sub.add_parser('inspect', help='inspect a raw log, arguments of read_bin.py', add_help=False)
+    sub.add_parser('detect', help='baud rate and packet type of units or raw logs, '\
+                   'arguments of autodetect.py', add_help=False)
+    p = sub.add_parser('postprocess', help='simulation files of logs')
+    p.add_argument('files', nargs='+')
+    p.add_argument('--replay', action='store_true',\
+                   help='files are raw captures or directories of raw captures')
+    p.add_argument('-t', '--type', default=None, help='packet type of raw captures')
+    p.add_argument('-o', '--output', default=None, help='output dir')
+    p.add_argument('-j', '--jobs', type=int, default=None, help='number of processes')
+    p.set_defaults(func=postprocess)
+    p = sub.add_parser('startup', help='startup time of each command')
+    p.add_argument('-n', '--repeat', type=int, default=10)
+    p.set_defaults(func=startup)
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+'''
+Remap sensor axes to the mounting orientation.
+The orientation is compiled once, from a string such as '-y+x+z' or from a mounting DCM,
+and then applied to each sample or to whole arrays of samples.
+'''
+import numpy as np
+import attitude
+
+axis_map = {'+x': (0, 1.0),\
+            '-x': (0, -1.0),\
+            '+y': (1, 1.0),\
+            '-y': (1, -1.0),\
+            '+z': (2, 1.0),\
+            '-z': (2, -1.0)}
+
+class orientation:
+    def __init__(self, ori=None, dcm=None):
+        '''
+        Args:
+            ori: a string including +x, -x +y, -y, +z, -z, for example: '-y+x+z'. The new
+                x axis is the old -y axis, the new y axis is the old x axis, and so on.
+            dcm: 3x3 matrix instead of ori, data_new = dcm * data_old.
+            Without ori and dcm, the orientation is identity.
+        '''
+        self.idx = (0, 1, 2)
+        self.sgn = (1.0, 1.0, 1.0)
+        self.is_perm = True
+        if ori is not None:
+            ori = ori.lower()
+            if len(ori) != 6 or ori[0:2] not in axis_map or ori[2:4] not in axis_map or\
+               ori[4:6] not in axis_map:
+                raise ValueError('Invalid orientation: %s'% ori)
+            idx_sgn = [axis_map[ori[0:2]], axis_map[ori[2:4]], axis_map[ori[4:6]]]
+            self.idx = tuple(i[0] for i in idx_sgn)
+            self.sgn = tuple(i[1] for i in idx_sgn)
+            if sorted(self.idx) != [0, 1, 2]:
+                raise ValueError('Invalid orientation, repeated axis: %s'% ori)
+            self.matrix = np.zeros((3, 3))
+            self.matrix[(0, 1, 2), self.idx] = self.sgn
+        elif dcm is not None:
+            self.matrix = np.array(dcm, dtype=np.float64).reshape((3, 3))
+            # a DCM with only 0 and +/-1 is a permutation, applied without multiplications
+            a = np.abs(self.matrix)
+            if np.all((a == 0) | (a == 1)) and np.all(a.sum(axis=0) == 1) and\
+               np.all(a.sum(axis=1) == 1):
+                self.idx = tuple(int(i) for i in np.argmax(a, axis=1))
+                self.sgn = tuple(float(self.matrix[i, self.idx[i]]) for i in range(3))
+            else:
+                self.is_perm = False
+        else:
+            self.matrix = np.eye(3)
+        # rows of the matrix as floats, for applying to one sample without numpy
+        self.rows = tuple(tuple(float(x) for x in r) for r in self.matrix)
+
+    def apply(self, data):
+        '''
+        Remap one sample in place.
+        Args:
+            data: 3-element list or numpy array, for example a row of a larger array.
+        Returns:
+            data
+        '''
+        x, y, z = data[0], data[1], data[2]
+        if self.is_perm:
+            v = (x, y, z)
+            idx, sgn = self.idx, self.sgn
+            data[0] = sgn[0] * v[idx[0]]
+            data[1] = sgn[1] * v[idx[1]]
+            data[2] = sgn[2] * v[idx[2]]
+        else:
+            r0, r1, r2 = self.rows
+            data[0] = r0[0]*x + r0[1]*y + r0[2]*z
+            data[1] = r1[0]*x + r1[1]*y + r1[2]*z
+            data[2] = r2[0]*x + r2[1]*y + r2[2]*z
+        return data
+
+    def apply_array(self, data):
+        '''
+        Remap many samples.
+        Args:
+            data: nx3 numpy array.
+        Returns:
+            new nx3 array.
+        '''
+        data = np.asarray(data)
+        if self.is_perm:
+            return data[:, self.idx] * np.array(self.sgn)
+        return data.dot(self.matrix.T)
+
+def from_euler(angles, rot_seq='zyx'):
+    '''
+    Orientation of a unit mounted with the given Euler angles, see attitude.euler2dcm.
+    Args:
+        angles: 3x1 Euler angles, rad.
+        rot_seq: rotation sequence corresponding to the angles.
+    '''
+    return orientation(dcm=attitude.euler2dcm(np.array(angles), rot_seq))
+
+def from_config(unit):
+    '''
+    Compile the 'orientation' entry of a unit config dict.
+    Returns:
+        orientation, None if the unit has no orientation.
+    '''
+    if 'orientation' not in unit:
+        return None
+    return orientation(unit['orientation'])
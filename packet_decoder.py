@@ -0,0 +1,499 @@
+'''
+Typed packet decoding from a schema.
+Each packet type is described once by its byte order and fields. A decoder compiles the
+schema into a struct.Struct to decode one payload at a time, and into a numpy dtype to
+decode many payloads at once with np.frombuffer. Run without arguments, the module checks
+the schema against frames with known values (golden).
+'''
+import sys
+import struct
+import numpy as np
+import framing
+
+# bump when a schema changes, decoded data cached with an older version is discarded
+VERSION = '1'
+
+G = 9.80665
+POW_2_16 = 65536.0
+POW_2_31 = 2147483648.0
+# packet type: [byte order, [(field name, struct format, count, scale), ...]]
+# Fields named None are reserved bytes. Scaled fields are decoded as float.
+schema = {
+    'imu38x': {
+        'S0': ['>', [('accel', 'h', 3, G*20/POW_2_16),\
+                     ('gyro', 'h', 3, 1260/POW_2_16),\
+                     ('mag', 'h', 3, 2/POW_2_16),\
+                     ('temp', 'h', 4, 200/POW_2_16),\
+                     ('counter', 'H', 1, None),\
+                     ('bit', 'H', 1, None)]],
+        'S1': ['>', [('accel', 'h', 3, G*20/POW_2_16),\
+                     ('gyro', 'h', 3, 1260/POW_2_16),\
+                     ('temp', 'h', 4, 200/POW_2_16),\
+                     ('counter', 'H', 1, None),\
+                     ('bit', 'H', 1, None)]],
+        'SH': ['>', [('accel', 'i', 3, G/4e6),\
+                     ('gyro', 'i', 3, 1/2.56e5),\
+                     ('temp', 'h', 1, 400/POW_2_16),\
+                     ('counter', 'H', 1, None),\
+                     ('bit', 'H', 1, None)]],
+        'A1': ['>', [('euler', 'h', 3, 360/POW_2_16),\
+                     ('gyro', 'h', 3, 1260/POW_2_16),\
+                     ('accel', 'h', 3, G*20/POW_2_16),\
+                     ('mag', 'h', 3, 2/POW_2_16),\
+                     ('temp', 'h', 1, 200/POW_2_16),\
+                     ('itow', 'I', 1, None),\
+                     ('bit', 'H', 1, None)]],
+        'A2': ['>', [('euler', 'h', 3, 360/POW_2_16),\
+                     ('gyro', 'h', 3, 1260/POW_2_16),\
+                     ('accel', 'h', 3, G*20/POW_2_16),\
+                     ('temp', 'h', 3, 200/POW_2_16),\
+                     ('itow', 'I', 1, None),\
+                     ('bit', 'H', 1, None)]],
+        'E3': ['>', [('counter', 'I', 1, None),\
+                     ('euler', 'h', 3, 360/POW_2_16),\
+                     ('steering_angle', 'h', 1, 360/POW_2_16),\
+                     ('accel', 'h', 3, 20/POW_2_16),\
+                     ('gyro', 'h', 3, 1260/POW_2_16),\
+                     ('steering_angle_rate', 'h', 1, 1260/POW_2_16),\
+                     ('vehicle_speed', 'h', 1, 0.001),\
+                     ('ins_states', 'H', 1, None),\
+                     ('dg_states', 'H', 1, None)]],
+        'MG': ['>', [('counter', 'I', 1, None),\
+                     ('accel', 'h', 3, 20/POW_2_16),\
+                     ('gyro', 'h', 3, 1260/POW_2_16),\
+                     ('tow', 'I', 1, None),\
+                     ('ground_speed', 'h', 1, 0.001),\
+                     ('gnss_update', 'b', 1, None),\
+                     ('gnss_fix_type', 'b', 1, None),\
+                     (None, 'x', 4, None)]],
+        'SA': ['>', [('counter', 'I', 1, None),\
+                     ('steering_angle', 'h', 1, 360/POW_2_16),\
+                     ('steering_angle_rate', 'h', 1, 1260/POW_2_16),\
+                     ('steering_states', 'H', 1, None),\
+                     (None, 'x', 8, None)]],
+        'FM': ['>', [('counts', 'i', 28, None),\
+                     ('sensor_subset', 'H', 1, None),\
+                     ('sample_idx', 'H', 1, None)]],
+        'z1': ['<', [('timer', 'I', 1, None),\
+                     ('accel', 'f', 3, None),\
+                     ('gyro', 'f', 3, None),\
+                     ('mag', 'f', 3, None)]],
+        's1': ['<', [('timer', 'I', 1, None),\
+                     ('time', 'Q', 1, None),\
+                     ('accel', 'f', 3, None),\
+                     ('gyro', 'f', 3, None),\
+                     ('mag', 'f', 3, None),\
+                     ('temp', 'f', 1, None)]],
+        'a1': ['<', [('itow', 'I', 1, None),\
+                     ('time', 'd', 1, None),\
+                     ('roll', 'f', 1, None),\
+                     ('pitch', 'f', 1, None),\
+                     ('gyro', 'f', 3, None),\
+                     ('accel', 'f', 3, None),\
+                     ('op_mode', 'B', 1, None),\
+                     ('lin_accel_sw', 'B', 1, None),\
+                     ('turn_sw', 'B', 1, None)]],
+        'a2': ['<', [('itow', 'I', 1, None),\
+                     ('time', 'd', 1, None),\
+                     ('ypr', 'f', 3, None),\
+                     ('gyro', 'f', 3, None),\
+                     ('accel', 'f', 3, None)]],
+        'e1': ['<', [('timer', 'I', 1, None),\
+                     ('time', 'd', 1, None),\
+                     ('euler', 'f', 3, None),\
+                     ('accel', 'f', 3, None),\
+                     ('gyro', 'f', 3, None),\
+                     ('gyro_bias', 'f', 3, None),\
+                     ('mag', 'f', 3, None),\
+                     ('op_mode', 'B', 1, None),\
+                     ('lin_accel_sw', 'B', 1, None),\
+                     ('turn_sw', 'B', 1, None)]],
+        'e2': ['<', [('timer', 'I', 1, None),\
+                     ('time', 'd', 1, None),\
+                     ('euler', 'f', 3, None),\
+                     ('accel', 'f', 3, None),\
+                     ('accel_bias', 'f', 3, None),\
+                     ('gyro', 'f', 3, None),\
+                     ('gyro_bias', 'f', 3, None),\
+                     ('velocity', 'f', 3, None),\
+                     ('mag', 'f', 3, None),\
+                     ('lla', 'd', 3, None),\
+                     ('op_mode', 'B', 1, None),\
+                     ('lin_accel_sw', 'B', 1, None),\
+                     ('turn_sw', 'B', 1, None)]],
+        'id': ['<', [('timer', 'I', 1, None),\
+                     ('gps_heading', 'f', 1, None),\
+                     ('gps_itow', 'I', 1, None),\
+                     ('euler', 'f', 3, None),\
+                     ('accel', 'f', 3, None),\
+                     ('accel_bias', 'f', 3, None),\
+                     ('gyro', 'f', 3, None),\
+                     ('gyro_bias', 'f', 3, None),\
+                     ('velocity', 'f', 3, None),\
+                     ('gps_velocity', 'f', 3, None),\
+                     ('lla', 'd', 3, None),\
+                     ('gps_lla', 'd', 3, None),\
+                     ('op_mode', 'B', 1, None),\
+                     ('lin_accel_sw', 'B', 1, None),\
+                     ('turn_sw', 'B', 1, None)]],
+        'sd': ['<', [('timer', 'I', 1, None),\
+                     ('gyro', 'f', 3, None),\
+                     ('accel', 'f', 3, None),\
+                     ('gyro_slave', 'f', 3, None),\
+                     ('ground_speed', 'f', 1, None),\
+                     ('gnss_update', 'b', 1, None),\
+                     ('gnss_fix_type', 'b', 1, None),\
+                     ('gps_itow', 'I', 1, None)]],
+    },
+    'rtk330l': {
+        's1': ['<', [('gps_week', 'I', 1, None),\
+                     ('time_of_week', 'd', 1, 1000.0),\
+                     ('accel', 'f', 3, None),\
+                     ('gyro', 'f', 3, None)]],
+        's2': ['<', [('gps_week', 'I', 1, None),\
+                     ('time_of_week', 'd', 1, 1000.0),\
+                     ('accel', 'f', 3, None),\
+                     ('gyro', 'f', 3, None)]],
+        'iN': ['<', [('gps_week', 'I', 1, None),\
+                     ('time_of_week', 'd', 1, None),\
+                     ('ins_status', 'B', 1, None),\
+                     ('ins_pos_status', 'B', 1, None),\
+                     ('latitude', 'i', 1, 180/POW_2_31),\
+                     ('longitude', 'i', 1, 180/POW_2_31),\
+                     ('height', 'i', 1, None),\
+                     ('velocity_north', 'h', 1, None),\
+                     ('velocity_east', 'h', 1, None),\
+                     ('velocity_up', 'h', 1, None),\
+                     ('roll', 'h', 1, None),\
+                     ('pitch', 'h', 1, None),\
+                     ('heading', 'h', 1, None)]],
+        'd1': ['<', [('gps_week', 'I', 1, None),\
+                     ('time_of_week', 'd', 1, None),\
+                     ('latitude_std', 'H', 1, 0.01),\
+                     ('longitude_std', 'H', 1, 0.01),\
+                     ('height_std', 'H', 1, 0.01),\
+                     ('velocity_north_std', 'H', 1, 0.01),\
+                     ('velocity_east_std', 'H', 1, 0.01),\
+                     ('velocity_up_std', 'H', 1, 0.01),\
+                     ('roll_std', 'H', 1, 0.01),\
+                     ('pitch_std', 'H', 1, 0.01),\
+                     ('heading_std', 'H', 1, 0.01)]],
+        'd2': ['<', [('gps_week', 'I', 1, None),\
+                     ('time_of_week', 'd', 1, None),\
+                     ('latitude_std', 'H', 1, 0.01),\
+                     ('longitude_std', 'H', 1, 0.01),\
+                     ('height_std', 'H', 1, 0.01),\
+                     ('velocity_north_std', 'H', 1, 0.01),\
+                     ('velocity_east_std', 'H', 1, 0.01),\
+                     ('velocity_up_std', 'H', 1, 0.01)]],
+        'gN': ['<', [('gps_week', 'I', 1, None),\
+                     ('time_of_week', 'd', 1, None),\
+                     ('pos_mode', 'B', 1, None),\
+                     ('latitude', 'i', 1, 8/POW_2_31),\
+                     ('longitude', 'i', 1, 8/POW_2_31),\
+                     ('height', 'i', 1, 8/POW_2_31),\
+                     ('num_of_svs', 'B', 1, None),\
+                     ('hdop', 'i', 1, 8/POW_2_31),\
+                     ('vdop', 'i', 1, 8/POW_2_31),\
+                     ('tdop', 'i', 1, 8/POW_2_31),\
+                     ('diffage', 'H', 1, None),\
+                     ('velocity_north', 'h', 1, None),\
+                     ('velocity_east', 'h', 1, None),\
+                     ('velocity_up', 'h', 1, None)]],
+        'sT': ['<', [('gps_week', 'I', 1, None),\
+                     ('time_of_week', 'd', 1, None),\
+                     ('year', 'H', 1, None),\
+                     ('month', 'B', 1, None),\
+                     ('day', 'B', 1, None),\
+                     ('hour', 'B', 1, None),\
+                     ('minute', 'B', 1, None),\
+                     ('sec', 'B', 1, None),\
+                     ('imu_status', 'I', 1, None),\
+                     ('imu_temp', 'f', 1, None),\
+                     ('mcu_temp', 'f', 1, None)]],
+    }
+}
+
+class packet_decoder:
+    '''
+    Decoder of one packet type, compiled from the schema.
+    '''
+    def __init__(self, packet_type, device='imu38x'):
+        if device not in schema or packet_type not in schema[device]:
+            raise ValueError('No schema for %s packet %s'% (device, packet_type))
+        self.packet_type = packet_type
+        self.device = device
+        endian, fields = schema[device][packet_type]
+        fmt = endian
+        dtype = []
+        offset = 0
+        self.names = []
+        self.slices = []        # (start index in the unpacked tuple, count, scale)
+        n = 0
+        for name, f, count, scale in fields:
+            size = struct.calcsize('<' + f) * count
+            fmt += '%u%s'% (count, f)
+            if name is not None:
+                self.names.append(name)
+                self.slices.append((n, count, scale))
+                n += count
+                dt = np.dtype(endian + f) if f not in 'bBx' else np.dtype(f)
+                dtype.append((name, dt if count == 1 else (dt, (count,)), offset))
+            offset += size
+        self.struct = struct.Struct(fmt)
+        self.size = self.struct.size
+        self.dtype = np.dtype({'names': [i[0] for i in dtype],\
+                               'formats': [i[1] for i in dtype],\
+                               'offsets': [i[2] for i in dtype],\
+                               'itemsize': self.size})
+        self.scales = dict((name, s[2]) for name, s in zip(self.names, self.slices))
+
+    def decode(self, payload):
+        '''
+        Decode one payload.
+        Returns:
+            list of field values in schema order. Fields of more than one value are tuples,
+            or lists when scaled.
+        '''
+        data = self.struct.unpack(payload)
+        out = []
+        for start, count, scale in self.slices:
+            if count == 1:
+                v = data[start]
+                if scale is not None:
+                    v = v * scale
+            else:
+                v = data[start:start+count]
+                if scale is not None:
+                    v = [x * scale for x in v]
+            out.append(v)
+        return out
+
+    def decode_dict(self, payload):
+        return dict(zip(self.names, self.decode(payload)))
+
+    def decode_array(self, payloads):
+        '''
+        Decode many payloads at once.
+        Args:
+            payloads: bytes of concatenated payloads, or (N, size) uint8 array.
+        Returns:
+            dict of field name -> numpy array of N rows, in native byte order.
+        '''
+        if isinstance(payloads, np.ndarray):
+            payloads = np.ascontiguousarray(payloads, dtype=np.uint8).reshape(-1)
+        records = np.frombuffer(payloads, dtype=self.dtype)
+        out = {}
+        for name in self.names:
+            v = records[name]
+            scale = self.scales[name]
+            if scale is not None:
+                out[name] = v * scale
+            else:
+                out[name] = v.astype(v.dtype.newbyteorder('='))
+        return out
+
+def payload_matrix(buf, positions, size):
+    '''
+    Gather payloads of frames found in buf.
+    Args:
+        buf: bytes-like object.
+        positions: start positions of the frames in buf.
+        size: payload size.
+    Returns:
+        (N, size) uint8 array.
+    '''
+    arr = np.frombuffer(buf, dtype=np.uint8)
+    idx = np.asarray(positions, dtype=np.int64)[:, None] + framing.header_size + np.arange(size)
+    return arr[idx]
+
+def scan_file(file_name, packet_type, size, block_size=16*1024*1024):
+    '''
+    All payloads of CRC-valid frames of one type and payload size in a binary log.
+    Returns:
+        (N, size) uint8 array.
+    '''
+    scanner = framing.frame_scanner([packet_type])
+    chunks = []
+    f = open(file_name, 'rb')
+    while True:
+        data = f.read(block_size)
+        if not data:
+            break
+        buf, frames = scanner.feed(data)
+        pos = [i[1] for i in frames if i[4] and i[3] == size]
+        if pos:
+            chunks.append(payload_matrix(buf, pos, size))
+    f.close()
+    if not chunks:
+        return np.zeros((0, size), dtype=np.uint8)
+    return np.vstack(chunks)
+
+# golden vectors: device, packet type, payload packed field by field with struct, and the
+#   decoded values expected. The values are written out by hand, not computed from the
+#   schema, so a wrong format, offset, byte order or scale in the schema is caught.
+golden = [
+    ('imu38x', 'S1',\
+     struct.pack('>3h3h4hHH', 16384, -8192, 0, 1024, -2048, 512, 8192, 9830, 6554, -1638,\
+                 65535, 256),\
+     {'accel': [49.03325, -24.516625, 0.0],\
+      'gyro': [19.6875, -39.375, 9.84375],\
+      'temp': [25.0, 29.998779296875, 20.001220703125, -4.998779296875],\
+      'counter': 65535,\
+      'bit': 256}),
+    ('imu38x', 'A1',\
+     struct.pack('>3h3h3h3hhIH', 16384, -32768, 4096, 1024, -2048, 512, 16384, -8192, 0,\
+                 16384, -8192, 32767, 8192, 4275878552, 3),\
+     {'euler': [90.0, -180.0, 22.5],\
+      'gyro': [19.6875, -39.375, 9.84375],\
+      'accel': [49.03325, -24.516625, 0.0],\
+      'mag': [0.5, -0.25, 0.999969482421875],\
+      'temp': 25.0,\
+      'itow': 4275878552,\
+      'bit': 3}),
+    ('imu38x', 'A2',\
+     struct.pack('>3h3h3h3hIH', -16384, 32767, -4096, -1024, 2048, -512, -16384, 8192, 1,\
+                 8192, 9830, -1638, 123456789, 0),\
+     {'euler': [-90.0, 179.9945068359375, -22.5],\
+      'gyro': [-19.6875, 39.375, -9.84375],\
+      'accel': [-49.03325, 24.516625, 0.0029927520751953125],\
+      'temp': [25.0, 29.998779296875, -4.998779296875],\
+      'itow': 123456789,\
+      'bit': 0}),
+    ('imu38x', 's1',\
+     struct.pack('<IQ3f3f3ff', 4000000000, 1099511627781, 0.0, -1.0, 0.5, 0.125, -0.25, 3.0,\
+                 0.25, -0.5, 0.75, 25.5),\
+     {'timer': 4000000000,\
+      'time': 1099511627781,\
+      'accel': [0.0, -1.0, 0.5],\
+      'gyro': [0.125, -0.25, 3.0],\
+      'mag': [0.25, -0.5, 0.75],\
+      'temp': 25.5}),
+    ('imu38x', 'e1',\
+     struct.pack('<Id3f3f3f3f3fBBB', 4000000000, 1234.5, 10.5, -20.25, 179.75, 0.0, -1.0, 0.5,\
+                 0.125, -0.25, 3.0, 0.0078125, -0.015625, 0.0, 0.25, -0.5, 0.75, 2, 1, 0),\
+     {'timer': 4000000000,\
+      'time': 1234.5,\
+      'euler': [10.5, -20.25, 179.75],\
+      'accel': [0.0, -1.0, 0.5],\
+      'gyro': [0.125, -0.25, 3.0],\
+      'gyro_bias': [0.0078125, -0.015625, 0.0],\
+      'mag': [0.25, -0.5, 0.75],\
+      'op_mode': 2,\
+      'lin_accel_sw': 1,\
+      'turn_sw': 0}),
+    ('imu38x', 'e2',\
+     struct.pack('<Id3f3f3f3f3f3f3f3dBBB', 7, 0.01, 10.5, -20.25, 179.75, 0.0, -1.0, 0.5,\
+                 0.001953125, -0.00390625, 0.0, 0.125, -0.25, 3.0, 0.0078125, -0.015625, 0.0,\
+                 1.5, -2.75, 0.0625, 0.25, -0.5, 0.75, 31.1234567, 121.7654321, 12.5, 255, 0, 3),\
+     {'timer': 7,\
+      'time': 0.01,\
+      'euler': [10.5, -20.25, 179.75],\
+      'accel': [0.0, -1.0, 0.5],\
+      'accel_bias': [0.001953125, -0.00390625, 0.0],\
+      'gyro': [0.125, -0.25, 3.0],\
+      'gyro_bias': [0.0078125, -0.015625, 0.0],\
+      'velocity': [1.5, -2.75, 0.0625],\
+      'mag': [0.25, -0.5, 0.75],\
+      'lla': [31.1234567, 121.7654321, 12.5],\
+      'op_mode': 255,\
+      'lin_accel_sw': 0,\
+      'turn_sw': 3}),
+    ('rtk330l', 's1',\
+     struct.pack('<Id3f3f', 2200, 345600.125, 0.0, -9.75, 0.5, 0.125, -0.25, 3.0),\
+     {'gps_week': 2200,\
+      'time_of_week': 345600125.0,\
+      'accel': [0.0, -9.75, 0.5],\
+      'gyro': [0.125, -0.25, 3.0]}),
+    ('rtk330l', 'gN',\
+     struct.pack('<IdBiiiBiiiHhhh', 2200, 345600.2, 4, 1073741824, -536870912, 268435456, 23,\
+                 134217728, 268435456, 67108864, 5, -100, 200, -3),\
+     {'gps_week': 2200,\
+      'time_of_week': 345600.2,\
+      'pos_mode': 4,\
+      'latitude': 4.0,\
+      'longitude': -2.0,\
+      'height': 1.0,\
+      'num_of_svs': 23,\
+      'hdop': 0.5,\
+      'vdop': 1.0,\
+      'tdop': 0.25,\
+      'diffage': 5,\
+      'velocity_north': -100,\
+      'velocity_east': 200,\
+      'velocity_up': -3}),
+]
+
+def decode_file(file_name, packet_type, device='imu38x'):
+    '''
+    Vectorized decoding of all packets of one type in a binary log.
+    Returns:
+        dict of field name -> numpy array.
+    '''
+    decoder = packet_decoder(packet_type, device)
+    return decoder.decode_array(scan_file(file_name, packet_type, decoder.size))
+
+def verify_file(file_name, packet_type, device='imu38x'):
+    '''
+    Decode a recorded log with both the struct and the numpy path, and compare.
+    Returns:
+        (number of packets, number of packets that differ)
+    '''
+    decoder = packet_decoder(packet_type, device)
+    payloads = scan_file(file_name, packet_type, decoder.size)
+    arrays = decoder.decode_array(payloads)
+    n_diff = 0
+    for i in range(payloads.shape[0]):
+        values = decoder.decode(payloads[i].tobytes())
+        for name, v in zip(decoder.names, values):
+            if not np.allclose(np.asarray(v, dtype=np.float64),\
+                               arrays[name][i].astype(np.float64), equal_nan=True):
+                n_diff += 1
+                break
+    return payloads.shape[0], n_diff
+
+def verify_golden(vectors=None):
+    '''
+    Decode the frames of the golden vectors with both the struct and the numpy path, and
+    compare with the expected values.
+    Args:
+        vectors: list of (device, packet type, payload, expected values), None for golden.
+    Returns:
+        list of (device, packet type, field name, expected, decoded) of the fields that differ.
+    '''
+    failed = []
+    for device, packet_type, payload, expected in (vectors if vectors is not None else golden):
+        decoder = packet_decoder(packet_type, device)
+        frame = framing.build_frame(packet_type, payload)
+        buf, frames = framing.frame_scanner([packet_type]).feed(frame)
+        pos = [i[1] for i in frames if i[4] and i[3] == decoder.size]
+        if len(pos) != 1 or set(expected) != set(decoder.names):
+            failed.append((device, packet_type, None, len(payload), decoder.size))
+            continue
+        values = decoder.decode_dict(payload_matrix(buf, pos, decoder.size)[0].tobytes())
+        arrays = decoder.decode_array(payload_matrix(buf, pos, decoder.size))
+        for name in decoder.names:
+            v = np.asarray(expected[name], dtype=np.float64)
+            for decoded in (np.asarray(values[name], dtype=np.float64),\
+                            arrays[name][0].astype(np.float64)):
+                if decoded.shape != v.shape or not np.allclose(decoded, v, rtol=1e-12, atol=0.0):
+                    failed.append((device, packet_type, name, expected[name], decoded.tolist()))
+                    break
+    return failed
+
+if __name__ == "__main__":
+    # without arguments, check the schema against the golden vectors
+    #   python packet_decoder.py
+    # decode a binary log and check that both decoding paths agree
+    #   python packet_decoder.py log.bin e2 [imu38x]
+    if len(sys.argv) < 3:
+        failed = verify_golden()
+        for i in failed:
+            print('%s %s %s: expected %s, decoded %s'% i)
+        print('%u golden vectors, %u fields differ'% (len(golden), len(failed)))
+        sys.exit(1 if failed else 0)
+    file_name = sys.argv[1]
+    packet_type = sys.argv[2]
+    device = sys.argv[3] if len(sys.argv) > 3 else 'imu38x'
+    n, n_diff = verify_file(file_name, packet_type, device)
+    print('%u %s packets, %u differ between struct and numpy decoding'% (n, packet_type, n_diff))
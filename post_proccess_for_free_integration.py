@@ -2,9 +2,9 @@ import os
 import math
 import threading
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.mlab as mlab
 import attitude
+import log_loader
+import continuity
 
 
 #### prepare data for free integration simulation
@@ -18,8 +18,23 @@ zero_ini_vel = True
 # using averaged accelerometer output to get initial pitch and roll,
 #   otherwiese averaged INS1000 output will be used.
 acc_ini_att = True
+# rollover of the packet counter of the first unit logged in the 2nd column, S1 counter by
+#   default. Simulation windows with counter gaps are rejected.
+counter_wrap = continuity.counter_def['S1'][1]
+# rows removed from the beginning of the logged file
+skip_rows = 100
 
-def post_processing(data_file, nav_view=False):
+def post_processing(data_file, nav_view=False, gap_report=None, units=None):
+    '''
+    Args:
+        data_file: file logged by log_for_freeintegration.py, or NavView export if nav_view is True.
+        nav_view: data_file is a NavView export.
+        gap_report: optional gap report written during logging. Row indices in the report
+            count data rows of data_file.
+        units: names of the logged units in column order, as in the gap report. The gaps
+            of each unit only reject the simulation windows of that unit. None to reject
+            the windows of all units for the gaps of any unit.
+    '''
     #### create data dir
     if not os.path.exists(data_dir):
         try:
@@ -28,16 +43,16 @@ def post_processing(data_file, nav_view=False):
             raise IOError('Cannot create dir: %s.'% data_dir)
     #### read logged file
     if nav_view:
-        data = np.genfromtxt(data_file, delimiter='\t', skip_header=15)
+        data = log_loader.load(data_file, 'nav_view')
         acc0 = data[:, 1:4] * 9.80665
         gyro0 = data[:, 4:7]
         lla = np.zeros((acc0.shape[0], 3))
         vel = np.zeros((acc0.shape[0], 3))
         euler = np.zeros((acc0.shape[0], 3))
     else:
-        data = np.genfromtxt(data_file, delimiter=',', skip_header=1)
+        data = log_loader.load(data_file, 'freeintegration')
         # remove zero LLA/Vel/att from ins1000
-        data = data[100:, :]
+        data = data[skip_rows:, :]
         acc0 = data[:, 2:5]
         gyro0 = data[:, 5:8]
         acc1 = data[:, 8:11]
@@ -45,11 +60,28 @@ def post_processing(data_file, nav_view=False):
         lla = data[:, 14:17]
         vel = data[:, 17:20]
         euler = data[:, 22:19:-1]
+    # counter gaps of each unit, in the logged counter of the first unit and found during
+    #   logging
+    gaps = [None, None]
+    if not nav_view:
+        names = units if units is not None else [None, None]
+        events = continuity.check_array(data[:, 1], counter_wrap)
+        continuity.write_gap_report(data_dir + 'gaps.csv', events, names[0] or 'log')
+        logged = np.array([i[0] for i in events if i[1] == continuity.GAP], dtype=np.int64)
+        for i in range(2):
+            gaps[i] = logged if i == 0 or units is None else np.zeros((0,), dtype=np.int64)
+            if gap_report is not None and os.path.exists(gap_report) and i < len(names):
+                gaps[i] = np.hstack((gaps[i],\
+                                     continuity.load_gap_report(gap_report, names[i]) - skip_rows))
+            print('%u counter gaps of %s found in %s'% (gaps[i].size,\
+                  names[i] if i < len(names) and names[i] else 'unit %u'% i, data_file))
     '''
     Generate logged files.
     You can specify multiple start points to generate multiple sets of data for simulaiton. 
     '''
     # get data before motion to calculate initial states
+    # matplotlib is only imported when the start of motion is picked on a plot
+    import matplotlib.pyplot as plt
     plt.ion()
     plt.plot(acc0)
     plt.grid(True)
@@ -63,12 +95,30 @@ def post_processing(data_file, nav_view=False):
         idx0 = 1
     # generate initial states and sensor files
     nxp_dir = data_dir + 'nxp/'
-    gen_sim_files(gyro0, acc0, lla, vel, euler, idx0, nxp_dir)
+    gen_sim_files(gyro0, acc0, lla, vel, euler, idx0, nxp_dir, gaps[0])
     if not nav_view:
         bosch_dir = data_dir + 'bosch/'
-        gen_sim_files(gyro1, acc1, lla, vel, euler, idx0, bosch_dir)
+        gen_sim_files(gyro1, acc1, lla, vel, euler, idx0, bosch_dir, gaps[1])
 
-def gen_sim_files(gyro, acc, lla, vel, euler, idx0, dir):
+def gen_sim_files(gyro, acc, lla, vel, euler, idx0, dir, gaps=None):
+    '''
+    Generate initial states and sensor files for simulation from data[idx0:idx0+10s].
+    Args:
+        gaps: optional row indices of counter gaps, see continuity.py. The window is
+            rejected if there is any gap in it.
+    Returns:
+        True if the files are generated, False if the window is rejected.
+    '''
+    #### window of the simulation data
+    if limit_data_to_10s:
+        n = idx0 + int(10.0/dt)
+        if n > gyro.shape[0]:
+            n = gyro.shape[0]
+    else:
+        n = gyro.shape[0]
+    if gaps is not None and continuity.window_has_gaps(gaps, idx0, n):
+        print("Data between row %u and %u has counter gaps, not saved to %s"% (idx0, n, dir))
+        return False
     # create dir if it does not exist
     if not os.path.exists(dir):
         os.mkdir(dir)
@@ -95,12 +145,6 @@ def gen_sim_files(gyro, acc, lla, vel, euler, idx0, dir):
     # all initial states
     ini_states = np.hstack((ini_pos, ini_vel, ini_euler, ab_norm))
     #### create log file
-    if limit_data_to_10s:
-        n = idx0 + int(10.0/dt)
-        if n > gyro.shape[0]:
-            n = gyro.shape[0]
-    else:
-        n = gyro.shape[0]
     # ini states
     file_name = dir + "ini.txt"
     np.savetxt(file_name, ini_states, delimiter=',', comments='')
@@ -130,6 +174,7 @@ def gen_sim_files(gyro, acc, lla, vel, euler, idx0, dir):
     headerline = "ref_Yaw (deg),ref_Pitch (deg),ref_Roll (deg)"
     np.savetxt(file_name, euler[idx0:n, :], header=headerline, delimiter=',', comments='')
     print("Simulation data saved to %s"% dir)
+    return True
 
 def parse_index(idx):
     ii = idx.find(':')
@@ -2,9 +2,8 @@ import os
 import math
 import threading
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.mlab as mlab
 import attitude
+import log_loader
 
 
 #### prepare data for free integration simulation
@@ -28,14 +27,14 @@ def post_processing(data_file, nav_view=False):
             raise IOError('Cannot create dir: %s.'% data_dir)
     #### read logged file
     if nav_view:
-        data = np.genfromtxt(data_file, delimiter='\t', skip_header=15)
+        data = log_loader.load(data_file, 'nav_view')
         acc0 = data[:, 1:4] * 9.80665
         gyro0 = data[:, 4:7]
         lla = np.zeros((acc0.shape[0], 3))
         vel = np.zeros((acc0.shape[0], 3))
         euler = np.zeros((acc0.shape[0], 3))
     else:
-        data = np.genfromtxt(data_file, delimiter=',', skip_header=1)
+        data = log_loader.load(data_file, 'freeintegration')
         # remove zero LLA/Vel/att from ins1000
         data = data[100:, :]
         acc0 = data[:, 2:5]
@@ -50,6 +49,8 @@ def post_processing(data_file, nav_view=False):
     You can specify multiple start points to generate multiple sets of data for simulaiton. 
     '''
     # get data before motion to calculate initial states
+    # matplotlib is only imported when the start of motion is picked on a plot
+    import matplotlib.pyplot as plt
     plt.ion()
     plt.plot(acc0)
     plt.grid(True)
@@ -1,51 +1,162 @@
 import os
+import sys
 import math
 import threading
+from multiprocessing import Pool
 import numpy as np
 import attitude
-import kml.dynamic_kml as kml
+import log_loader
+import trajectory_export
 
 
 #### prepare data for free integration simulation
 data_dir = "./ins_data/"
+# rows at the start of a log with zero LLA/Vel/att from ins1000
+skip_rows = 100
+# the log is converted chunk by chunk, about this many bytes at a time
+chunk_bytes = 16*1024*1024
+# Douglas-Peucker tolerance of the .kml files, m
+kml_tolerance = 1.0
 
+def format_rows(data):
+    '''
+    Format an nxm array as csv lines, much faster than np.savetxt.
+    '''
+    if data.shape[0] == 0 or data.shape[1] == 0:
+        return ''
+    fmt = ','.join(['%.18e'] * data.shape[1]) + '\n'
+    return (fmt * data.shape[0]) % tuple(data.ravel().tolist())
 
-def post_processing(data_file):
-    #### create data dir
-    if not os.path.exists(data_dir):
-        try:
-            os.makedirs(data_dir)
-        except:
-            raise IOError('Cannot create dir: %s.'% data_dir)
-    #### read logged file
-    data = np.genfromtxt(data_file, delimiter=',', skip_header=1)
-    # remove zero LLA/Vel/att from ins1000
-    data = data[100:, :]
-    lla = data[:, 8:11]
-    vel = data[:, 11:14]
-    euler = data[:, 14:17]
-    ref_lla = data[:, 17:20]
-    ref_vel = data[:, 20:23]
-    ref_euler = data[:, 23:26]
-    # Generate logged files
-    file_name = data_dir + "pos-0.csv"
-    headerline = "pos_lat (deg),pos_lon (deg),pos_alt (m)"
-    np.savetxt(file_name, lla, header=headerline, delimiter=',', comments='')
-    file_name = data_dir + "ref_pos.csv"
-    headerline = "ref_pos_lat (deg),ref_pos_lon (deg),ref_pos_alt (m)"
-    np.savetxt(file_name, ref_lla, header=headerline, delimiter=',', comments='')
-    file_name = data_dir + "att_euler-0.csv"
-    headerline = "Yaw (deg),Pitch (deg),Roll (deg)"
-    np.savetxt(file_name, euler[:,-1:-4:-1], header=headerline, delimiter=',', comments='')
-    # generate .kml file
-    file_name = data_dir + 'ref_pos.kml'
-    kml.gen_kml(file_name, ref_lla, ref_euler[:,2], 'ff0000ff')
-    file_name = data_dir + 'pos-1.kml'
-    kml.gen_kml(file_name, lla, euler[:,2], 'ffff0000')
-    
+def convert_chunk(task):
+    '''
+    Convert one chunk of a log.
+    Args:
+        task: (data_file, start, end, skip), byte range of the chunk and rows to skip.
+    Returns:
+        texts of pos-0.csv, ref_pos.csv and att_euler-0.csv, and the simplified LLA of the
+        unit and of the reference for the .kml files.
+    '''
+    data_file, start, end, skip = task
+    data = log_loader.read_range(data_file, start, end)
+    data = data[skip:, :]
+    texts, tracks = convert_arrays(data[:, 8:11], data[:, 17:20], data[:, 14:17])
+    return data.shape[0], texts, tracks
+
+def convert_arrays(lla, ref_lla, euler):
+    '''
+    Convert a block of rows.
+    Args:
+        lla: (n, 3) LLA of the unit, deg, deg, m.
+        ref_lla: (n, 3) LLA of the reference.
+        euler: (n, 3) roll, pitch and yaw of the unit, deg.
+        Arrays of fewer than 3 columns are not in the log and give empty outputs.
+    Returns:
+        texts and tracks for sim_writer.write().
+    '''
+    texts = (format_rows(lla), format_rows(ref_lla), format_rows(euler[:,-1:-4:-1]))
+    tracks = []
+    for i in (lla, ref_lla):
+        i = i[np.isfinite(i).all(axis=1) & ((i[:, 0] != 0) | (i[:, 1] != 0))]\
+            if i.shape[1] == 3 else np.zeros((0, 3))
+        tracks.append(i[trajectory_export.douglas_peucker(i, kml_tolerance)])
+    return texts, tracks
+
+class sim_writer:
+    '''
+    Simulation files of a log: pos-0.csv, ref_pos.csv, att_euler-0.csv, ref_pos.kml and
+    pos-1.kml, written block by block.
+    '''
+    def __init__(self, out_dir):
+        #### create data dir
+        if not os.path.exists(out_dir):
+            try:
+                os.makedirs(out_dir)
+            except:
+                raise IOError('Cannot create dir: %s.'% out_dir)
+        #### output files
+        self.f_pos = open(os.path.join(out_dir, "pos-0.csv"), 'w')
+        self.f_pos.write("pos_lat (deg),pos_lon (deg),pos_alt (m)\n")
+        self.f_ref = open(os.path.join(out_dir, "ref_pos.csv"), 'w')
+        self.f_ref.write("ref_pos_lat (deg),ref_pos_lon (deg),ref_pos_alt (m)\n")
+        self.f_att = open(os.path.join(out_dir, "att_euler-0.csv"), 'w')
+        self.f_att.write("Yaw (deg),Pitch (deg),Roll (deg)\n")
+        # generate .kml file, simplified block by block
+        self.ref_kml = trajectory_export.track_file(os.path.join(out_dir, 'ref_pos.kml'),\
+                                                    'ref_pos', 'ff0000ff')
+        self.pos_kml = trajectory_export.track_file(os.path.join(out_dir, 'pos-1.kml'),\
+                                                    'pos-1', 'ffff0000')
+
+    def write(self, texts, tracks):
+        '''
+        Append a block converted by convert_arrays().
+        '''
+        self.f_pos.write(texts[0])
+        self.f_ref.write(texts[1])
+        self.f_att.write(texts[2])
+        self.pos_kml.append(tracks[0])
+        self.ref_kml.append(tracks[1])
+
+    def close(self):
+        for i in (self.f_pos, self.f_ref, self.f_att, self.pos_kml, self.ref_kml):
+            i.close()
+
+def post_processing(data_file, out_dir=None, processes=1):
+    '''
+    Convert a log of log_for_ins_test.py to simulation files, chunk by chunk with constant
+    memory: pos-0.csv, ref_pos.csv, att_euler-0.csv, ref_pos.kml and pos-1.kml.
+    Args:
+        data_file: log file.
+        out_dir: output dir, None for data_dir.
+        processes: number of processes converting chunks in parallel.
+    Returns:
+        number of rows converted.
+    '''
+    if out_dir is None:
+        out_dir = data_dir
+    writer = sim_writer(out_dir)
+    #### read logged file chunk by chunk, the first skip_rows rows are in the first chunk
+    tasks = ((data_file, start, end, skip_rows if start_idx == 0 else 0)\
+             for start_idx, (start, end) in enumerate(log_loader.chunk_ranges(data_file, chunk_bytes)))
+    pool = None
+    if processes > 1:
+        pool = Pool(processes)
+        results = pool.imap(convert_chunk, tasks)
+    else:
+        results = map(convert_chunk, tasks)
+    rows = 0
+    for n, texts, tracks in results:
+        rows += n
+        writer.write(texts, tracks)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    writer.close()
+    return rows
+
+def post_processing_sessions(data_files, processes=None):
+    '''
+    Convert several logs in parallel, each one to data_dir/<log name>/.
+    Args:
+        processes: number of processes, None for the number of CPUs.
+    Returns:
+        list of number of rows converted of each log.
+    '''
+    pool = Pool(processes)
+    out_dirs = [os.path.join(data_dir, os.path.splitext(os.path.basename(i))[0])\
+                for i in data_files]
+    rows = pool.starmap(post_processing, zip(data_files, out_dirs))
+    pool.close()
+    pool.join()
+    return rows
 
 if __name__ == "__main__":
     # data_file = "E:\\Projects\\python-imu380-mult\\log_data\\log(2).csv"
     data_file = "e:\\vs_projects\\dmu380_offline_sim-ins_update\\sim_data\\results.csv"
     # data_file = "D:\\MyDocuments\\desktop\\新建文件夹\\log-2019_09_12_10_09_54.csv"
-    post_processing(data_file)
\ No newline at end of file
+    if len(sys.argv) > 2:
+        # several sessions, in parallel
+        print(post_processing_sessions(sys.argv[1:]))
+    else:
+        if len(sys.argv) > 1:
+            data_file = sys.argv[1]
+        post_processing(data_file)
\ No newline at end of file
@@ -0,0 +1,119 @@
+'''
+Raw capture of a serial stream, written by the reader process alongside live decoding.
+Every chunk read from the port is appended to <name>.bin unchanged, so the capture can be
+decoded again later by the file replay of imu38x/rtk330l (baud 0) or by decode_cache. The
+host time of each chunk is appended to <name>.bin.ts as (byte offset, time.time()) records,
+see timestamps(). Both are kept in memory and written in large blocks, at most every
+flush_interval seconds, so teeing costs a memory copy per chunk.
+    unit = imu38x.imu38x(port, baud, packet, pipe=pipe, raw=raw_capture.raw_capture(name))
+'''
+import os
+import sys
+import time
+import struct
+import signal
+
+# byte offset of the chunk in the capture, host time
+ts_struct = struct.Struct('<Qd')
+ts_ext = '.ts'
+# bytes kept in memory before writing
+buffer_size = 4*1024*1024
+# buffered bytes are written at least this often, s
+flush_interval = 1.0
+
+class raw_capture:
+    def __init__(self, file_name, max_buffer=None, interval=None):
+        '''
+        Args:
+            file_name: raw capture file, truncated. Timestamps go to file_name + ts_ext.
+            max_buffer: bytes kept in memory, None for buffer_size.
+            interval: write at least every interval seconds, None for flush_interval.
+        '''
+        self.file_name = file_name
+        self.max_buffer = max_buffer if max_buffer is not None else buffer_size
+        self.interval = interval if interval is not None else flush_interval
+        d = os.path.dirname(file_name)
+        if d and not os.path.exists(d):
+            os.makedirs(d)
+        # unbuffered, writes are already large
+        self.f = open(file_name, 'wb', 0)
+        self.f_ts = open(file_name + ts_ext, 'wb', 0)
+        self.buf = bytearray()
+        self.ts = bytearray()
+        self.offset = 0         # bytes captured
+        self.chunks = 0
+        self.tflush = time.time()
+
+    def write(self, data):
+        '''
+        Append a chunk read from the port.
+        '''
+        tnow = time.time()
+        self.ts += ts_struct.pack(self.offset, tnow)
+        self.buf += data
+        self.offset += len(data)
+        self.chunks += 1
+        if len(self.buf) >= self.max_buffer or tnow - self.tflush >= self.interval:
+            self.flush(tnow)
+
+    def flush(self, tnow=None):
+        if self.buf:
+            self.f.write(self.buf)
+            self.buf = bytearray()
+        if self.ts:
+            self.f_ts.write(self.ts)
+            self.ts = bytearray()
+        self.tflush = time.time() if tnow is None else tnow
+
+    def close(self):
+        if self.f is None:
+            return
+        self.flush()
+        self.f.close()
+        self.f_ts.close()
+        self.f = None
+
+def timestamps(file_name, relative=True):
+    '''
+    Host times of the chunks of a raw capture.
+    Args:
+        relative: times since the first chunk, as serial_emulator.file_source expects.
+    Returns:
+        list of (byte offset, time), None if the capture has no timestamp file.
+    '''
+    try:
+        f = open(file_name + ts_ext, 'rb')
+    except OSError:
+        return None
+    data = f.read()
+    f.close()
+    # a capture that was not closed may end with a partial record
+    n = len(data) // ts_struct.size
+    out = list(ts_struct.iter_unpack(data[:n * ts_struct.size]))
+    if relative and out:
+        t0 = out[0][1]
+        out = [(offset, t - t0) for offset, t in out]
+    return out
+
+def exit_on_terminate():
+    '''
+    Exit normally on SIGTERM, so that Process.terminate() by the logger still writes the
+    buffered bytes (in the finally clauses and at exit). Not effective on Windows, where
+    terminate() ends the process at once.
+    '''
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+if __name__ == "__main__":
+    # summary of a raw capture
+    #   python raw_capture.py log.bin
+    file_name = sys.argv[1]
+    size = os.path.getsize(file_name)
+    ts = timestamps(file_name, False)
+    if not ts:
+        print('%s: %u bytes, no timestamps'% (file_name, size))
+    else:
+        duration = ts[-1][1] - ts[0][1]
+        print('%s: %u bytes in %u chunks, %.1f s from %s, %.0f bytes/s'% (\
+              file_name, size, len(ts), duration,\
+              time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts[0][1])),\
+              size / duration if duration > 0 else 0.0))
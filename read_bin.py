@@ -1,20 +1,129 @@
-import sys
-
-filepath = r'2021-0820-1755-com.txt'
-binfile = open(filepath, 'rb')
-i=0
-ch = binfile.read(1)
-
-while ch:
-	data = ord(ch)
-	i = i + 1
-	if i % 16 == 1:
-		print ("\t0x%02X, " %(data), end='')
-	elif i % 16 == 0:
-		print ("0x%02X," %(data), end='')
-		print ('')
-	else:
-		print ("0x%02X," %(data), end='')
-	ch = binfile.read(1)
-
-binfile.close()
+'''
+Streaming inspector for binary logs of 5555-framed packets.
+Examples:
+    python read_bin.py log.bin                  # one line per frame
+    python read_bin.py log.bin -t A1 S1         # only A1 and S1 frames
+    python read_bin.py log.bin -s 1000 -e 5000  # frames between byte offset 1000 and 5000
+    python read_bin.py log.bin --summary        # per-type counts, CRC error rate and resyncs
+    python read_bin.py log.bin --raw            # plain hex dump, 16 bytes per line
+'''
+import sys
+import time
+import argparse
+import framing
+import imu38x
+import rtk330l
+
+block_size = 4*1024*1024
+
+def known_types():
+    '''
+    Type codes of all packets that can be decoded in this repo.
+    '''
+    return set(imu38x.packet_def.keys()) | set(rtk330l.packet_def.keys())
+
+def read_blocks(f, start, end, size):
+    '''
+    Read [start, end) of file f in blocks of the given size. end can be None.
+    '''
+    f.seek(start)
+    remaining = None if end is None else end - start
+    while remaining is None or remaining > 0:
+        n = size if remaining is None else min(size, remaining)
+        data = f.read(n)
+        if not data:
+            break
+        if remaining is not None:
+            remaining -= len(data)
+        yield data
+
+def dump_raw(f, start, end, out):
+    '''
+    Hex dump in the format of a C array initializer, 16 bytes per line.
+    '''
+    # whole lines per block
+    for data in read_blocks(f, start, end, block_size - block_size % 16):
+        hex_str = data.hex().upper()
+        lines = []
+        for i in range(0, len(hex_str), 32):
+            row = hex_str[i:i+32]
+            lines.append('\t0x' + ', 0x'.join(row[j:j+2] for j in range(0, len(row), 2)) + ',')
+        out.write('\n'.join(lines))
+        out.write('\n')
+
+def dump_frames(f, start, end, scanner, show_types, out):
+    '''
+    One line per frame: offset, type, payload length, CRC result and the frame in hex.
+    '''
+    for data in read_blocks(f, start, end, block_size):
+        buf, frames = scanner.feed(data)
+        lines = []
+        for offset, pos, packet_type, n, crc_ok in frames:
+            if show_types is not None and packet_type not in show_types:
+                continue
+            lines.append('%10d  %s  %3d  %s  %s'% (offset, packet_type, n,\
+                         'OK  ' if crc_ok else 'FAIL', buf[pos:pos+n+framing.overhead].hex(' ')))
+        if lines:
+            out.write('\n'.join(lines))
+            out.write('\n')
+    scanner.flush()
+
+def summary(f, start, end, scanner, show_types, out):
+    '''
+    Per-type frame counts, CRC error rate and resync counts.
+    '''
+    tstart = time.time()
+    for data in read_blocks(f, start, end, block_size):
+        scanner.feed(data)
+    scanner.flush()
+    elapsed = time.time() - tstart
+    types = sorted(set(scanner.type_count.keys()) | set(scanner.type_fail.keys()))
+    if show_types is not None:
+        types = [i for i in types if i in show_types]
+    out.write('%-6s %12s %10s %10s\n'% ('type', 'frames', 'crc_fail', 'fail_rate'))
+    for i in types:
+        ok = scanner.type_count.get(i, 0)
+        fail = scanner.type_fail.get(i, 0)
+        out.write('%-6s %12u %10u %9.4f%%\n'% (i, ok, fail, 100.0 * fail / (ok + fail)))
+    total = scanner.frames + scanner.crc_fail
+    out.write('bytes scanned:   %u\n'% scanner.bytes_in)
+    out.write('frames:          %u\n'% scanner.frames)
+    out.write('crc fail:        %u (%.4f%%)\n'% (scanner.crc_fail,\
+              100.0 * scanner.crc_fail / total if total else 0.0))
+    out.write('resyncs:         %u\n'% scanner.resync)
+    out.write('discarded bytes: %u\n'% scanner.discarded)
+    out.write('elapsed:         %.3f s (%.1f MB/s)\n'% (elapsed,\
+              scanner.bytes_in / 1e6 / elapsed if elapsed > 0 else 0.0))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect binary logs of 5555-framed packets.')
+    parser.add_argument('file', help='binary log file')
+    parser.add_argument('-t', '--type', nargs='+', default=None,\
+                        help='only show these packet types, for example -t A1 S1')
+    parser.add_argument('-s', '--start', type=int, default=0, help='start byte offset')
+    parser.add_argument('-e', '--end', type=int, default=None, help='end byte offset (exclusive)')
+    parser.add_argument('--summary', action='store_true',\
+                        help='per-type counts, CRC error rate and resync counts')
+    parser.add_argument('--raw', action='store_true', help='plain hex dump, no framing')
+    parser.add_argument('--any-type', action='store_true',\
+                        help='accept frames with unknown type codes')
+    args = parser.parse_args(argv)
+
+    show_types = None if args.type is None else set(args.type)
+    scanner = framing.frame_scanner(None if args.any_type else known_types(), args.start)
+    out = sys.stdout
+    try:
+        with open(args.file, 'rb') as f:
+            if args.raw:
+                dump_raw(f, args.start, args.end, out)
+            elif args.summary:
+                summary(f, args.start, args.end, scanner, show_types, out)
+            else:
+                dump_frames(f, args.start, args.end, scanner, show_types, out)
+        out.flush()
+    except BrokenPipeError:
+        # output piped to head or less and closed early
+        sys.stderr.close()
+
+if __name__ == "__main__":
+    main()
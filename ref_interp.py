@@ -0,0 +1,223 @@
+'''
+Resample a reference trajectory (INS1000/NovAtel truth) onto the timestamps of a unit.
+Position and velocity are interpolated linearly and quaternions by SLERP, all vectorized
+over the query times. The reference can be delayed or advanced to correct for latency
+between the reference and the unit.
+'''
+import sys
+import numpy as np
+
+class ref_interp:
+    def __init__(self, latency=0.0, max_gap=0.1, capacity=65536):
+        '''
+        Args:
+            latency: reference latency, s. A reference record stamped t is taken as
+                valid at t - latency.
+            max_gap: query times between two reference records more than max_gap apart
+                are invalid, s.
+            capacity: initial number of records, doubled when full.
+        '''
+        self.latency = latency
+        self.max_gap = max_gap
+        self.t = np.zeros((capacity,))
+        self.lla = np.zeros((capacity, 3))
+        self.vel = np.zeros((capacity, 3))
+        self.quat = np.zeros((capacity, 4))
+        self.n = 0
+        self.out_of_order = 0
+
+    def add(self, record):
+        '''
+        Add a record decoded by ins1000.parse_nav: (time, lla, vel, quat).
+        Records older than the latest one are dropped.
+        '''
+        t = float(np.ravel(record[0])[0])
+        if self.n and t <= self.t[self.n-1]:
+            self.out_of_order += 1
+            return
+        if self.n == self.t.shape[0]:
+            self.grow(2 * self.n)
+        i = self.n
+        self.t[i] = t
+        self.lla[i] = np.ravel(record[1])
+        self.vel[i] = np.ravel(record[2])
+        self.quat[i] = np.ravel(record[3])
+        self.n += 1
+
+    def add_arrays(self, t, lla, vel, quat):
+        '''
+        Add many records, time sorted.
+        '''
+        n = len(t)
+        if self.n + n > self.t.shape[0]:
+            self.grow(max(2 * self.t.shape[0], self.n + n))
+        s = slice(self.n, self.n + n)
+        self.t[s], self.lla[s], self.vel[s], self.quat[s] = t, lla, vel, quat
+        self.n += n
+
+    def grow(self, capacity):
+        for name in ('t', 'lla', 'vel', 'quat'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:])
+            new[:self.n] = old[:self.n]
+            setattr(self, name, new)
+
+    def resample(self, t):
+        '''
+        Reference at the query times.
+        Args:
+            t: (m,) query times, same time base as the reference.
+        Returns:
+            dict of 'lla' (m, 3), 'vel' (m, 3), 'quat' (m, 4), 'valid' (m,) bool.
+            Invalid rows are NaN, all rows with fewer than 2 records.
+        '''
+        if self.n < 2:
+            m = np.asarray(t).shape[0]
+            return {'valid': np.zeros((m,), dtype=bool), 'lla': np.full((m, 3), np.nan),\
+                    'vel': np.full((m, 3), np.nan), 'quat': np.full((m, 4), np.nan)}
+        t_ref = self.t[:self.n] - self.latency
+        idx, u, valid = bracket(t_ref, t, self.max_gap)
+        out = {'valid': valid}
+        out['lla'] = lerp(self.lla[:self.n], idx, u, valid)
+        out['vel'] = lerp(self.vel[:self.n], idx, u, valid)
+        out['quat'] = slerp(self.quat[:self.n][idx], self.quat[:self.n][idx+1], u)
+        out['quat'][~valid] = np.nan
+        return out
+
+    def save(self, file_name):
+        np.savez(file_name, t=self.t[:self.n], lla=self.lla[:self.n],\
+                 vel=self.vel[:self.n], quat=self.quat[:self.n])
+
+def load(file_name, latency=0.0, max_gap=0.1):
+    '''
+    Load a reference saved by ref_interp.save().
+    '''
+    npz = np.load(file_name)
+    ref = ref_interp(latency, max_gap, max(npz['t'].size, 1))
+    ref.add_arrays(npz['t'], npz['lla'], npz['vel'], npz['quat'])
+    return ref
+
+def bracket(t_ref, t, max_gap=None):
+    '''
+    Find the reference interval of each query time.
+    Returns:
+        idx: (m,) index of the record before each query time, in [0, n-2].
+        u: (m,) fraction of the interval, in [0, 1].
+        valid: (m,) bool, the query time is inside the reference and the interval is
+            not longer than max_gap.
+    '''
+    t = np.asarray(t, dtype=np.float64)
+    n = t_ref.size
+    if n < 2:
+        return np.zeros(t.shape, dtype=np.int64), np.zeros(t.shape), np.zeros(t.shape, dtype=bool)
+    idx = np.clip(np.searchsorted(t_ref, t, side='right') - 1, 0, n - 2)
+    dt = t_ref[idx+1] - t_ref[idx]
+    u = (t - t_ref[idx]) / dt
+    valid = (u >= 0.0) & (u <= 1.0)
+    if max_gap is not None:
+        valid &= dt <= max_gap
+    return idx, np.clip(u, 0.0, 1.0), valid
+
+def lerp(x, idx, u, valid=None):
+    '''
+    Linear interpolation of the rows of x between idx and idx+1.
+    '''
+    out = x[idx] + (x[idx+1] - x[idx]) * u[:, None]
+    if valid is not None:
+        out[~valid] = np.nan
+    return out
+
+def slerp(q0, q1, u):
+    '''
+    Batched spherical linear interpolation.
+    Args:
+        q0, q1: (m, 4) quaternions, scalar first.
+        u: (m,) fractions in [0, 1].
+    Returns:
+        (m, 4) unit quaternions along the shortest path from q0 to q1.
+    '''
+    q0 = q0 / np.linalg.norm(q0, axis=1)[:, None]
+    q1 = q1 / np.linalg.norm(q1, axis=1)[:, None]
+    d = np.einsum('ij,ij->i', q0, q1)
+    # q and -q are the same rotation, take the shortest path
+    q1 = np.where((d < 0.0)[:, None], -q1, q1)
+    d = np.abs(d)
+    theta = np.arccos(np.clip(d, -1.0, 1.0))
+    s = np.sin(theta)
+    # almost identical quaternions: linear interpolation and normalization
+    near = s < 1e-6
+    s = np.where(near, 1.0, s)
+    w0 = np.where(near, 1.0 - u, np.sin((1.0 - u) * theta) / s)
+    w1 = np.where(near, u, np.sin(u * theta) / s)
+    q = w0[:, None] * q0 + w1[:, None] * q1
+    return q / np.linalg.norm(q, axis=1)[:, None]
+
+def quat2euler(q):
+    '''
+    Vectorized attitude.quat2euler, zyx.
+    Args:
+        q: (m, 4) quaternions, scalar first.
+    Returns:
+        (m, 3) [yaw, pitch, roll], rad.
+    '''
+    q0, q1, q2, q3 = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    yaw = np.arctan2(2.0*(q1*q2 + q0*q3), q0*q0 + q1*q1 - q2*q2 - q3*q3)
+    pitch = np.arcsin(np.clip(-2.0*(q1*q3 - q0*q2), -1.0, 1.0))
+    roll = np.arctan2(2.0*(q2*q3 + q0*q1), q0*q0 - q1*q1 - q2*q2 + q3*q3)
+    return np.stack((yaw, pitch, roll), axis=1)
+
+def estimate_latency(t, x, t_ref, x_ref, max_lag=0.5, step=0.005):
+    '''
+    Latency of a reference signal compared with a unit signal, by minimizing the RMS
+    difference over lags in [-max_lag, max_lag]. Use a signal that changes, for example
+    velocity or heading rate during dynamic motion.
+    Args:
+        t, x: (m,) unit times and signal.
+        t_ref, x_ref: (n,) reference times and signal.
+    Returns:
+        latency, s. Use it as ref_interp(latency=...).
+    '''
+    best = (np.inf, 0.0)
+    for lag in np.arange(-max_lag, max_lag + step/2, step):
+        idx, u, valid = bracket(t_ref - lag, t)
+        if np.count_nonzero(valid) < 2:
+            continue
+        d = x[valid] - (x_ref[idx] + (x_ref[idx+1] - x_ref[idx]) * u)[valid]
+        rms = np.sqrt(np.mean(d * d))
+        if rms < best[0]:
+            best = (rms, lag)
+    return best[1]
+
+def write_resampled(file_name, t, out):
+    '''
+    Write resampled reference to a csv file, one line per query time.
+    '''
+    euler = quat2euler(out['quat']) * (180.0 / np.pi)
+    data = np.hstack((t[:, None], out['lla'], out['vel'], euler[:, ::-1],\
+                      out['valid'][:, None]))
+    header = 'time (s), ref_Lat, ref_Lon, ref_Alt (m), ref_vN (m/s), ref_vE (m/s), ref_vD (m/s), '
+    header += 'ref_roll (deg), ref_pitch (deg), ref_yaw (deg), valid'
+    np.savetxt(file_name, data, fmt='%.9f', delimiter=', ', header=header, comments='')
+
+def resample_log(ref, log_file, out_file, time_scale=1.0):
+    '''
+    Resample the reference at the times in column 0 of a log with a header line.
+    Args:
+        time_scale: converts the log times to the reference time base, for example 0.001
+            for an itow in ms and a reference time in s.
+    Returns:
+        number of valid rows.
+    '''
+    import compare
+    t = compare.load_log(log_file, 1)[:, 0] * time_scale
+    out = ref.resample(t)
+    write_resampled(out_file, t, out)
+    return np.count_nonzero(out['valid'])
+
+if __name__ == "__main__":
+    # resample a saved reference (ref.npz) at the times in column 0 of a log
+    #   python ref_interp.py ref.npz log.csv out.csv [latency] [time scale]
+    ref = load(sys.argv[1], float(sys.argv[4]) if len(sys.argv) > 4 else 0.0)
+    time_scale = float(sys.argv[5]) if len(sys.argv) > 5 else 1.0
+    n_valid = resample_log(ref, sys.argv[2], sys.argv[3], time_scale)
+    print('%u rows of the reference resampled'% n_valid)
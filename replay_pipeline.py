@@ -0,0 +1,143 @@
+'''
+Headless replay of raw captures to simulation files.
+A raw capture is decoded with the vectorized decoder (through decode_cache), remapped to the
+body frame with the unit orientation and written as simulation files, all on numpy arrays:
+no child process, no pipe, no decoded csv and no GUI. A directory of captures is processed
+by a pool of processes, one capture per process.
+Output files of each capture:
+    time.csv, accel-0.csv, gyro-0.csv       as post_proccess_for_free_integration.py
+    pos-0.csv, ref_pos.csv, att_euler-0.csv, ref_pos.kml, pos-1.kml
+                                            as post_proccess_for_ins_test.py
+'''
+import os
+import sys
+import time
+from multiprocessing import Pool
+import numpy as np
+import orientation
+import decode_cache
+import post_proccess_for_ins_test
+
+packet_type = 'id'
+# orientation of the unit, for example '-y+x+z'. None if the unit is not rotated.
+unit_orientation = None
+out_dir = './ins_data/'
+# extensions of raw captures in a directory
+raw_ext = ('.bin', '.txt')
+# rows converted at a time
+block_rows = 100000
+# accel of the packets is in g, simulation files are in m/s^2
+accel_scale = 9.80665
+# packet timer to s
+time_scale = 0.001
+# simulation data -> field of the packet, see packet_decoder.schema
+sim_fields = {'s1': {'timer': 'timer', 'accel': 'accel', 'gyro': 'gyro'},\
+              'e1': {'timer': 'timer', 'accel': 'accel', 'gyro': 'gyro', 'euler': 'euler'},\
+              'e2': {'timer': 'timer', 'accel': 'accel', 'gyro': 'gyro', 'euler': 'euler',\
+                     'lla': 'lla'},\
+              'id': {'timer': 'timer', 'accel': 'accel', 'gyro': 'gyro', 'euler': 'euler',\
+                     'lla': 'lla', 'ref_lla': 'gps_lla'}}
+
+def process(raw_file, dir=None, packet=None, ori=None):
+    '''
+    Convert a raw capture to simulation files.
+    Args:
+        raw_file: raw capture of an imu38x unit.
+        dir: output dir, None for out_dir.
+        packet: packet type, None for packet_type.
+        ori: orientation string of the unit, None for unit_orientation.
+    Returns:
+        number of rows written.
+    '''
+    if dir is None:
+        dir = out_dir
+    if packet is None:
+        packet = packet_type
+    if ori is None:
+        ori = unit_orientation
+    ori = orientation.orientation(ori) if ori is not None else None
+    fields = sim_fields[packet]
+    arrays = decode_cache.decode_file(raw_file, packet, 'imu38x')
+    n = arrays[fields['timer']].shape[0]
+    # remove zero LLA/Vel/att at the beginning, as post_proccess_for_ins_test.py
+    skip = min(post_proccess_for_ins_test.skip_rows, n)
+    writer = post_proccess_for_ins_test.sim_writer(dir)
+    f_time = open(os.path.join(dir, "time.csv"), 'w')
+    f_time.write("time (sec)\n")
+    f_acc = open(os.path.join(dir, "accel-0.csv"), 'w')
+    f_acc.write("accel_x (m/s^2),accel_y (m/s^2),accel_z (m/s^2)\n")
+    f_gyro = open(os.path.join(dir, "gyro-0.csv"), 'w')
+    f_gyro.write("gyro_x (deg/s),gyro_y (deg/s),gyro_z (deg/s)\n")
+    timer0 = float(arrays[fields['timer']][skip]) if n > skip else 0.0
+    for i in range(skip, n, block_rows):
+        s = slice(i, min(i + block_rows, n))
+        m = s.stop - s.start
+        # fields not in the packet are (m, 0) arrays, written as empty files
+        get = lambda name: np.asarray(arrays[fields[name]][s], dtype=np.float64)\
+                           if name in fields else np.zeros((m, 0))
+        acc = get('accel') * accel_scale
+        gyro = get('gyro')
+        if ori is not None:
+            acc = ori.apply_array(acc)
+            gyro = ori.apply_array(gyro)
+        t = (get('timer') - timer0) * time_scale
+        f_time.write(post_proccess_for_ins_test.format_rows(t.reshape(-1, 1)))
+        f_acc.write(post_proccess_for_ins_test.format_rows(acc))
+        f_gyro.write(post_proccess_for_ins_test.format_rows(gyro))
+        texts, tracks = post_proccess_for_ins_test.convert_arrays(get('lla'), get('ref_lla'),\
+                                                                  get('euler'))
+        writer.write(texts, tracks)
+    writer.close()
+    for f in (f_time, f_acc, f_gyro):
+        f.close()
+    return n - skip
+
+def raw_files(raw_dir):
+    return sorted(os.path.join(raw_dir, i) for i in os.listdir(raw_dir)\
+                  if os.path.splitext(i)[1].lower() in raw_ext)
+
+def process_dir(raw_dir, dir=None, processes=None, packet=None, ori=None):
+    '''
+    Convert all raw captures in a directory, each one to <dir>/<capture name>/.
+    Args:
+        processes: number of processes, None for the number of CPUs.
+    Returns:
+        dict of capture -> number of rows written.
+    '''
+    return process_files(raw_files(raw_dir), dir, processes, packet, ori)
+
+def process_files(files, dir=None, processes=None, packet=None, ori=None):
+    '''
+    Convert raw captures, each one to <dir>/<capture name>/.
+    Args:
+        processes: number of processes, None for the number of CPUs.
+    Returns:
+        dict of capture -> number of rows written.
+    '''
+    if dir is None:
+        dir = out_dir
+    args = [(i, os.path.join(dir, os.path.splitext(os.path.basename(i))[0]), packet, ori)\
+            for i in files]
+    if processes == 1 or len(files) < 2:
+        rows = [process(*i) for i in args]
+    else:
+        pool = Pool(processes)
+        rows = pool.starmap(process, args)
+        pool.close()
+        pool.join()
+    return dict(zip(files, rows))
+
+if __name__ == "__main__":
+    # python replay_pipeline.py capture.bin|capture_dir [packet type] [out dir] [orientation]
+    src = sys.argv[1]
+    packet = sys.argv[2] if len(sys.argv) > 2 else None
+    dir = sys.argv[3] if len(sys.argv) > 3 else None
+    ori = sys.argv[4] if len(sys.argv) > 4 else None
+    tstart = time.time()
+    if os.path.isdir(src):
+        result = process_dir(src, dir, None, packet, ori)
+    else:
+        result = {src: process(src, dir, packet, ori)}
+    for i in result:
+        print('%s: %u rows'% (i, result[i]))
+    print('%u captures in %.3f s'% (len(result), time.time() - tstart))
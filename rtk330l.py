@@ -1,10 +1,11 @@
 import os
 import time
 import sys
-import math
-import serial
-import serial.tools.list_ports
 import struct
+import link_metrics
+import continuity
+import packet_decoder
+import decode_cache
 
 preamble = bytearray.fromhex('5555')
 packet_def = {'s1': [43, bytearray.fromhex('7331')],\
@@ -14,14 +15,24 @@ packet_def = {'s1': [43, bytearray.fromhex('7331')],\
               'd2': [31, bytearray.fromhex('6432')],\
               'gN': [53, bytearray.fromhex('674E')],\
               'sT': [38, bytearray.fromhex('7354')]}
+# payload layouts and scale factors are in packet_decoder.schema
+decoders = dict((i, packet_decoder.packet_decoder(i, 'rtk330l')) for i in packet_def)
+# time_of_week of each packet type in ms, for the continuity check: s1 and s2 are decoded in
+#   ms, the others in s
+tow_ms = {'s1': 1.0, 's2': 1.0}
+# replay data files from the decode cache
+use_decode_cache = True
 
 class rtk330l:
-    def __init__(self, port, baud=115200, packet_type='gN', pipe=None):
+    def __init__(self, port, baud=115200, packet_type='gN', pipe=None, log_interval=None):
         self.port = port
         self.baud = baud
+        self.packet_type = packet_type
         self.physical_port = True
         self.file_size = 0
         if baud > 0:
+            # pyserial is only imported for a serial port, not for file replay
+            import serial
             self.ser = serial.Serial(self.port, self.baud)
             self.open = self.ser.isOpen()
         else:
@@ -44,6 +55,12 @@ class rtk330l:
             print('Unsupported packet type: %s'% packet_type)
         self.bf = bytearray(self.size*2)
         self.nbf = 0
+        # link health
+        self.metrics = link_metrics.link_metrics(str(port), log_interval)
+        # time_of_week continuity, gaps are counted in self.metrics
+        self.continuity = continuity.continuity_checker(continuity.itow_wrap, unit=str(port),\
+                                                        metrics=self.metrics)
+        self.tow_scale = tow_ms.get(packet_type, 1000.0)
 
     def start(self, reset=False, reset_cmd='5555725300FC88'):
         if self.open:
@@ -52,7 +69,9 @@ class rtk330l:
                 if reset is True:
                     self.ser.write(bytearray.fromhex(reset_cmd))
                 self.ser.reset_input_buffer()
-            while True:
+            # a data file decoded before is replayed from the decode cache
+            replayed = not self.physical_port and self.replay_cached()
+            while not replayed:
                 if self.physical_port:
                     read_size = self.ser.in_waiting
                 else:
@@ -68,13 +87,35 @@ class rtk330l:
             #close port or file
             self.ser.close()
             print('End of processing.')
-            self.pipe.send('exit')
+            if self.pipe is not None:
+                self.pipe.send('exit')
         
+    def replay_cached(self):
+        '''
+        Replay a data file decoded by decode_cache, decoding it first if it is not cached.
+        Returns:
+            True if replayed.
+        '''
+        if not use_decode_cache or self.packet_type not in decoders:
+            return False
+        arrays = decode_cache.decode_file(self.port, self.packet_type, 'rtk330l')
+        metrics = self.metrics
+        for row in decode_cache.rows(arrays, decoders[self.packet_type].names):
+            self.latest = row
+            metrics.frames_ok += 1
+            self.continuity.update(int(round(row[1] * self.tow_scale)))
+            if self.pipe is not None:
+                self.pipe.send(self.latest)
+        metrics.tick()
+        return True
+
     def parse_new_data(self, data):
         '''
         add new data in the buffer
         '''
+        metrics = self.metrics
         n = len(data)
+        metrics.bytes_in += n
         for i in range(n):
             self.bf[self.nbf] = data[i]
             self.nbf += 1
@@ -86,24 +127,43 @@ class rtk330l:
                     calculated_crc = self.calc_crc(self.bf[2:self.bf[4]+5])
                     # decode
                     if packet_crc == calculated_crc:
+                        t0 = time.perf_counter()
                         self.latest = self.parse_packet(self.bf[2:self.bf[4]+5])
-                        if self.latest[0]%5 == 0:
-                            print(self.latest) 
+                        metrics.parse_latency.add(time.perf_counter() - t0)
+                        metrics.frames_ok += 1
+                        self.continuity.update(int(round(self.latest[1] * self.tow_scale)))
                         if self.pipe is not None:
                             self.pipe.send(self.latest)
                         self.nbf -= self.size
                         for i in range(self.nbf):
                             self.bf[i] = self.bf[i+self.size]
                     else:
-                        print('crc fail: %s %s %s %s'% (self.size, self.nbf, packet_crc, calculated_crc))
-                        print(" ".join("{:02X}".format(self.bf[i]) for i in range(0, self.nbf)))
+                        metrics.crc_fail += 1
                         # remove the first byte from the buffer
                         self.nbf -= 1
                         for i in range(self.nbf):
                             self.bf[i] = self.bf[i+1]
-                        self.nbf = self.sync_packet(self.bf, self.nbf, preamble)
+                        self.resync(1)
                 else:
-                    self.nbf = self.sync_packet(self.bf, self.nbf, preamble)
+                    self.resync(0)
+        metrics.tick()
+
+    def resync(self, dropped):
+        '''
+        search for the next packet header, and count bytes dropped from the buffer
+        '''
+        nbf = self.nbf
+        self.nbf = self.sync_packet(self.bf, self.nbf, preamble)
+        dropped += nbf - self.nbf
+        if dropped:
+            self.metrics.resync += 1
+            self.metrics.bytes_discarded += dropped
+
+    def get_metrics(self):
+        '''
+        snapshot of link health metrics
+        '''
+        return self.metrics.snapshot()
 
     def get_latest(self):
         a = self.latest
@@ -114,188 +174,26 @@ class rtk330l:
         return data
 
     def parse_s1(self, payload):
-        gps_week = (math.pow(4, 12) * payload[0] + math.pow(4, 8) * payload[1] + \
-            math.pow(4, 4) * payload[2] + payload[3])
-
-        time_of_week = (math.pow(4, 28) * payload[4] + math.pow(4, 24) * payload[5] + \
-            math.pow(4, 20) * payload[6] + math.pow(4,16) * payload[7] + math.pow(4, 12) * \
-            payload[8] + math.pow(4, 8) * payload[9] + math.pow(4, 4) * payload[10] + \
-            payload[11]) * 1000
-
-        accels = [0 for x in range(3)]
-        for i in range(3):
-            accels[i] = (math.pow(4, 12) * payload[4*i+12] + math.pow(4, 8) * payload[4*i+13] + \
-            math.pow(4, 4) * payload[4*i+14] + payload[4*i+15])
-        
-        angles = [0 for x in range(3)]
-        for i in range(3):
-            angles[i] = (math.pow(4, 12) * payload[4*i+16] + math.pow(4, 8) * payload[4*i+17] + \
-            math.pow(4, 4) * payload[4*i+18] + payload[4*i+19])
+        return tuple(decoders['s1'].decode(payload))
 
-        return gps_week, time_of_week, accels, angles
-       
     def parse_s2(self, payload):
-        gps_week = (math.pow(4, 12) * payload[0] + math.pow(4, 8) * payload[1] + \
-            math.pow(4, 4) * payload[2] + payload[3])
-
-        time_of_week = (math.pow(4, 28) * payload[4] + math.pow(4, 24) * payload[5] + \
-            math.pow(4, 20) * payload[6] + math.pow(4,16) * payload[7] + math.pow(4, 12) * \
-            payload[8] + math.pow(4, 8) * payload[9] + math.pow(4, 4) * payload[10] + \
-            payload[11]) * 1000
-
-        accels = [0 for x in range(3)]
-        for i in range(3):
-            accels[i] = (math.pow(4, 12) * payload[4*i+12] + math.pow(4, 8) * payload[4*i+13] + \
-            math.pow(4, 4) * payload[4*i+14] + payload[4*i+15])
-        
-        angles = [0 for x in range(3)]
-        for i in range(3):
-            angles[i] = (math.pow(4, 12) * payload[4*i+16] + math.pow(4, 8) * payload[4*i+17] + \
-            math.pow(4, 4) * payload[4*i+18] + payload[4*i+19])
-
-        return gps_week, time_of_week, accels, angles
+        return tuple(decoders['s2'].decode(payload))
 
     def parse_iN(self, payload):
-        gps_week = (math.pow(4, 12) * payload[0] + math.pow(4, 8) * payload[1] + \
-            math.pow(4, 4) * payload[2] + payload[3])
-
-        time_of_week = (math.pow(4, 28) * payload[4] + math.pow(4, 24) * payload[5] + \
-            math.pow(4, 20) * payload[6] + math.pow(4,16) * payload[7] + math.pow(4, 12) * \
-            payload[8] + math.pow(4, 8) * payload[9] + math.pow(4, 4) * payload[10] + \
-            payload[11]) 
-        
-        ins_status = payload[12]
-        ins_pos_status = payload[13]
-
-        latitude = (math.pow(4, 12) * payload[14] + math.pow(4, 8) * payload[15] + \
-            math.pow(4, 4) * payload[16] + payload[17]) * (180 / (math.pow(2,31)))
-
-        longitude = (math.pow(4, 12) * payload[18] + math.pow(4, 8) * payload[19] + \
-            math.pow(4, 4) * payload[20] + payload[21]) * (180 / (math.pow(2,31)))
-        
-        hight = (math.pow(4, 12) * payload[22] + math.pow(4, 8) * payload[23] + \
-            math.pow(4, 4) * payload[24] + payload[25])
-
-        velocity_north = (math.pow(4, 4) * payload[26] + payload[27])
-        velocity_east = (math.pow(4, 4) * payload[28] + payload[29])
-        velocity_up = (math.pow(4, 4) * payload[30] + payload[31])
-
-        roll = (math.pow(4, 4) * payload[32] + payload[33])    
-        pitch = (math.pow(4, 4) * payload[34] + payload[35]) 
-        head = (math.pow(4,4) * payload[36] + payload[37]) 
+        return tuple(decoders['iN'].decode(payload))
 
-        return gps_week, time_of_week, ins_status, ins_pos_status, latitude, longitude, hight, velocity_north, \
-            velocity_east, velocity_up, roll, pitch, head
-    
     def parse_d1(self, payload):
-        gps_week = (math.pow(4, 12) * payload[0] + math.pow(4, 8) * payload[1] + \
-            math.pow(4, 4) * payload[2] + payload[3]) 
-
-        time_of_week = (math.pow(4, 28) * payload[4] + math.pow(4, 24) * payload[5] + \
-            math.pow(4, 20) * payload[6] + math.pow(4,16) * payload[7] + math.pow(4, 12) * \
-            payload[8] + math.pow(4, 8) * payload[9] + math.pow(4, 4) * payload[10] + \
-            payload[11])
-        
-        latitude = (math.pow(4, 4) * payload[12] + payload[13]) / 100
-        longitude = (math.pow(4, 4) * payload[14] + payload[15]) / 100
-        hight = (math.pow(4, 4) * payload[16] + payload[17]) / 100 
-
-        velocity_north = (math.pow(4, 4) * payload[18] + payload[19]) / 100 
-        velocity_east = (math.pow(4, 4) * payload[20] + payload[21]) / 100
-        velocity_up = (math.pow(4, 4) * payload[22] + payload[23]) / 100
-
-        roll = (math.pow(4, 4) * payload[24] + payload[25]) / 100 
-        pitch = (math.pow(4, 4) * payload[26] + payload[27]) / 100
-        head = (math.pow(4, 4) * payload[28] + payload[29]) / 100
-
-        return gps_week, time_of_week, latitude, longitude, hight, velocity_north, velocity_east, velocity_up, roll, pitch, head
+        return tuple(decoders['d1'].decode(payload))
 
     def parse_d2(self, payload):
-        gps_week = (math.pow(4, 12) * payload[0] + math.pow(4, 8) * payload[1] + \
-            math.pow(4, 4) * payload[2] + payload[3]) 
-
-        time_of_week = (math.pow(4, 28) * payload[4] + math.pow(4, 24) * payload[5] + \
-            math.pow(4, 20) * payload[6] + math.pow(4,16) * payload[7] + math.pow(4, 12) * \
-            payload[8] + math.pow(4, 8) * payload[9] + math.pow(4, 4) * payload[10] + \
-            payload[11])
-
-        latitude = (math.pow(4, 4) * payload[12] + payload[13]) / 100 
-        longitude = (math.pow(4, 4) * payload[14] + payload[15]) / 100 
-        hight = (math.pow(4, 4) * payload[16] + payload[17]) / 100
-
-        velocity_north = (math.pow(4, 4) * payload[18] + payload[19]) / 100
-        velocity_east = (math.pow(4, 4) * payload[20] + payload[21]) / 100 
-        velocity_up = (math.pow(4, 4) * payload[22] + payload[23]) /100
-
-        return gps_week, time_of_week, latitude, longitude, hight, velocity_north, velocity_east, velocity_up
+        return tuple(decoders['d2'].decode(payload))
 
     def parse_gN(self, payload):
-        gps_week = (math.pow(4, 12) * payload[0] + math.pow(4, 8) * payload[1] + \
-            math.pow(4, 4) * payload[2] + payload[3]) 
-
-        time_of_week = (math.pow(4, 28) * payload[4] + math.pow(4, 24) * payload[5] + \
-            math.pow(4, 20) * payload[6] + math.pow(4,16) * payload[7] + math.pow(4, 12) * \
-            payload[8] + math.pow(4, 8) * payload[9] + math.pow(4, 4) * payload[10] + \
-            payload[11])
-
-        pos_mode = payload[12]
-        
-        latitude = (math.pow(4, 12) * payload[13] + math.pow(4, 8) * payload[14] + \
-            math.pow(4, 4) * payload[15] + payload[16]) * (8 / math.pow(2, 31))
-
-        longitude = (math.pow(4, 12) * payload[17] + math.pow(4, 8) * payload[18] + \
-            math.pow(4, 4) * payload[19] + payload[20]) * (8 / math.pow(2, 31))
-
-        hight = (math.pow(4, 12) * payload[21] + math.pow(4, 8) * payload[22] + \
-            math.pow(4, 4) * payload[23] + payload[24]) * (8 / math.pow(2, 31)) 
-        
-        num_of_SVs = payload[25]
-
-        hdop = (math.pow(4, 12) * payload[26] + math.pow(4, 8) * payload[27] + \
-            math.pow(4, 4) * payload[28] + payload[29]) * (8 / math.pow(2, 31)) 
-        
-        vdop = (math.pow(4, 12) * payload[30] + math.pow(4, 8) * payload[31] + \
-            math.pow(4, 4) * payload[32] + payload[33]) * (8 / math.pow(2, 31)) 
-
-        tdop = (math.pow(4, 12) * payload[34] + math.pow(4, 8) * payload[35] + \
-            math.pow(4, 4) * payload[36] + payload[37]) * (8 / math.pow(2, 31)) 
-
-        diffage = (math.pow(4,4) * payload[38] + payload[39])
-
-        velocity_north = (math.pow(4,4) * payload[40] + payload[41])
-        velocity_east = (math.pow(4,4) * payload[42] + payload[43])
-        velocity_up = (math.pow(4,4) * payload[44] + payload[45])
-
-        return gps_week, time_of_week, pos_mode, latitude, longitude, hight, num_of_SVs, hdop, vdop, tdop, \
-            diffage, velocity_north, velocity_east, velocity_up
+        return tuple(decoders['gN'].decode(payload))
 
     def parse_sT(self, payload):
-        gps_week = (math.pow(4, 12) * payload[0] + math.pow(4, 8) * payload[1] + \
-            math.pow(4, 4) * payload[2] + payload[3]) 
+        return tuple(decoders['sT'].decode(payload))
 
-        time_of_week = (math.pow(4, 28) * payload[4] + math.pow(4, 24) * payload[5] + \
-            math.pow(4, 20) * payload[6] + math.pow(4,16) * payload[7] + math.pow(4, 12) * \
-            payload[8] + math.pow(4, 8) * payload[9] + math.pow(4, 4) * payload[10] + \
-            payload[11])
-        
-        year = (math.pow(4, 4) * payload[12] + payload[13])
-        month = payload[14]
-        day = payload[15]
-        hour = payload[16]
-        minute = payload[17]
-        sec = payload[18]
-
-        imu_status = int(math.pow(4,12) * payload[19] + math.pow(4, 8) * payload[20] + \
-            math.pow(4, 4) * payload[21] + payload[22])
-
-        imu_temp = (math.pow(4, 12) * payload[23] + math.pow(4, 8) * payload[24] + \
-            math.pow(4, 4) * payload[25] + payload[26])
-        
-        mcu_temp = (math.pow(4, 12) * payload[27] + math.pow(4, 8) * payload[28] + \
-            math.pow(4, 4) * payload[29] + payload[30])
-
-        return  gps_week, time_of_week, year, month, day, hour, minute, sec, imu_status, imu_temp, mcu_temp
-        
     def sync_packet(self, bf, bf_len, preamble):
         idx = -1
         while 1:
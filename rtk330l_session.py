@@ -0,0 +1,135 @@
+'''
+Log all packet types of an RTK330L from one stream.
+Packets are demultiplexed by type, and each type is written to its own columnar table
+(see columnar.py) in a session directory:
+    <session_dir>/gN/, <session_dir>/iN/, <session_dir>/s1/, ...
+All tables share the host_time and seq columns, so packets of different types can be
+matched in time. Each table is flushed on its own cadence: high-rate IMU data in large
+batches, low-rate GNSS data often enough that a crash loses little of it.
+'''
+import os
+import sys
+import time
+import framing
+import columnar
+import link_metrics
+import rtk330l
+
+# seconds between flushes of each table
+flush_interval = {'s1': 1.0,\
+                  's2': 1.0,\
+                  'iN': 1.0,\
+                  'd1': 5.0,\
+                  'd2': 5.0,\
+                  'gN': 5.0,\
+                  'sT': 10.0}
+# a table is also flushed when this many packets are waiting
+flush_rows = 10000
+
+class rtk330l_session:
+    def __init__(self, port, baud=115200, session_dir=None, types=None, log_interval=None):
+        '''
+        Args:
+            port: serial port, or a data file when baud is 0.
+            baud: baud rate, 0 to read a data file.
+            session_dir: output directory. None to create one under ./log_data/.
+            types: packet types to log, None for all types in rtk330l.packet_def.
+            log_interval: print link metrics every log_interval seconds, None to disable.
+        '''
+        self.port = port
+        self.baud = baud
+        self.physical_port = baud > 0
+        if session_dir is None:
+            session_dir = './log_data/rtk330l_' + time.strftime("%Y%m%d_%H%M%S", time.localtime())
+        self.session_dir = session_dir
+        if types is None:
+            types = list(rtk330l.packet_def.keys())
+        self.types = types
+        self.scanner = framing.frame_scanner(types)
+        self.writers = {}
+        for i in types:
+            self.writers[i] = columnar.table_writer(os.path.join(session_dir, i),\
+                                                    rtk330l.decoders[i],\
+                                                    flush_interval.get(i, 1.0), flush_rows)
+        self.seq = 0
+        # frames of a known type but an unexpected length
+        self.bad_length = 0
+        self.metrics = link_metrics.link_metrics(str(port), log_interval)
+
+    def start(self):
+        '''
+        Log until the end of the data file, or until Ctrl-C.
+        '''
+        if self.physical_port:
+            import serial
+            ser = serial.Serial(self.port, self.baud)
+            ser.reset_input_buffer()
+        else:
+            ser = open(self.port, 'rb')
+        print('Logging %s to %s'% (self.port, self.session_dir))
+        try:
+            while True:
+                if self.physical_port:
+                    data = ser.read(max(ser.in_waiting, 1))
+                else:
+                    data = ser.read(1024*1024)
+                    if not data:
+                        break
+                self.add_data(data)
+        except KeyboardInterrupt:
+            pass
+        ser.close()
+        self.close()
+
+    def add_data(self, data, host_time=None):
+        '''
+        Demultiplex new data into the tables.
+        '''
+        if host_time is None:
+            host_time = time.time()
+        scanner = self.scanner
+        crc_fail = scanner.crc_fail
+        discarded = scanner.discarded
+        resync = scanner.resync
+        buf, frames = scanner.feed(data)
+        for offset, pos, packet_type, n, crc_ok in frames:
+            if not crc_ok:
+                continue
+            writer = self.writers[packet_type]
+            if n != writer.decoder.size:
+                self.bad_length += 1
+                continue
+            writer.add(bytes(buf[pos+framing.header_size:pos+framing.header_size+n]),\
+                       host_time, self.seq)
+            self.seq += 1
+            self.metrics.frames_ok += 1
+        metrics = self.metrics
+        metrics.bytes_in += len(data)
+        metrics.crc_fail += scanner.crc_fail - crc_fail
+        metrics.bytes_discarded += scanner.discarded - discarded
+        metrics.resync += scanner.resync - resync
+        metrics.tick()
+
+    def close(self):
+        self.scanner.flush()
+        for writer in self.writers.values():
+            writer.close()
+        print('End of logging, %u packets.'% self.seq)
+        for i in self.types:
+            print('    %s: %u rows, %u flushes'% (i, self.writers[i].rows, self.writers[i].flushes))
+        if self.bad_length:
+            print('    %u packets of unexpected length dropped'% self.bad_length)
+
+if __name__ == "__main__":
+    port = 'COM7'
+    baud = 460800
+    session_dir = None
+    num_of_args = len(sys.argv)
+    if num_of_args > 1:
+        port = sys.argv[1]
+        if num_of_args > 2:
+            baud = int(sys.argv[2])
+            if num_of_args > 3:
+                session_dir = sys.argv[3]
+    session = rtk330l_session(port, baud, session_dir, log_interval=10.0)
+    session.start()
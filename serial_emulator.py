@@ -0,0 +1,410 @@
+'''
+Serial port emulator for load and regression tests without devices.
+Sources generate (time, bytes) blocks:
+    synth_source    valid frames of every packet type of imu38x, rtk330l, openimu (z1) and
+                    ins1000 (nav) at given rates, deterministic for a seed
+    file_source     a recorded capture, paced by the baud rate or by recorded timestamps
+An impairments object corrupts a synthesized stream with CRC errors, dropped bytes,
+partial frames and bursts of noise, also deterministic for a seed.
+A source is served by:
+    fake_serial     in-process replacement of serial.Serial, see patch_serial()
+    pty_port        a pseudo terminal pair, opened by the drivers as a real port (Linux)
+Bytes arrive at the rate of the baud rate (10 bits per byte), in real time, or as fast as
+they are read with realtime=False for throughput benchmarks.
+'''
+import os
+import sys
+import math
+import time
+import heapq
+import random
+import struct
+import argparse
+import threading
+import framing
+import packet_decoder
+import imu38x
+import rtk330l
+import ins1000
+import openimu
+import raw_capture
+
+# device -> packet type -> [frame size, type code]
+devices = {'imu38x': imu38x.packet_def,\
+           'rtk330l': rtk330l.packet_def,\
+           'openimu': {'z1': [openimu.z1_size, bytearray(b'z1')]},\
+           'ins1000': {'nav': [ins1000.nav_size, ins1000.nav_header]}}
+# integer struct codes, for synthesized fields of packets with a schema
+int_codes = 'bBhHiIlLqQ'
+# decoders of the packets with a schema, by (device, packet type)
+decoders = {}
+
+def synth_payload(device, packet_type, i, rng):
+    '''
+    Payload of the i-th frame of a packet type. Integer fields of packets with a schema in
+    packet_decoder count the frames, so counter checks see a continuous stream, and float
+    fields are slow sine waves. Payloads of other packets are random bytes.
+    '''
+    size = devices[device][packet_type][0] - framing.overhead
+    schema = packet_decoder.schema.get(device, {})
+    if packet_type not in schema:
+        return bytes(rng.getrandbits(8) for j in range(size))
+    endian, fields = schema[packet_type]
+    values = []
+    k = 0
+    for name, f, count, scale in fields:
+        if f == 'x':
+            continue
+        for j in range(count):
+            if f in int_codes:
+                bits = 8 * struct.calcsize('<' + f)
+                values.append(i % (1 << (bits - (0 if f.isupper() else 1))))
+            else:
+                values.append(math.sin(0.01 * i + k))
+            k += 1
+    if (device, packet_type) not in decoders:
+        decoders[(device, packet_type)] = packet_decoder.packet_decoder(packet_type, device)
+    return decoders[(device, packet_type)].struct.pack(*values)
+
+def nav_frame(i, rate):
+    '''
+    i-th INS1000 nav frame: header, payload length, payload and Fletcher checksum as
+    checked by ins1000.ins1000.
+    '''
+    t = i / rate
+    payload = bytearray(ins1000.payload_len)
+    q = (math.cos(0.005 * t), 0.0, 0.0, math.sin(0.005 * t))
+    struct.pack_into('<dddf3f4f', payload, 0, t, 31.0 + 1e-6 * t, 121.0, 10.0,\
+                     1.0, 0.0, 0.0, q[0], q[1], q[2], q[3])
+    crc = ins1000.calc_crc(payload)
+    return bytes(ins1000.nav_header) + struct.pack('<H', ins1000.payload_len) + bytes(payload) +\
+           bytes((crc >> 8, crc & 0xff))
+
+def synth_frame(device, packet_type, i, rate, rng):
+    if device == 'ins1000':
+        return nav_frame(i, rate)
+    payload = synth_payload(device, packet_type, i, rng)
+    return framing.build_frame(bytes(devices[device][packet_type][1]), payload)
+
+class impairments:
+    '''
+    Deterministic corruption of frames. Each rate is the probability per frame.
+    '''
+    def __init__(self, crc_rate=0.0, drop_rate=0.0, partial_rate=0.0, burst_rate=0.0,\
+                 burst_len=64, seed=0):
+        '''
+        Args:
+            crc_rate: one byte of the frame after the header is changed, the CRC fails.
+            drop_rate: one byte of the frame is removed.
+            partial_rate: the frame is cut at a random length.
+            burst_rate: a burst of burst_len random bytes is sent before the frame.
+        '''
+        self.rates = {'crc': crc_rate, 'drop': drop_rate, 'partial': partial_rate,\
+                      'burst': burst_rate}
+        self.burst_len = burst_len
+        self.rng = random.Random(seed)
+        self.counts = dict((i, 0) for i in self.rates)
+
+    def apply(self, frame):
+        rng = self.rng
+        frame = bytearray(frame)
+        out = b''
+        if rng.random() < self.rates['burst']:
+            self.counts['burst'] += 1
+            out = bytes(rng.getrandbits(8) for j in range(self.burst_len))
+        if rng.random() < self.rates['crc']:
+            self.counts['crc'] += 1
+            j = rng.randrange(framing.header_size, len(frame))
+            frame[j] ^= 1 << rng.randrange(8)
+        if rng.random() < self.rates['drop']:
+            self.counts['drop'] += 1
+            del frame[rng.randrange(len(frame))]
+        if rng.random() < self.rates['partial']:
+            self.counts['partial'] += 1
+            frame = frame[:rng.randrange(1, len(frame))]
+        return out + bytes(frame)
+
+def synth_source(device, rates, duration=None, impair=None, seed=0):
+    '''
+    Frames of several packet types of a device, in time order.
+    Args:
+        device: key of devices.
+        rates: dict of packet type -> rate, Hz.
+        duration: length of the stream, s. None for an endless stream.
+        impair: optional impairments.
+    Returns:
+        generator of (time, frame bytes).
+    '''
+    rng = random.Random(seed)
+    queue = [(0.0, packet_type, 0) for packet_type in sorted(rates)]
+    heapq.heapify(queue)
+    while queue:
+        t, packet_type, i = heapq.heappop(queue)
+        if duration is not None and t >= duration:
+            continue
+        frame = synth_frame(device, packet_type, i, rates[packet_type], rng)
+        if impair is not None:
+            frame = impair.apply(frame)
+        yield t, frame
+        heapq.heappush(queue, ((i + 1) / rates[packet_type], packet_type, i + 1))
+
+def file_source(file_name, timestamps=None, block_size=4096):
+    '''
+    Blocks of a recorded capture.
+    Args:
+        timestamps: optional sorted (byte offset, time) pairs recorded with the capture.
+            Each block is sent at the time of the last pair at or before its offset, so the
+            original timing is kept. None to send all blocks at time 0, paced by the baud rate.
+    Returns:
+        generator of (time, bytes).
+    '''
+    f = open(file_name, 'rb')
+    offset = 0
+    k = 0
+    t = 0.0
+    while True:
+        data = f.read(block_size)
+        if not data:
+            break
+        if timestamps is not None:
+            # blocks end at the next timestamp, so that each one keeps its time
+            while k < len(timestamps) and timestamps[k][0] <= offset:
+                t = timestamps[k][1]
+                k += 1
+            if k < len(timestamps) and timestamps[k][0] < offset + len(data):
+                n = timestamps[k][0] - offset
+                f.seek(offset + n)
+                data = data[:n]
+        yield t, data
+        offset += len(data)
+    f.close()
+
+def paced(source, baud):
+    '''
+    Arrival time of the end of each block on a serial line of the given baud rate.
+    A block is sent at its time or when the previous block has been sent, whichever is later.
+    Returns:
+        generator of (arrival time, bytes).
+    '''
+    byte_time = 10.0 / baud if baud > 0 else 0.0
+    line_free = 0.0
+    for t, data in source:
+        line_free = max(t, line_free) + len(data) * byte_time
+        yield line_free, data
+
+class fake_serial:
+    '''
+    In-process replacement of serial.Serial serving a source.
+    '''
+    def __init__(self, port=None, baudrate=115200, source=None, realtime=True, timeout=None,\
+                 t0=None, **kwargs):
+        '''
+        Args:
+            source: generator of (time, bytes), see synth_source and file_source.
+            realtime: bytes arrive in real time since the port was opened. If False, all
+                bytes are available at once and in_waiting reports blocks of up to 64 KB.
+            timeout: read timeout in real time mode, s. None to block until size bytes
+                arrive or the source ends.
+            t0: time.perf_counter() of time 0 of the source, None for now. A common t0
+                lets another process know when each byte arrived.
+        '''
+        self.port = port
+        self.baudrate = baudrate
+        self.realtime = realtime
+        self.timeout = timeout
+        self.source = paced(source if source is not None else iter(()), baudrate)
+        self.buf = bytearray()
+        self.next = None            # (arrival time, bytes) not yet arrived
+        self.exhausted = False
+        self.written = bytearray()
+        self.bytes_read = 0
+        self.is_open = True
+        self.t0 = time.perf_counter() if t0 is None else t0
+
+    def isOpen(self):
+        return self.is_open
+
+    def fill(self, now, max_bytes=None):
+        '''
+        Move blocks that arrived by now into the buffer.
+        '''
+        while not self.exhausted and (max_bytes is None or len(self.buf) < max_bytes):
+            if self.next is None:
+                try:
+                    self.next = next(self.source)
+                except StopIteration:
+                    self.exhausted = True
+                    break
+            if self.next[0] > now:
+                break
+            self.buf += self.next[1]
+            self.next = None
+
+    def now(self):
+        return time.perf_counter() - self.t0 if self.realtime else float('inf')
+
+    @property
+    def in_waiting(self):
+        self.fill(self.now(), None if self.realtime else 65536)
+        return len(self.buf)
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.perf_counter() + self.timeout
+        self.fill(self.now(), None if self.realtime else size)
+        while self.realtime and len(self.buf) < size and not self.exhausted:
+            # sleep until the next block arrives, the deadline or 10 ms
+            wait = 0.01
+            if self.next is not None:
+                wait = min(wait, max(self.next[0] - self.now(), 0.0))
+            if deadline is not None:
+                if time.perf_counter() >= deadline:
+                    break
+                wait = min(wait, max(deadline - time.perf_counter(), 0.0))
+            time.sleep(wait)
+            self.fill(self.now())
+        data = bytes(self.buf[:size])
+        del self.buf[:size]
+        self.bytes_read += len(data)
+        return data
+
+    def write(self, data):
+        self.written += data
+        return len(data)
+
+    def reset_input_buffer(self):
+        # without real time nothing has arrived before the first read
+        if self.realtime:
+            self.fill(self.now())
+        self.buf = bytearray()
+
+    def close(self):
+        self.is_open = False
+
+def patch_serial(sources, realtime=True, t0=None):
+    '''
+    Make serial.Serial open fake ports, for the drivers in this process and in child
+    processes forked after the call.
+    Args:
+        sources: dict of port name -> function returning a new source, called when the
+            port is opened. Ports not in sources open real ports.
+        realtime, t0: see fake_serial.
+    Returns:
+        the original serial.Serial, to restore it.
+    '''
+    try:
+        import serial
+    except ImportError:
+        # no pyserial: a module with only the fake port
+        import types
+        serial = types.ModuleType('serial')
+        serial.Serial = None
+        sys.modules['serial'] = serial
+    original = serial.Serial
+    def open_port(port=None, baudrate=9600, *args, **kwargs):
+        if port in sources:
+            return fake_serial(port, baudrate, sources[port](), realtime, kwargs.get('timeout'), t0)
+        return original(port, baudrate, *args, **kwargs)
+    serial.Serial = open_port
+    return original
+
+class pty_port:
+    '''
+    A pseudo terminal pair: the drivers open name as a serial port, a thread writes the
+    source to the other end at its arrival times.
+    '''
+    def __init__(self, source, baud=115200):
+        import pty
+        import tty
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.name = os.ttyname(self.slave)
+        self.source = paced(source, baud)
+        self.bytes_written = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self.name
+
+    def run(self):
+        t0 = time.perf_counter()
+        for t, data in self.source:
+            if not self.running:
+                break
+            wait = t - (time.perf_counter() - t0)
+            if wait > 0:
+                time.sleep(wait)
+            view = memoryview(data)
+            while view:
+                n = os.write(self.master, view)
+                view = view[n:]
+            self.bytes_written += len(data)
+
+    def stop(self):
+        self.running = False
+        self.thread.join(1.0)
+        os.close(self.master)
+        os.close(self.slave)
+
+def parse_rates(text):
+    '''
+    'e2:100,s1:50' -> {'e2': 100.0, 's1': 50.0}
+    '''
+    rates = {}
+    for i in text.split(','):
+        packet_type, rate = i.split(':')
+        rates[packet_type] = float(rate)
+    return rates
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Emulate serial ports of the units.')
+    parser.add_argument('mode', choices=['pty', 'file'],\
+                        help='serve a pseudo terminal, or write the stream to a file')
+    parser.add_argument('source', help='device (imu38x, rtk330l, openimu, ins1000) or a capture')
+    parser.add_argument('rates', nargs='?', default=None,\
+                        help='packet types and rates of a device, for example e2:100,s1:50')
+    parser.add_argument('-b', '--baud', type=int, default=115200)
+    parser.add_argument('-d', '--duration', type=float, default=None, help='stream length, s')
+    parser.add_argument('-o', '--output', default='emulated.bin', help='file of the file mode')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--crc', type=float, default=0.0, help='CRC error rate per frame')
+    parser.add_argument('--drop', type=float, default=0.0, help='dropped byte rate per frame')
+    parser.add_argument('--partial', type=float, default=0.0, help='partial frame rate')
+    parser.add_argument('--burst', type=float, default=0.0, help='noise burst rate per frame')
+    args = parser.parse_args(argv)
+    impair = None
+    if args.crc or args.drop or args.partial or args.burst:
+        impair = impairments(args.crc, args.drop, args.partial, args.burst, seed=args.seed)
+    if args.source in devices:
+        duration = args.duration
+        if args.mode == 'file' and duration is None:
+            duration = 10.0
+        source = synth_source(args.source, parse_rates(args.rates), duration, impair, args.seed)
+    else:
+        # original timing of a capture with host timestamps, see raw_capture.py
+        source = file_source(args.source, raw_capture.timestamps(args.source))
+    if args.mode == 'file':
+        f = open(args.output, 'wb')
+        n = 0
+        for t, data in source:
+            f.write(data)
+            n += len(data)
+        f.close()
+        print('%u bytes written to %s'% (n, args.output))
+    else:
+        port = pty_port(source, args.baud)
+        print('Serving %s at %u baud. Ctrl+C to stop.'% (port.start(), args.baud))
+        try:
+            while port.thread.is_alive():
+                time.sleep(0.2)
+        except KeyboardInterrupt:
+            pass
+        port.stop()
+        print('%u bytes sent'% port.bytes_written)
+    if impair is not None:
+        print('impairments: %s'% impair.counts)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+'''
+UDP telemetry for local dashboards.
+Samples are coalesced into batched datagrams sent at a configurable rate, instead of one
+datagram per sample. A thread of the publisher sends a batch when its interval is over, so the
+last samples are not held back until the next sample is published.
+
+Datagram layout, little endian:
+    header:
+        2 bytes     magic 'OT'
+        1 byte      version
+        1 byte      flags, bit0: values are float32, otherwise float64
+        4 bytes     U4 sequence number of the datagram
+        2 bytes     U2 number of samples in the datagram
+        2 bytes     U2 number of values per sample
+        8 bytes     F8 host time of the first sample, s
+    samples:
+        4 bytes     F4 host time of the sample relative to the first sample, s
+        n values    F4 or F8
+'''
+import sys
+import time
+import socket
+import struct
+import threading
+
+magic = b'OT'
+version = 1
+FLAG_FLOAT32 = 0x01
+header_fmt = struct.Struct('<2sBBIHHd')
+# keep datagrams below a typical Ethernet MTU
+max_datagram = 1400
+
+class telemetry_publisher:
+    def __init__(self, n_fields, address='<broadcast>', port=10600, rate=20.0,\
+                 use_float32=False, ttl=1):
+        '''
+        Args:
+            n_fields: number of values per sample.
+            address: '<broadcast>', a unicast IP, or a multicast group (224.0.0.0/4).
+            port: UDP port.
+            rate: datagrams per second. Samples published in between are batched.
+                A datagram is also sent early when it is full.
+            use_float32: send values as float32 instead of float64.
+            ttl: time to live of multicast datagrams.
+        '''
+        self.n_fields = n_fields
+        self.target = (address, port)
+        self.interval = 1.0 / rate
+        self.flags = FLAG_FLOAT32 if use_float32 else 0
+        self.sample_struct = struct.Struct('<f' + ('f' if use_float32 else 'd') * n_fields)
+        self.max_samples = (max_datagram - header_fmt.size) // self.sample_struct.size
+        if self.max_samples < 1:
+            raise ValueError('%u fields do not fit in a datagram'% n_fields)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if address == '<broadcast>':
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        elif is_multicast(address):
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.seq = 0
+        self.samples = []
+        self.t0 = 0.0
+        self.tsend = time.time()
+        self.datagrams = 0
+        self.published = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def publish(self, values, t=None):
+        '''
+        Add a sample. It is sent with the next datagram.
+        Args:
+            values: n_fields numbers.
+            t: host time of the sample, s. None to use the current time.
+        '''
+        if t is None:
+            t = time.time()
+        with self.cond:
+            if not self.samples:
+                self.t0 = t
+                # the sender thread waits for the end of the interval of this batch
+                self.cond.notify()
+            self.samples.append(self.sample_struct.pack(t - self.t0, *values))
+            self.published += 1
+            if len(self.samples) >= self.max_samples or t - self.tsend >= self.interval:
+                self.send(t)
+
+    def run(self):
+        '''
+        Sender thread: send the batched samples once the interval since the last datagram is
+        over.
+        '''
+        with self.cond:
+            while not self.closed:
+                if not self.samples:
+                    self.cond.wait()
+                    continue
+                remaining = self.tsend + self.interval - time.time()
+                if remaining > 0:
+                    self.cond.wait(remaining)
+                elif self.samples:
+                    self.send()
+
+    def flush(self, t=None):
+        '''
+        Send the batched samples now.
+        '''
+        with self.cond:
+            self.send(t)
+
+    def send(self, t=None):
+        self.tsend = time.time() if t is None else t
+        if not self.samples:
+            return
+        header = header_fmt.pack(magic, version, self.flags, self.seq, len(self.samples),\
+                                 self.n_fields, self.t0)
+        try:
+            self.sock.sendto(header + b''.join(self.samples), self.target)
+        except OSError:
+            # no route to the dashboard, telemetry must not stop logging
+            pass
+        self.seq = (self.seq + 1) & 0xffffffff
+        self.datagrams += 1
+        self.samples = []
+
+    def close(self):
+        with self.cond:
+            self.send()
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        self.sock.close()
+
+class telemetry_receiver:
+    def __init__(self, port=10600, group=None, address=''):
+        '''
+        Args:
+            port: UDP port.
+            group: multicast group to join, None for broadcast or unicast.
+            address: local address to bind.
+        '''
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((address, port))
+        if group is not None:
+            mreq = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton('0.0.0.0'))
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        self.expected_seq = None
+        self.lost = 0
+        self.reordered = 0
+        self.received = 0
+
+    def recv(self, timeout=None):
+        '''
+        Receive a datagram.
+        Args:
+            timeout: seconds to wait, None to block.
+        Returns:
+            list of (t, values) with host time t, empty list on timeout or invalid datagram.
+        '''
+        self.sock.settimeout(timeout)
+        try:
+            data = self.sock.recv(65536)
+        except socket.timeout:
+            return []
+        return self.decode(data)
+
+    def decode(self, data):
+        if len(data) < header_fmt.size:
+            return []
+        tag, ver, flags, seq, n, n_fields, t0 = header_fmt.unpack_from(data, 0)
+        if tag != magic or ver != version:
+            return []
+        d = (seq - self.expected_seq) & 0xffffffff if self.expected_seq is not None else 0
+        if d >= 0x80000000:
+            # late datagram, counted as lost when it was skipped: not lost after all
+            self.reordered += 1
+            self.lost = max(self.lost - 1, 0)
+        else:
+            self.lost += d
+            self.expected_seq = (seq + 1) & 0xffffffff
+        self.received += 1
+        sample_struct = struct.Struct('<f' + ('f' if flags & FLAG_FLOAT32 else 'd') * n_fields)
+        samples = []
+        offset = header_fmt.size
+        for i in range(n):
+            data_i = sample_struct.unpack_from(data, offset)
+            samples.append((t0 + data_i[0], data_i[1:]))
+            offset += sample_struct.size
+        return samples
+
+def is_multicast(address):
+    try:
+        first = int(address.split('.')[0])
+    except ValueError:
+        return False
+    return 224 <= first <= 239
+
+if __name__ == "__main__":
+    # print received telemetry
+    port = 10600
+    group = None
+    num_of_args = len(sys.argv)
+    if num_of_args > 1:
+        port = int(sys.argv[1])
+        if num_of_args > 2:
+            group = sys.argv[2]
+    receiver = telemetry_receiver(port, group)
+    try:
+        while True:
+            for t, values in receiver.recv():
+                print('%.3f '% t + ' '.join('%f'% x for x in values))
+    except KeyboardInterrupt:
+        print('%u datagrams received, %u lost, %u reordered'% (receiver.received, receiver.lost,\
+                                                               receiver.reordered))
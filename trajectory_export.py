@@ -0,0 +1,295 @@
+'''
+Trajectory export to KML and GeoJSON.
+Tracks are appended incrementally: only the fixed closing tags at the end of the file are
+rewritten, so the cost of writing a point does not grow with the length of the drive.
+Points are decimated by distance and heading thresholds while logging, or with
+Douglas-Peucker for a whole trajectory. The latest position is written to a separate small
+file, so a live map can follow the unit without reloading the track.
+'''
+import os
+import time
+import math
+import numpy as np
+
+EARTH_RADIUS = 6378137.0
+
+kml_head = '<?xml version="1.0" encoding="UTF-8"?>\n'\
+           '<kml xmlns="http://www.opengis.net/kml/2.2">\n'\
+           '<Document>\n'\
+           '<Style id="track"><LineStyle><color>%s</color><width>2</width></LineStyle></Style>\n'\
+           '<Placemark><name>%s</name><styleUrl>#track</styleUrl>\n'\
+           '<LineString><tessellate>1</tessellate><altitudeMode>clampToGround</altitudeMode>\n'\
+           '<coordinates>\n'
+kml_tail = '</coordinates>\n</LineString>\n</Placemark>\n</Document>\n</kml>\n'
+kml_point = '<?xml version="1.0" encoding="UTF-8"?>\n'\
+            '<kml xmlns="http://www.opengis.net/kml/2.2">\n'\
+            '<Placemark><name>%s</name>\n'\
+            '<Style><IconStyle><color>%s</color><heading>%.1f</heading>\n'\
+            '<Icon><href>http://maps.google.com/mapfiles/kml/shapes/arrow.png</href></Icon>\n'\
+            '</IconStyle></Style>\n'\
+            '<Point><coordinates>%.9f,%.9f,%.3f</coordinates></Point>\n'\
+            '</Placemark>\n</kml>\n'
+geojson_head = '{"type": "Feature", "properties": {"name": "%s", "color": "%s"},\n'\
+               '"geometry": {"type": "LineString", "coordinates": [\n'
+geojson_tail = '\n]}}\n'
+
+def local_xy(lla, lat0=None):
+    '''
+    North and east position in meters of LLA points (deg, deg, m), flat earth around lat0.
+    Returns:
+        (n, 2) array.
+    '''
+    lla = np.asarray(lla, dtype=np.float64).reshape(-1, 3)
+    if lla.shape[0] == 0:
+        return np.zeros((0, 2))
+    if lat0 is None:
+        lat0 = lla[0, 0] if lla.shape[0] else 0.0
+    k = math.radians(1.0) * EARTH_RADIUS
+    return np.stack(((lla[:, 0] - lla[0, 0]) * k,\
+                     (lla[:, 1] - lla[0, 1]) * k * math.cos(math.radians(lat0))), axis=1)
+
+def douglas_peucker(lla, tolerance=1.0):
+    '''
+    Simplify a trajectory.
+    Args:
+        lla: (n, 3) lat (deg), lon (deg), alt (m).
+        tolerance: maximum horizontal distance of dropped points from the simplified line, m.
+    Returns:
+        sorted indices of the points to keep.
+    '''
+    xy = local_xy(lla)
+    n = xy.shape[0]
+    if n < 3:
+        return np.arange(n)
+    keep = np.zeros((n,), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n-1)]
+    while stack:
+        i0, i1 = stack.pop()
+        if i1 - i0 < 2:
+            continue
+        p = xy[i0+1:i1] - xy[i0]
+        d = xy[i1] - xy[i0]
+        length = math.hypot(d[0], d[1])
+        if length > 0:
+            dist = np.abs(p[:, 0]*d[1] - p[:, 1]*d[0]) / length
+        else:
+            dist = np.hypot(p[:, 0], p[:, 1])
+        j = int(np.argmax(dist))
+        if dist[j] > tolerance:
+            k = i0 + 1 + j
+            keep[k] = True
+            stack.append((i0, k))
+            stack.append((k, i1))
+    return np.flatnonzero(keep)
+
+class decimator:
+    '''
+    Decide point by point whether a point of a live trajectory is kept.
+    '''
+    def __init__(self, distance=10.0, heading=5.0, min_distance=0.5):
+        '''
+        Args:
+            distance: keep a point when it is this far from the last kept point, m.
+            heading: also keep a point when the heading changed this much since the last
+                kept point and it moved at least min_distance, deg.
+            min_distance: points closer than this to the last kept point are dropped, m.
+        '''
+        self.distance = distance
+        self.heading = heading
+        self.min_distance = min_distance
+        self.last = None
+        self.last_heading = 0.0
+        self.kept = 0
+        self.dropped = 0
+
+    def add(self, lla, heading=None):
+        '''
+        Returns:
+            True if the point should be kept.
+        '''
+        if self.last is None:
+            keep = True
+        else:
+            k = math.radians(1.0) * EARTH_RADIUS
+            dn = (lla[0] - self.last[0]) * k
+            de = (lla[1] - self.last[1]) * k * math.cos(math.radians(lla[0]))
+            d = math.hypot(dn, de)
+            keep = d >= self.distance
+            if not keep and heading is not None and d >= self.min_distance:
+                dh = (heading - self.last_heading + 180.0) % 360.0 - 180.0
+                keep = abs(dh) >= self.heading
+        if keep:
+            self.last = (float(lla[0]), float(lla[1]))
+            if heading is not None:
+                self.last_heading = float(heading)
+            self.kept += 1
+        else:
+            self.dropped += 1
+        return keep
+
+class track_file:
+    '''
+    A KML or GeoJSON track file that grows by appending points before its closing tags.
+    '''
+    def __init__(self, file_name, name='track', color='ff0000ff'):
+        '''
+        Args:
+            file_name: .kml or .geojson file, overwritten.
+            name: track name.
+            color: KML color, aabbggrr.
+        '''
+        d = os.path.dirname(file_name)
+        if d and not os.path.exists(d):
+            os.makedirs(d)
+        self.geojson = file_name.lower().endswith('json')
+        if self.geojson:
+            head, self.tail = geojson_head % (name, color), geojson_tail
+        else:
+            head, self.tail = kml_head % (color, name), kml_tail
+        self.f = open(file_name, 'w')
+        self.f.write(head)
+        self.tail_pos = self.f.tell()
+        self.f.write(self.tail)
+        self.f.flush()
+        self.points = 0
+
+    def append(self, lla):
+        '''
+        Append points.
+        Args:
+            lla: (n, 3) or (3,) lat (deg), lon (deg), alt (m).
+        '''
+        lla = np.asarray(lla, dtype=np.float64).reshape(-1, 3)
+        if lla.shape[0] == 0:
+            return
+        if self.geojson:
+            sep = ',\n' if self.points else ''
+            text = sep + ',\n'.join('[%.9f, %.9f, %.3f]'% (p[1], p[0], p[2]) for p in lla)
+        else:
+            text = ''.join('%.9f,%.9f,%.3f\n'% (p[1], p[0], p[2]) for p in lla)
+        self.f.seek(self.tail_pos)
+        self.f.write(text)
+        self.tail_pos = self.f.tell()
+        self.f.write(self.tail)
+        self.f.flush()
+        self.points += lla.shape[0]
+
+    def close(self):
+        self.f.close()
+
+def write_latest(file_name, lla, heading=0.0, name='latest', color='ff0000ff'):
+    '''
+    Write the latest position to a small KML file, replaced atomically so that a viewer
+    never reads a partial file.
+    '''
+    tmp = file_name + '.tmp'
+    f = open(tmp, 'w')
+    f.write(kml_point % (name, color, heading, lla[1], lla[0], lla[2]))
+    f.close()
+    os.replace(tmp, file_name)
+
+class trajectory_writer:
+    '''
+    Live trajectory: decimated track files and a latest position file.
+    Files are <base>.kml, <base>.geojson and <base>_latest.kml.
+    '''
+    def __init__(self, base, color='ff0000ff', formats=('kml', 'geojson'),\
+                 flush_interval=1.0, distance=10.0, heading=5.0):
+        '''
+        Args:
+            base: file name without extension.
+            color: KML color, aabbggrr.
+            formats: track formats to write.
+            flush_interval: kept points and the latest position are written at most this
+                often, s.
+            distance, heading: decimation thresholds, see decimator.
+        '''
+        name = os.path.basename(base)
+        self.name = name
+        self.color = color
+        self.tracks = [track_file(base + '.' + i, name, color) for i in formats]
+        self.latest_file = base + '_latest.kml'
+        self.decimator = decimator(distance, heading)
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.latest = None
+        self.tflush = 0.0
+
+    def add(self, lla, heading=0.0):
+        '''
+        Add a point: lat (deg), lon (deg), alt (m) and heading (deg).
+        '''
+        if lla[0] == 0 and lla[1] == 0:
+            # no position yet
+            return
+        self.latest = (float(lla[0]), float(lla[1]), float(lla[2]), float(heading))
+        if self.decimator.add(lla, heading):
+            self.pending.append(self.latest[0:3])
+        tnow = time.time()
+        if tnow - self.tflush >= self.flush_interval:
+            self.flush(tnow)
+
+    def flush(self, tnow=None):
+        self.tflush = time.time() if tnow is None else tnow
+        if self.pending:
+            for i in self.tracks:
+                i.append(self.pending)
+            self.pending = []
+        if self.latest is not None:
+            write_latest(self.latest_file, self.latest[0:3], self.latest[3], self.name, self.color)
+
+    def close(self):
+        self.flush()
+        for i in self.tracks:
+            i.close()
+
+def write_track(file_name, lla, color='ff0000ff', tolerance=1.0):
+    '''
+    Write a whole trajectory simplified with Douglas-Peucker.
+    Args:
+        file_name: .kml or .geojson file.
+        lla: (n, 3) lat (deg), lon (deg), alt (m).
+        tolerance: Douglas-Peucker tolerance, m. 0 to keep all points.
+    Returns:
+        number of points written.
+    '''
+    lla = np.asarray(lla, dtype=np.float64).reshape(-1, 3)
+    lla = lla[np.isfinite(lla).all(axis=1) & ((lla[:, 0] != 0) | (lla[:, 1] != 0))]
+    if tolerance > 0:
+        lla = lla[douglas_peucker(lla, tolerance)]
+    name = os.path.splitext(os.path.basename(file_name))[0]
+    track = track_file(file_name, name, color)
+    # large batches keep the text formatting fast
+    for i in range(0, lla.shape[0], 10000):
+        track.append(lla[i:i+10000])
+    track.close()
+    return lla.shape[0]
+
+# live writers of gen_kml, by file name
+writers = {}
+
+def gen_kml(file_name, lla, heading, color='ff0000ff'):
+    '''
+    Drop-in replacement of the former kml.dynamic_kml.gen_kml.
+    Args:
+        file_name: .kml file.
+        lla: (3,) the latest position, appended to a live track of file_name,
+            or (n, 3) a whole trajectory, written simplified.
+        heading: heading of the latest position or of each point, deg.
+        color: KML color, aabbggrr.
+    '''
+    lla = np.asarray(lla, dtype=np.float64)
+    if lla.ndim == 2:
+        return write_track(file_name, lla, color)
+    if file_name not in writers:
+        writers[file_name] = trajectory_writer(os.path.splitext(file_name)[0], color, ('kml',))
+    writers[file_name].add(lla, heading)
+
+def close_all():
+    '''
+    Close the live writers of gen_kml.
+    '''
+    for i in writers.values():
+        i.close()
+    writers.clear()
@@ -0,0 +1,131 @@
+'''
+Receive data from several units over multiprocessing connections without blocking on
+any one of them. A unit that stops sending is marked silent, logging continues with
+the other units, and the unit is marked alive again as soon as it sends data.
+'''
+import time
+from multiprocessing.connection import wait
+
+# unit states
+ALIVE = 'alive'
+SILENT = 'silent'
+CLOSED = 'closed'
+
+class unit_mux:
+    def __init__(self, timeout=0.1, silent_timeout=1.0, verbose=True, max_msgs=1000):
+        '''
+        Args:
+            timeout: default time to wait for data in recv(), seconds.
+            silent_timeout: a unit that sends nothing for this long is marked silent, seconds.
+            verbose: print a line when a unit becomes silent, alive again or closed.
+            max_msgs: at most this many messages are read from one unit in one recv().
+        '''
+        self.timeout = timeout
+        self.silent_timeout = silent_timeout
+        self.verbose = verbose
+        self.max_msgs = max_msgs
+        self.names = []         # unit names in the order they are added
+        self.conns = {}         # name -> connection
+        self.by_conn = {}       # connection -> name
+        self.state = {}         # name -> ALIVE/SILENT/CLOSED
+        self.last_time = {}     # name -> time of the latest data
+        self.count = {}         # name -> number of received messages
+        self.tstart = time.time()
+
+    def add(self, name, conn):
+        '''
+        Add a unit.
+        Args:
+            name: unit name, any hashable.
+            conn: receiving end of the unit's Pipe.
+        '''
+        self.names.append(name)
+        self.conns[name] = conn
+        self.by_conn[conn] = name
+        self.state[name] = ALIVE
+        self.last_time[name] = time.time()
+        self.count[name] = 0
+
+    def recv(self, timeout=None):
+        '''
+        Wait until at least one unit has data, then read everything available.
+        Args:
+            timeout: seconds to wait, None to use the default timeout.
+        Returns:
+            list of (name, message). Empty if no data arrived before the timeout.
+            An 'exit' message from a unit marks the unit closed and is also returned.
+        '''
+        if timeout is None:
+            timeout = self.timeout
+        ready = wait([self.conns[i] for i in self.names if self.state[i] != CLOSED], timeout)
+        tnow = time.time()
+        msgs = []
+        for conn in ready:
+            name = self.by_conn[conn]
+            n = 0
+            try:
+                while n < self.max_msgs and conn.poll():
+                    n += 1
+                    msg = conn.recv()
+                    msgs.append((name, msg))
+                    self.count[name] += 1
+                    if isinstance(msg, str) and msg == 'exit':
+                        self.set_state(name, CLOSED)
+                        break
+            except (EOFError, OSError):
+                # the other end of the pipe is closed
+                self.set_state(name, CLOSED)
+                continue
+            if self.state[name] != CLOSED:
+                if self.state[name] == SILENT:
+                    self.set_state(name, ALIVE)
+                self.last_time[name] = tnow
+        self.check_liveness(tnow)
+        return msgs
+
+    def check_liveness(self, tnow=None):
+        '''
+        Mark units that sent nothing for silent_timeout seconds as silent.
+        '''
+        if tnow is None:
+            tnow = time.time()
+        for name in self.names:
+            if self.state[name] == ALIVE and tnow - self.last_time[name] > self.silent_timeout:
+                self.set_state(name, SILENT)
+
+    def set_state(self, name, state):
+        if self.state[name] != state:
+            self.state[name] = state
+            if self.verbose:
+                print('%s is %s (%u messages received, last one %.3f s ago)'% (name, state,\
+                      self.count[name], time.time() - self.last_time[name]))
+
+    def alive(self, name):
+        return self.state[name] == ALIVE
+
+    def all_closed(self):
+        return all(self.state[i] == CLOSED for i in self.names)
+
+    def pace(self, order=None):
+        '''
+        The unit whose samples should trigger a new log line: the first alive unit in order.
+        Args:
+            order: unit names in order of preference, None to use the order they were added.
+        Returns:
+            unit name, None if no unit in order is alive.
+        '''
+        if order is None:
+            order = self.names
+        for name in order:
+            if self.state[name] == ALIVE:
+                return name
+        return None
+
+    def status(self):
+        '''
+        Returns:
+            dict of name -> (state, messages received, seconds since the latest data)
+        '''
+        tnow = time.time()
+        return dict((i, (self.state[i], self.count[i], tnow - self.last_time[i]))\
+                    for i in self.names)